@@ -7,7 +7,6 @@ import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
 import time
-import yfinance as yf
 
 # Get the absolute path of the current file (app.py)
 current_file = Path(__file__).resolve()
@@ -21,8 +20,8 @@ project_root = parent_directory.parent
 # Add the project root to sys.path
 sys.path.append(str(project_root))
 
-from backend_theoretical.MeanVariance import MeanVarianceMethod
-from backend_theoretical.main import main as quantum_main
+from backend_theoretical import MarketData
+from backend_theoretical import SolverClient
 
 # Streamlit app configuration
 st.set_page_config(page_title="Quantum Stock Optimization", layout="wide")
@@ -72,6 +71,7 @@ stocks = st.sidebar.text_input("Enter stock tickers (comma-separated)", "AAPL, G
 start_date = st.sidebar.date_input("Start Date", datetime(2020, 1, 1), min_value=datetime(1900, 1, 1))
 end_date = st.sidebar.date_input("End Date", datetime(2023, 1, 1), min_value=datetime(1900, 1, 1))
 budget = st.sidebar.slider("Budget (number of stocks to include)", min_value=1, max_value=len(stocks.split(','))-1, value=1)
+sweep_budgets = st.sidebar.checkbox("Optimize every budget at once", value=False, help="Solve all budgets with one circuit, so moving the budget slider afterwards needs no new optimization.")
 
 # Prevent users from entering data beyond today's date
 if end_date > date.today():
@@ -81,16 +81,20 @@ if end_date > date.today():
 # Color scheme for charts
 color_map = px.colors.qualitative.Plotly
 
+# Prices and company names are served from the local market-data store and
+# only fetched for dates or tickers it has not seen yet.
+@st.cache_resource
+def get_market_data_store():
+    return MarketData.default_store()
+
+market_data = get_market_data_store()
+
 def get_company_name(ticker):
-    try:
-        company_info = yf.Ticker(ticker).info
-        return company_info.get('longName', ticker)
-    except Exception as e:
-        return ticker
+    return market_data.company_name(ticker)
 def plot_stock_trends(tickers, start_date, end_date):
     for i, ticker in enumerate(tickers):
         try:
-            data = yf.download(ticker, start=start_date, end=end_date)
+            data = market_data.history(ticker, start_date, end_date)
             if data.empty:
                 st.error(f"No data found for {ticker}. It might be an invalid ticker.")
                 continue
@@ -134,6 +138,149 @@ def create_donut_chart(stock_list, selected_stocks, color_map):
     
     return fig
 
+# Optimizations run in the solver service (backend_theoretical/Service.py),
+# which is started here if it is not running yet. It is shared by all
+# sessions and app workers. Identical inputs attach to the job that is already
+# running or finished, and reruns only poll its progress.
+@st.cache_resource
+def get_solver():
+    return SolverClient.connect()
+
+solver = get_solver()
+
+def call_solver(method, *args, **inputs):
+    # The service may have stopped since the client was cached. Only refused
+    # connections are retried, as those requests never reached a service;
+    # the cached client is replaced by one from connect(), which starts the
+    # service again. Jobs of the stopped service are gone.
+    global solver
+    try:
+        return getattr(solver, method)(*args, **inputs)
+    except OSError as e:
+        if not SolverClient.connection_refused(e):
+            raise
+        get_solver.clear()
+        solver = get_solver()
+        return getattr(solver, method)(*args, **inputs)
+
+stage_labels = {
+    "queued": "Waiting for a free optimizer",
+    "data": "Loading price data and computing mean-variance weights",
+    "circuit": "Preparing the QAOA circuit",
+    "build": "Building the QAOA circuit",
+    "transpile": "Transpiling the QAOA circuit",
+    "optimize": "Optimizing angles",
+    "budget": "Optimizing every budget",
+    "done": "Done",
+}
+
+def show_progress(snapshot):
+    details = snapshot["details"]
+    message = stage_labels.get(snapshot["stage"], snapshot["stage"])
+    if snapshot["stage"] == "optimize" and details.get("best_ratio") is not None:
+        message += f" ({details['evaluations']} evaluations, best ratio so far {details['best_ratio']:.3f})"
+    if details.get("simulation_mode"):
+        message += f" on the {details['simulation_mode']} simulator"
+    if snapshot["stage"] == "budget":
+        message += f" (budget {details['budget']} done with ratio {details['best_ratio']:.3f})"
+    st.info(f"{message}... {snapshot['elapsed']:.0f} s")
+
+def show_time_breakdown(instrumentation):
+    # Top-level spans are the stages of the run; counters are shown as-is.
+    stages = {name: span for name, span in instrumentation["spans"].items() if span["top_level"]}
+    if not stages:
+        return
+    st.write("#### Where the Time Went")
+    fig = go.Figure(go.Bar(x=[span["seconds"] for span in stages.values()], y=list(stages.keys()), orientation="h"))
+    fig.update_layout(xaxis_title="Seconds", height=60 + 40 * len(stages), margin=dict(l=0, r=0, b=0, t=0))
+    st.plotly_chart(fig, use_container_width=True, key="time_breakdown")
+    details = dict(instrumentation["counters"])
+    if "statevector.bytes" in instrumentation["maxima"]:
+        details["peak statevector MiB"] = round(instrumentation["maxima"]["statevector.bytes"] / 2**20, 3)
+    if "simulator.estimated_bytes" in instrumentation["maxima"]:
+        details["estimated simulator MiB"] = round(instrumentation["maxima"]["simulator.estimated_bytes"] / 2**20, 3)
+    st.write(details)
+
+def show_results(result, time_taken):
+    stock_list = result["stocks"]
+    optimized_weights = result["optimized_weights"]
+    higher_prob_key_reversed = result["higher_prob_key_reversed"]
+    best_known_solution = result["best_known_solution"]
+    approximation_ratio = result["approximation_ratio"]
+
+    # Display results
+    st.write("### Quantum Optimization Results")
+    st.markdown(f"<span style='color: #00FF00;'>Time taken for optimization: {time_taken:.2f} seconds</span>", unsafe_allow_html=True)
+    st.write("#### Optimized Weights")
+    optimized_weights_dict = {f"{get_company_name(stock)} ({stock})": weight for stock, weight in zip(stock_list, optimized_weights)}
+    st.write(optimized_weights_dict)
+
+    # Convert best_known_solution to a list, handling the n-d array case
+    if isinstance(best_known_solution, np.ndarray):
+        best_known_solution_list = best_known_solution.flatten().tolist()
+    else:
+        st.error(f"Unexpected type for best_known_solution: {type(best_known_solution)}")
+        st.write("Best known solution:", best_known_solution)
+        st.stop()
+
+    quantum_selected_stocks = [stock for i, stock in enumerate(stock_list) if higher_prob_key_reversed[i] == '1']
+    classical_selected_stocks = [stock for i, stock in enumerate(stock_list) if best_known_solution_list[i] == 1]
+
+    st.write("### Quantum Method Results and Visualization")
+    st.write("#### Quantum Method Selected Stocks:")
+    for stock in quantum_selected_stocks:
+        color = color_map[stock_list.index(stock) % len(color_map)]
+        st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
+
+    st.write("#### Quantum Method Visualization")
+    fig_donut_quantum = create_donut_chart(stock_list, quantum_selected_stocks, color_map)
+    st.plotly_chart(fig_donut_quantum, use_container_width=True, key="quantum_donut_1")
+
+    st.write("### Comparison: Quantum vs Classical Method")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.write("#### Quantum Method Selected Stocks:")
+        for stock in quantum_selected_stocks:
+            color = color_map[stock_list.index(stock) % len(color_map)]
+            st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
+        st.write("#### Quantum Method Visualization")
+        fig_donut_quantum = create_donut_chart(stock_list, quantum_selected_stocks, color_map)
+        st.plotly_chart(fig_donut_quantum, use_container_width=True, key="quantum_donut")
+
+    with col2:
+        st.write("#### Classical Method Selected Stocks:")
+        for stock in classical_selected_stocks:
+            color = color_map[stock_list.index(stock) % len(color_map)]
+            st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
+        st.write("#### Classical Method Visualization")
+        fig_donut_classical = create_donut_chart(stock_list, classical_selected_stocks, color_map)
+        st.plotly_chart(fig_donut_classical, use_container_width=True, key="classical_donut")
+
+    if "instrumentation" in result:
+        show_time_breakdown(result["instrumentation"])
+
+    st.write("### Performance Comparison")
+    st.write(f"Approximation ratio: {approximation_ratio}")
+    st.write("The approximation ratio compares the performance of the quantum method to the classical method.")
+    st.write("A ratio closer to 1 indicates that the quantum method's performance is closer to the classical method's performance.")
+
+    # Calculate the difference in selected stocks
+    different_stocks = set(quantum_selected_stocks).symmetric_difference(set(classical_selected_stocks))
+    if different_stocks:
+        st.write("### Differences in Stock Selection")
+        st.write("The following stocks were selected differently by the two methods:")
+
+        for stock in different_stocks:
+            method = "Quantum" if stock in quantum_selected_stocks else "Classical"
+            color = color_map[stock_list.index(stock) % len(color_map)]  # Unified color scheme for the stocks
+            st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock}) ({method})</span>", unsafe_allow_html=True)
+    else:
+        st.write("### Stock Selection Comparison")
+        st.write("Both methods selected the same stocks for the portfolio.")
+
+
 if st.sidebar.button("Optimize Portfolio"):
     # Parse stock input
     stock_list = [s.strip().upper() for s in stocks.split(",")]
@@ -143,96 +290,34 @@ if st.sidebar.button("Optimize Portfolio"):
     elif start_date >= end_date:
         st.error("End date must be after start date.")
     else:
-        # Display loading animation
+        try:
+            if sweep_budgets:
+                job = call_solver("submit", "sweep", stocks=stock_list, start_date=start_date, end_date=end_date)
+            else:
+                job = call_solver("submit", "portfolio", stocks=stock_list, start_date=start_date, end_date=end_date, budget=budget)
+            st.session_state["job_id"] = job["id"]
+            st.session_state["job_is_sweep"] = sweep_budgets
+        except SolverClient.ServiceBusy as e:
+            st.warning(f"The optimizer is busy with other portfolios. Please try again in {e.retry_after} seconds.")
+
+snapshot = call_solver("snapshot", st.session_state.get("job_id"))
+if snapshot is not None:
+    if snapshot["status"] == "failed":
+        st.error(f"Error: {snapshot['error']}")
+    elif snapshot["status"] == "done" and st.session_state.get("job_is_sweep"):
+        # A sweep holds results for every budget; show the one selected now.
+        if budget in snapshot["result"]:
+            show_results(snapshot["result"][budget], snapshot["elapsed"])
+        else:
+            st.warning(f"The budget sweep has no result for a budget of {budget}. Run the optimization again for this portfolio.")
+    elif snapshot["status"] == "done":
+        show_results(snapshot["result"], snapshot["elapsed"])
+    else:
+        # Display loading animation while the job runs, then poll again
         with st.spinner("Quantum particles are optimizing your portfolio..."):
-            try:
-                start_time = time.time()
-                
-                # Perform mean-variance optimization
-                mv_method = MeanVarianceMethod(stock_list, start_date, end_date)
-                optimized_weights = mv_method.weights()
-                
-                # Call the main quantum function
-                higher_prob_key_reversed, higher_prob_key, best_known_solution, approximation_ratio = quantum_main(optimized_weights, budget)
-                
-                end_time = time.time()
-                time_taken = end_time - start_time
-                
-                # Hide historical trends
-                show_trends = False
-                
-                # Display results
-                st.write("### Quantum Optimization Results")
-                st.markdown(f"<span style='color: #00FF00;'>Time taken for optimization: {time_taken:.2f} seconds</span>", unsafe_allow_html=True)
-                st.write("#### Optimized Weights")
-                optimized_weights_dict = {f"{get_company_name(stock)} ({stock})": weight for stock, weight in zip(stock_list, optimized_weights)}
-                st.write(optimized_weights_dict)
-                
-                # Convert best_known_solution to a list, handling the n-d array case
-                if isinstance(best_known_solution, np.ndarray):
-                    best_known_solution_list = best_known_solution.flatten().tolist()
-                else:
-                    st.error(f"Unexpected type for best_known_solution: {type(best_known_solution)}")
-                    st.write("Best known solution:", best_known_solution)
-                    st.stop()
-                
-                quantum_selected_stocks = [stock for i, stock in enumerate(stock_list) if higher_prob_key_reversed[i] == '1']
-                classical_selected_stocks = [stock for i, stock in enumerate(stock_list) if best_known_solution_list[i] == 1]
-                
-                st.write("### Quantum Method Results and Visualization")
-                st.write("#### Quantum Method Selected Stocks:")
-                for stock in quantum_selected_stocks:
-                    color = color_map[stock_list.index(stock) % len(color_map)]
-                    st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
-                
-                st.write("#### Quantum Method Visualization")
-                fig_donut_quantum = create_donut_chart(stock_list, quantum_selected_stocks, color_map)
-                st.plotly_chart(fig_donut_quantum, use_container_width=True, key="quantum_donut_1")
-
-                st.write("### Comparison: Quantum vs Classical Method")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.write("#### Quantum Method Selected Stocks:")
-                    for stock in quantum_selected_stocks:
-                        color = color_map[stock_list.index(stock) % len(color_map)]
-                        st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
-                    st.write("#### Quantum Method Visualization")
-                    fig_donut_quantum = create_donut_chart(stock_list, quantum_selected_stocks, color_map)
-                    st.plotly_chart(fig_donut_quantum, use_container_width=True, key="quantum_donut")
-                
-                with col2:
-                    st.write("#### Classical Method Selected Stocks:")
-                    for stock in classical_selected_stocks:
-                        color = color_map[stock_list.index(stock) % len(color_map)]
-                        st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock})</span>", unsafe_allow_html=True)
-                    st.write("#### Classical Method Visualization")
-                    fig_donut_classical = create_donut_chart(stock_list, classical_selected_stocks, color_map)
-                    st.plotly_chart(fig_donut_classical, use_container_width=True, key="classical_donut")
-
-                st.write("### Performance Comparison")
-                st.write(f"Approximation ratio: {approximation_ratio}")
-                st.write("The approximation ratio compares the performance of the quantum method to the classical method.")
-                st.write("A ratio closer to 1 indicates that the quantum method's performance is closer to the classical method's performance.")
-                
-                # Calculate the difference in selected stocks
-                different_stocks = set(quantum_selected_stocks).symmetric_difference(set(classical_selected_stocks))
-                if different_stocks:
-                    st.write("### Differences in Stock Selection")
-                    st.write("The following stocks were selected differently by the two methods:")
-                    
-                    for stock in different_stocks:
-                        method = "Quantum" if stock in quantum_selected_stocks else "Classical"
-                        color = color_map[stock_list.index(stock) % len(color_map)]  # Unified color scheme for the stocks
-                        st.markdown(f"<span style='background-color: {color}; padding: 5px 10px; border-radius: 20px; margin: 5px;'>{get_company_name(stock)} ({stock}) ({method})</span>", unsafe_allow_html=True)
-                else:
-                    st.write("### Stock Selection Comparison")
-                    st.write("Both methods selected the same stocks for the portfolio.")
-
-            except ValueError as e:
-                st.error(f"Error: {str(e)}")
-                st.stop()
+            show_progress(snapshot)
+            time.sleep(0.5)
+        st.rerun()
 
 # Add some final touches
 st.sidebar.markdown("---")
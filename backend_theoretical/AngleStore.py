@@ -0,0 +1,231 @@
+import atexit
+import contextlib
+import copy
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+import numpy as np
+from .KnapsackMethod import fingerprint
+from . import Instrumentation
+from . import Utilities
+
+try:
+    import fcntl
+except ImportError:
+    # Without file locks concurrent writers still merge, but may race.
+    fcntl = None
+
+store_path = os.environ.get("QAOA_ANGLE_STORE", os.path.join(os.path.expanduser("~"), ".cache", "quantum_core", "angles.json"))
+# Stored problems further than max_distance (in feature space) from a new
+# problem are not used as warm starts; at most neighbours of them are tried.
+neighbours = 3
+max_distance = 0.2
+# Nelder-Mead iterations spent refining a warm start.
+refine_maxiter = 30
+
+def mixer(problem, m):
+    # The spectral simulator optimizes a different mixer, so its angles are
+    # kept apart from those of the walk circuit.
+    return "continuous" if Utilities.spectral_applies(problem, m) else "walk"
+
+def problem_key(problem, p, m):
+    # Values are taken as fractions of their total, as in features(), so a
+    # basket with all values rescaled is the same problem; its angles only
+    # need transfer_angles.
+    values, weights, max_weight = fingerprint(problem)
+    scale = value_scale(problem)
+    key = {"values": [round(v / scale, 12) for v in values], "weights": weights, "max_weight": max_weight, "p": p, "m": m}
+    if mixer(problem, m) != "walk":
+        key["mixer"] = mixer(problem, m)
+    if Utilities.is_apply_noise:
+        key["noise"] = True
+    return json.dumps(key, sort_keys=True)
+
+def features(problem):
+    # Values as fractions of their total, and the budget as a fraction of the
+    # total weight.
+    values = np.asarray(problem.values, dtype=float)
+    scale = np.abs(values).sum() or 1.0
+    return np.append(values / scale, problem.max_weight / max(sum(problem.weights), 1e-12))
+
+def value_scale(problem):
+    return float(np.abs(np.asarray(problem.values, dtype=float)).sum()) or 1.0
+
+def transfer_angles(angles, from_scale, to_scale):
+    # The cost layer applies a phase gamma * value, so the optimal gammas of
+    # a problem with all values scaled by s are the original ones divided by s.
+    angles = np.array(angles, dtype=float)
+    angles[0::2] *= from_scale / to_scale
+    return angles
+
+STATS = ("exact_hits", "neighbour_hits", "misses", "evaluations_saved")
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@contextlib.contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class AngleStore:
+    # Optimized angles of solved problems in one JSON file, with running hit
+    # statistics. Entries are keyed by the problem, up to a scale of its
+    # values, and depth. Several processes may share the file: writes re-read
+    # it under a file lock and merge in what this store added since, so none
+    # of them loses the others' entries. A read-only store never writes; what it adds is left in added
+    # and pending for its owner to merge into a writable store.
+    def __init__(self, path, entries=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        content = _read(path) if entries is None else {"entries": entries}
+        self.entries = content.get("entries", {})
+        self.stats = {**dict.fromkeys(STATS, 0), **content.get("stats", {})}
+        self.added = {}
+        self.pending = dict.fromkeys(STATS, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return AngleStore(self.path, copy.deepcopy(self.entries), read_only=True)
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with _file_lock(self.path):
+            content = _read(self.path)
+            entries = {**content.get("entries", {}), **self.added}
+            stats = {name: content.get("stats", {}).get(name, 0) + self.pending[name] for name in STATS}
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"entries": entries, "stats": stats}, f)
+            os.replace(tmp_path, self.path)
+        self.entries, self.stats = entries, stats
+        self.added = {}
+        self.pending = dict.fromkeys(STATS, 0)
+
+    def flush(self):
+        # Hit statistics alone do not rewrite the file; they go out with the
+        # next entry, or here.
+        with self._lock:
+            if not self.read_only and (self.added or any(self.pending.values())):
+                self._save()
+
+    def lookup(self, problem, p, m):
+        return self.entries.get(problem_key(problem, p, m))
+
+    def nearest(self, problem, p, m, k=neighbours):
+        target = features(problem)
+        candidates = []
+        for entry in self.entries.values():
+            if entry["N"] != problem.N or entry["p"] != p or entry["m"] != m or entry.get("mixer", "walk") != mixer(problem, m) or entry.get("noise", False) != Utilities.is_apply_noise:
+                continue
+            distance = float(np.linalg.norm(np.asarray(entry["features"]) - target))
+            if distance <= max_distance:
+                candidates.append((distance, entry))
+        candidates.sort(key=lambda candidate: candidate[0])
+        return candidates[:k]
+
+    def add(self, problem, p, m, angles, value, evaluations, refined_from=None):
+        # evaluations are those the angles took. Refined entries also carry
+        # the evaluations of the full search they started from, which is what
+        # a later hit on them saves.
+        entry = {
+            "N": problem.N,
+            "p": p,
+            "m": m,
+            "mixer": mixer(problem, m),
+            "noise": Utilities.is_apply_noise,
+            "features": features(problem).tolist(),
+            "scale": value_scale(problem),
+            "angles": np.asarray(angles, dtype=float).tolist(),
+            "value": value,
+            "evaluations": evaluations,
+        }
+        if refined_from is not None:
+            entry.update(refined=True, search_evaluations=refined_from.get("search_evaluations", refined_from["evaluations"]))
+        self.merge({problem_key(problem, p, m): entry})
+
+    def merge(self, entries, stats=None):
+        with self._lock:
+            # A read-only store keeps serving the entries it was made with.
+            if not self.read_only:
+                self.entries.update(entries)
+            self.added.update(entries)
+            for name, count in (stats or {}).items():
+                self.stats[name] += count
+                self.pending[name] += count
+            if entries and not self.read_only:
+                self._save()
+
+    def record(self, outcome, evaluations_saved=0):
+        evaluations_saved = max(int(evaluations_saved), 0)
+        with self._lock:
+            for name, count in ((outcome, 1), ("evaluations_saved", evaluations_saved)):
+                self.stats[name] += count
+                self.pending[name] += count
+        Instrumentation.count(f"angle_store.{outcome}")
+
+    def take_added(self):
+        # What a read-only store collected since the last call.
+        with self._lock:
+            added, pending = self.added, self.pending
+            self.added, self.pending = {}, dict.fromkeys(STATS, 0)
+            return added, pending
+
+    def summary(self):
+        lookups = self.stats["exact_hits"] + self.stats["neighbour_hits"] + self.stats["misses"]
+        hits = self.stats["exact_hits"] + self.stats["neighbour_hits"]
+        return {**self.stats, "entries": len(self.entries), "hit_rate": hits / lookups if lookups else 0.0}
+
+@lru_cache(maxsize=None)
+def _store(path):
+    store = AngleStore(path)
+    atexit.register(store.flush)
+    return store
+
+def default_store():
+    return _store(store_path)
+
+def find_angles(circuit, problem, store=None, method="shgo", seed=None, progress=None):
+    # Exact hits are returned without evaluating anything. Otherwise the
+    # angles of the nearest stored problems, rescaled to this problem's
+    # values, only get a short local refinement; problems with no neighbours
+    # fall back to the global search. Every new result is stored.
+    store = default_store() if store is None else store
+    p, m = circuit.p, circuit.m
+    entry = store.lookup(problem, p, m)
+    if entry is not None:
+        # Refined entries are hits too; they save the search they refined.
+        store.record("exact_hits", entry.get("search_evaluations", entry["evaluations"]))
+        return transfer_angles(entry["angles"], entry["scale"], value_scale(problem))
+    candidates = store.nearest(problem, p, m)
+    report = {}
+    if candidates:
+        scale = value_scale(problem)
+        initial_angles = [transfer_angles(entry["angles"], entry["scale"], scale) for __, entry in candidates]
+        angles = Utilities.find_optimal_angles(circuit, problem, initial_angles=initial_angles, report=report, progress=progress, maxiter=refine_maxiter)
+        # The saving is measured against the global search that produced the
+        # nearest neighbour's angles.
+        nearest = candidates[0][1]
+        store.record("neighbour_hits", nearest.get("search_evaluations", nearest["evaluations"]) - report["evaluations"])
+    else:
+        angles = Utilities.find_optimal_angles(circuit, problem, method=method, seed=seed, report=report, progress=progress)
+        store.record("misses")
+        nearest = None
+    value = Utilities.get_expectation_value(circuit, problem, angles)
+    store.add(problem, p, m, angles, value, report["evaluations"], refined_from=nearest)
+    return angles
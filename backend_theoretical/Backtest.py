@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+from . import Instrumentation
+from . import KnapsackMethod
+from . import MarketData
+
+# Daily returns per estimation window, and trading days between rebalances.
+window = 252
+step = 21
+# Trading days per year, as pypfopt annualizes with.
+frequency = 252
+# Bounds on each min-volatility weight, as in EfficientFrontier. Unbounded
+# weights have a closed form; bounded ones are solved per date, starting from
+# the previous date's weights.
+weight_bounds = (None, None)
+# The rolling sums are recomputed from the window itself this often, so
+# rounding errors of the incremental updates do not pile up.
+refresh_every = 50
+# EfficientFrontier.clean_weights defaults.
+cutoff = 1e-4
+rounding = 5
+
+def daily_returns(prices):
+    # As pypfopt's CovarianceShrinkage: simple returns, missing ones as zero.
+    return np.nan_to_num(prices.pct_change().dropna(how="all").to_numpy(dtype=float))
+
+def rebalance_ends(num_returns):
+    # End (exclusive) of the returns window of every rebalance date. The
+    # window ending at e covers the prices at rows e - window to e.
+    return np.arange(window, num_returns + 1, step)
+
+class RollingMoments:
+    # Sums over a window of returns x of x_i, x_i x_j, x_i^2 x_j and
+    # x_i^2 x_j^2: all Ledoit-Wolf needs. Sliding the window adds the rows that
+    # enter it and subtracts those that leave, instead of summing it again.
+    def __init__(self, returns):
+        self.returns = returns
+        self.reset()
+
+    def reset(self):
+        num_assets = self.returns.shape[1]
+        self.start = self.end = 0
+        self.sum = np.zeros(num_assets)
+        self.cross = np.zeros((num_assets, num_assets))
+        self.cubic = np.zeros((num_assets, num_assets))
+        self.quartic = np.zeros((num_assets, num_assets))
+
+    def _update(self, rows, sign):
+        squares = rows ** 2
+        self.sum += sign * rows.sum(axis=0)
+        self.cross += sign * rows.T @ rows
+        self.cubic += sign * squares.T @ rows
+        self.quartic += sign * squares.T @ squares
+
+    def move_to(self, start, end, exact=False):
+        if exact or start >= self.end:
+            self.reset()
+            self._update(self.returns[start:end], 1)
+        else:
+            self._update(self.returns[self.end:end], 1)
+            self._update(self.returns[self.start:start], -1)
+        self.start, self.end = start, end
+
+def rolling_moments(returns, ends):
+    # The moments of every window, stacked along a first axis of len(ends).
+    moments = RollingMoments(returns)
+    stacked = {name: [] for name in ("sum", "cross", "cubic", "quartic")}
+    for i, end in enumerate(ends):
+        moments.move_to(end - window, end, exact=i % refresh_every == 0)
+        for name, values in stacked.items():
+            values.append(getattr(moments, name).copy())
+    return {name: np.array(values) for name, values in stacked.items()}
+
+def ledoit_wolf(moments, n):
+    # sklearn's ledoit_wolf (the constant variance target pypfopt uses), for
+    # all windows at once. Its sums over the centred returns are expanded into
+    # the raw moments: sum_k (x_ki - m_i)^2 (x_kj - m_j)^2 summed over i, j is
+    # quartic - 4 m.cubic + 2 sum(x^2) |m|^2 + 4 m.cross.m - 3 n |m|^4.
+    mean = moments["sum"] / n
+    num_assets = mean.shape[1]
+    emp_cov = moments["cross"] / n - mean[:, :, None] * mean[:, None, :]
+    variances = np.diagonal(emp_cov, axis1=1, axis2=2)
+    mu = variances.sum(axis=1) / num_assets
+    squared_mean = (mean ** 2).sum(axis=1)
+    beta_ = (
+        moments["quartic"].sum(axis=(1, 2))
+        - 4 * np.einsum("dij,dj->d", moments["cubic"], mean)
+        + 2 * np.diagonal(moments["cross"], axis1=1, axis2=2).sum(axis=1) * squared_mean
+        + 4 * np.einsum("dij,di,dj->d", moments["cross"], mean, mean)
+        - 3 * n * squared_mean ** 2
+    )
+    delta_ = (emp_cov ** 2).sum(axis=(1, 2))
+    beta = (beta_ / n - delta_) / (num_assets * n)
+    delta = (delta_ - 2 * mu * variances.sum(axis=1) + num_assets * mu ** 2) / num_assets
+    beta = np.minimum(beta, delta)
+    shrinkage = np.divide(beta, delta, out=np.zeros_like(beta), where=beta != 0)
+    shrunk = (1 - shrinkage)[:, None, None] * emp_cov + (shrinkage * mu)[:, None, None] * np.eye(num_assets)
+    return shrunk * frequency, shrinkage
+
+def _bounded_min_volatility(cov, initial):
+    from scipy.optimize import minimize
+    lower, upper = weight_bounds
+    bounds = [(lower, upper)] * len(initial)
+    initial = np.clip(initial, lower if lower is not None else -np.inf, upper if upper is not None else np.inf)
+    result = minimize(
+        lambda w: (w @ cov @ w, 2 * cov @ w),
+        initial, jac=True, method="SLSQP", bounds=bounds, options={"ftol": 1e-12, "maxiter": 500},
+        constraints=[{"type": "eq", "fun": lambda w: w.sum() - 1, "jac": lambda w: np.ones_like(w)}],
+    )
+    return result.x, result.nit
+
+def min_volatility(covariances):
+    # Minimum variance weights summing to one, for every window.
+    num_assets = covariances.shape[1]
+    if weight_bounds == (None, None):
+        weights = np.linalg.solve(covariances, np.ones((len(covariances), num_assets, 1)))[:, :, 0]
+        return weights / weights.sum(axis=1, keepdims=True)
+    weights = np.empty((len(covariances), num_assets))
+    previous = np.full(num_assets, 1 / num_assets)
+    for i, cov in enumerate(covariances):
+        previous, iterations = _bounded_min_volatility(cov, previous)
+        weights[i] = previous
+        Instrumentation.count("backtest.solver_iterations", iterations)
+    return weights
+
+def clean_weights(weights):
+    weights = np.where(np.abs(weights) < cutoff, 0, weights)
+    return np.round(weights, rounding)
+
+@Instrumentation.timed("backtest.covariance")
+def window_weights(prices):
+    # Cleaned min-volatility weights of every rebalance date, as
+    # MeanVarianceMethod.weights would give for each window on its own.
+    returns = daily_returns(prices)
+    ends = rebalance_ends(len(returns))
+    if not len(ends):
+        raise ValueError(f"{len(returns)} daily returns do not fill one window of {window}")
+    covariances, shrinkage = ledoit_wolf(rolling_moments(returns, ends), window)
+    return ends, clean_weights(min_volatility(covariances)), shrinkage
+
+def select(values, budget, selector, p, m):
+    # The knapsack stage for one date: which stocks to hold, and the
+    # approximation ratio of the QAOA distribution when QAOA picked them.
+    problem = KnapsackMethod.KnapsackProblem(list(values), [1] * len(values), budget)
+    if selector == "classical":
+        return KnapsackMethod.classical_solutions(problem)[0], None
+    from .main import solve
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = solve(problem, p, m)
+    selection = np.array([int(bit) for bit in result["higher_prob_key_reversed"]])
+    return selection, result["approximation_ratio"]
+
+def run_backtest(prices, budget=None, selector="qaoa", p=1, m=5, progress=None):
+    # Rebalances every step trading days once a full window of returns is
+    # available, holding the selected stocks in equal parts until the next
+    # rebalance (or the last price).
+    stocks = list(prices.columns)
+    budget = len(stocks) // 2 if budget is None else budget
+    ends, weights, shrinkage = window_weights(prices)
+    values = prices.to_numpy(dtype=float)
+    rows = []
+    growth = 1.0
+    with Instrumentation.span("backtest.selection"):
+        for i, end in enumerate(ends):
+            selection, ratio = select(weights[i], budget, selector, p, m)
+            held = np.flatnonzero(selection)
+            following = min(end + step, len(prices) - 1)
+            period_return = float(np.nanmean(values[following, held] / values[end, held] - 1)) if len(held) and following > end else 0.0
+            growth *= 1 + period_return
+            rows.append({
+                "date": prices.index[end],
+                "window_start": prices.index[end - window],
+                "weights": weights[i].tolist(),
+                "shrinkage": float(shrinkage[i]),
+                "selection": [stocks[j] for j in held],
+                "approximation_ratio": ratio,
+                "period_return": period_return,
+                "growth": growth,
+            })
+            if progress is not None:
+                progress(i + 1, len(ends), rows[-1])
+    return pd.DataFrame(rows).set_index("date")
+
+def backtest(stocks, start_date, end_date, store=None, **options):
+    store = store or MarketData.default_store()
+    with Instrumentation.span("market_data"):
+        prices = store.prices(list(stocks), start_date, end_date)
+    invalid_tickers = set(stocks) - set(prices.columns)
+    if invalid_tickers:
+        raise ValueError(f"Invalid tickers: {', '.join(invalid_tickers)}")
+    return run_backtest(prices[list(stocks)], **options)
+
+def main():
+    global window, step
+    parser = argparse.ArgumentParser(description="Rolling-window backtest of the min-volatility and knapsack selection pipeline.")
+    parser.add_argument("stocks", help="Comma separated tickers.")
+    parser.add_argument("start")
+    parser.add_argument("end")
+    parser.add_argument("--budget", type=int)
+    parser.add_argument("--window", type=int, default=window)
+    parser.add_argument("--step", type=int, default=step)
+    parser.add_argument("--selector", default="qaoa", choices=["qaoa", "classical"])
+    parser.add_argument("--simulator", default="choice_space", choices=["aer", "choice_space", "spectral"])
+    parser.add_argument("-p", type=int, default=1)
+    parser.add_argument("-m", type=int, default=5)
+    parser.add_argument("--output", help="Write the per-date results to this CSV file.")
+    args = parser.parse_args()
+
+    from . import Utilities
+    Utilities.simulator = args.simulator
+    window, step = args.window, args.step
+    def progress(done, total, row):
+        print(f"[{done}/{total}] {row['date']:%Y-%m-%d}: {', '.join(row['selection']) or '-'} ({row['period_return']:+.2%})", flush=True)
+    results = backtest(args.stocks.split(","), args.start, args.end, budget=args.budget, selector=args.selector, p=args.p, m=args.m, progress=progress)
+    print(f"Growth over {len(results)} rebalances: {results['growth'].iloc[-1]:.4f}")
+    if args.output:
+        results.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .Jobs import job_key
+
+# Fields a job may set, and their defaults. A job gives either stocks with a
+# date window, whose minimum-volatility weights become the knapsack values,
+# or the values directly.
+DEFAULTS = {
+    "stocks": None,
+    "start": None,
+    "end": None,
+    "values": None,
+    "weights": None,
+    "budget": None,
+    "p": 1,
+    "m": 5,
+    "method": "shgo",
+    "simulator": "aer",
+}
+
+def expand_manifest(manifest):
+    # A manifest is a list of jobs, or a dict with optional "defaults", an
+    # explicit "jobs" list and a "grid" of field -> list of values whose
+    # cartesian product is added as further jobs.
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+    defaults = {**DEFAULTS, **manifest.get("defaults", {})}
+    jobs = [{**defaults, **job} for job in manifest.get("jobs", [])]
+    grid = manifest.get("grid")
+    if grid:
+        fields = list(grid)
+        for combination in itertools.product(*(grid[field] for field in fields)):
+            jobs.append({**defaults, **dict(zip(fields, combination))})
+    for job in jobs:
+        unknown = set(job) - set(DEFAULTS) - {"id"}
+        if unknown:
+            raise ValueError(f"Unknown job fields {sorted(unknown)} in {job}")
+        if job["values"] is None and not (job["stocks"] and job["start"] and job["end"]):
+            raise ValueError(f"Job needs either values or stocks, start and end: {job}")
+        # Ids are a fingerprint of the inputs unless given, so the same job in
+        # a later run of the manifest is recognised as done.
+        job.setdefault("id", job_key(**{field: job[field] for field in DEFAULTS})[:16])
+    ids = [job["id"] for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Job ids in the manifest are not unique")
+    return jobs
+
+def load_manifest(path):
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            return expand_manifest([json.loads(line) for line in f if line.strip()])
+        return expand_manifest(json.load(f))
+
+def completed_ids(output_path):
+    # Ids of jobs already in the output. A line cut short by a crash is
+    # dropped from the file, so appending starts on a fresh line.
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, "rb+") as f:
+        content = f.read()
+        complete = content.rfind(b"\n") + 1
+        if complete < len(content):
+            f.truncate(complete)
+        for line in content[:complete].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "done":
+                done.add(record["id"])
+    return done
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+_angle_store = None
+
+def _initialize_worker(quiet, angle_store_path=None, angle_entries=None):
+    global _angle_store
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    if angle_store_path is not None:
+        from . import AngleStore
+        _angle_store = AngleStore.AngleStore(angle_store_path, angle_entries, read_only=True)
+
+def run_job(job):
+    # Runs in a worker process. Price data and transpiled circuits come from
+    # the on-disk caches that every worker shares. Angles come from the
+    # snapshot of the angle store taken when the pool started, so a job does
+    # not depend on which others happened to finish first; the angles it
+    # adds go back to the parent in the record.
+    from . import AngleStore, Instrumentation, KnapsackMethod, Utilities
+    from .main import solve
+    start = time.perf_counter()
+    record = {"id": job["id"], "job": job}
+    angle_store = _angle_store or AngleStore.default_store().snapshot()
+    try:
+        with Instrumentation.recording() as recording:
+            Utilities.simulator = job["simulator"]
+            values = job["values"]
+            if values is None:
+                from .MeanVariance import MeanVarianceMethod
+                values = MeanVarianceMethod(list(job["stocks"]), job["start"], job["end"]).weights()
+            weights = job["weights"] or [1] * len(values)
+            budget = job["budget"] if job["budget"] is not None else len(values) // 2
+            problem = KnapsackMethod.KnapsackProblem(list(values), list(weights), budget)
+            result = solve(problem, job["p"], job["m"], method=job["method"], angle_store=angle_store)
+        record.update(status="done", values=list(values), result=result, instrumentation=recording.summary())
+    except Exception as e:
+        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+    record["recording"] = recording.export()
+    angle_entries, angle_stats = angle_store.take_added()
+    record["angle_store"] = {"entries": angle_entries, "stats": angle_stats}
+    record.update(seconds=time.perf_counter() - start, finished=time.time(), worker=os.getpid())
+    return record
+
+def prefetch_prices(jobs):
+    # Fills the market-data store once per basket and window before the pool
+    # starts, so workers only read the stored files.
+    from . import MarketData
+    store = MarketData.default_store()
+    windows = {(tuple(job["stocks"]), job["start"], job["end"]) for job in jobs if job["values"] is None}
+    for stocks, start, end in sorted(windows):
+        store.prices(list(stocks), start, end)
+
+def run(jobs, output_path, workers=None, quiet=True, progress=None):
+    # Results are appended to output_path as each job finishes, one JSON
+    # object per line. Jobs already recorded as done there are skipped, so an
+    # interrupted run continues where it stopped when started again.
+    done = completed_ids(output_path)
+    pending = [job for job in jobs if job["id"] not in done]
+    summary = {"jobs": len(jobs), "skipped": len(jobs) - len(pending), "done": 0, "failed": 0}
+    if not pending:
+        return summary
+    prefetch_prices(pending)
+    from . import AngleStore, Instrumentation
+    angle_store = AngleStore.default_store()
+    snapshot = angle_store.snapshot()
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers or os.cpu_count(), len(pending))
+    initargs = (quiet, snapshot.path, snapshot.entries)
+    with open(output_path, "a") as output, ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_initialize_worker, initargs=initargs) as pool:
+        futures = [pool.submit(run_job, job) for job in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            added = record.pop("angle_store")
+            angle_store.merge(added["entries"], added["stats"])
+            Instrumentation.merge(record.pop("recording"))
+            output.write(json.dumps(record, default=_to_json) + "\n")
+            output.flush()
+            os.fsync(output.fileno())
+            summary[record["status"]] += 1
+            if progress is not None:
+                progress(record, summary)
+    angle_store.flush()
+    return summary
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.string()),
+        ("status", pa.string()),
+        ("error", pa.string()),
+        ("job", pa.string()),
+        ("values", pa.list_(pa.float64())),
+        ("p", pa.int64()),
+        ("m", pa.int64()),
+        ("approximation_ratio", pa.float64()),
+        ("higher_prob_key", pa.string()),
+        ("top_probability", pa.float64()),
+        ("simulation_mode", pa.string()),
+        ("angles", pa.string()),
+        ("probabilities", pa.string()),
+        ("instrumentation", pa.string()),
+        ("seconds", pa.float64()),
+        ("finished", pa.float64()),
+        ("worker", pa.int64()),
+    ])
+
+def to_parquet(output_path, parquet_path):
+    # One row per job: a job retried after a failure keeps its last record.
+    # Nested fields are stored as JSON strings.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    records = {}
+    with open(output_path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records.pop(record["id"], None)
+                records[record["id"]] = record
+    schema = parquet_schema()
+    rows = []
+    for record in records.values():
+        result = record.get("result") or {}
+        row = {**record, **{key: result.get(key) for key in ("p", "m", "approximation_ratio", "higher_prob_key", "top_probability", "simulation_mode")}}
+        for key, value in (("job", record.get("job")), ("instrumentation", record.get("instrumentation")), ("angles", result.get("angles")), ("probabilities", result.get("probabilities"))):
+            row[key] = None if value is None else json.dumps(value)
+        rows.append({name: row.get(name) for name in schema.names})
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), parquet_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every job of a manifest across a process pool, appending results to a JSON lines file.")
+    parser.add_argument("manifest", help="JSON (list of jobs, or defaults/jobs/grid) or JSON lines file of jobs.")
+    parser.add_argument("output", help="JSON lines file the results are appended to. Jobs already done in it are skipped.")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--parquet", help="Also write the results as a Parquet table to this file.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the output of the workers.")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    def progress(record, summary):
+        outcome = f"ratio {record['result']['approximation_ratio']:.3f}" if record["status"] == "done" else record["error"]
+        print(f"[{summary['done'] + summary['failed']}/{len(jobs) - summary['skipped']}] {record['id']} {record['status']} in {record['seconds']:.1f} s: {outcome}", flush=True)
+    summary = run(jobs, args.output, workers=args.workers, quiet=not args.verbose, progress=progress)
+    print(f"{summary['done']} done, {summary['failed']} failed, {summary['skipped']} already done")
+    if args.parquet:
+        to_parquet(args.output, args.parquet)
+
+
+if __name__ == "__main__":
+    main()
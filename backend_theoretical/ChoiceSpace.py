@@ -0,0 +1,175 @@
+import math
+import numpy as np
+from .KnapsackMethod import KnapsackProblem
+from . import Instrumentation
+
+def register_layout(problem: KnapsackProblem):
+    n = math.floor(math.log2(problem.total_weight)) + 1
+    c = math.floor(math.log2(problem.max_weight)) + 1
+    if c == n:
+        n += 1
+    # The oracle adds the offset 2^c - C - 1 to the total weight; the register
+    # must hold that sum, or heavy choices wrap around into the feasible range.
+    n = max(n, int(problem.total_weight + 2**c - problem.max_weight - 1).bit_length())
+    return n, c
+
+def sweep_register_layout(problem: KnapsackProblem):
+    # Registers of a budget-sweep circuit for every budget up to
+    # problem.max_weight. The offset 2^c - C - 1 grows as the budget C
+    # shrinks, up to 2^c - 1, so the weight register is widened until
+    # total_weight + 2^c - 1 fits and the sum never wraps around.
+    n, c = register_layout(problem)
+    return max(n, int(problem.total_weight + 2**c - 1).bit_length()), c
+
+# The functions below take an optional (n, c) layout for circuits whose
+# registers were sized for another budget, as in a budget sweep.
+def oracle_offset(problem: KnapsackProblem, layout=None):
+    n, c = layout or register_layout(problem)
+    return 2**c - problem.max_weight - 1
+
+def codes_weight(codes, weights):
+    total = np.zeros(len(codes), dtype=np.asarray(weights).dtype)
+    for i, weight in enumerate(weights):
+        total += ((codes >> i) & 1) * weight
+    return total
+
+def oracle_feasible(total_weight, problem: KnapsackProblem, layout=None):
+    # FbsOracle adds w0 into an n-qubit register and checks that every bit
+    # from c upwards is zero, so the sum wraps around modulo 2^n.
+    n, c = layout or register_layout(problem)
+    return (total_weight + oracle_offset(problem, layout)) % 2**n < 2**c
+
+def oracle_windows(problem: KnapsackProblem, layout=None):
+    # Total weights the oracle accepts: [k 2^n - w0, k 2^n - w0 + 2^c - 1].
+    n, c = layout or register_layout(problem)
+    w0 = oracle_offset(problem, layout)
+    windows = []
+    for k in range((problem.total_weight + w0) // 2**n + 1):
+        lo, hi = k * 2**n - w0, k * 2**n - w0 + 2**c - 1
+        if hi >= 0 and lo <= problem.total_weight:
+            windows.append((max(lo, 0), hi))
+    return windows
+
+def feasible_codes(problem: KnapsackProblem, layout=None):
+    weights = np.asarray(problem.weights)
+    if (weights < 0).any():
+        codes = np.arange(2**problem.N, dtype=np.int64)
+        return codes[oracle_feasible(codes_weight(codes, weights), problem, layout)]
+    # Grow choices item by item, keeping only partial choices whose total can
+    # still land in one of the accepted weight windows.
+    windows = oracle_windows(problem, layout)
+    remaining = np.concatenate([np.cumsum(weights[::-1])[::-1][1:], [0]])
+    codes = np.zeros(1, dtype=np.int64)
+    totals = np.zeros(1, dtype=weights.dtype)
+    for i, weight in enumerate(weights):
+        codes = np.concatenate([codes, codes | (1 << i)])
+        totals = np.concatenate([totals, totals + weight])
+        keep = np.zeros(len(codes), dtype=bool)
+        for lo, hi in windows:
+            keep |= (totals <= hi) & (totals + remaining[i] >= lo)
+        codes, totals = codes[keep], totals[keep]
+    return np.sort(codes)
+
+class ChoiceSpaceCircuit:
+    # What the choice-space simulator needs to know about a QuantumWalkQAOA
+    # (depth, register layout and angle ranges), without building it in qiskit.
+    def __init__(self, problem: KnapsackProblem, p: int, m: int, budget_sweep=False):
+        self.problem = problem
+        self.p = p
+        self.m = m
+        self.oracle_layout = sweep_register_layout(problem) if budget_sweep else register_layout(problem)
+        self.offset_parameter = None
+        self.offset = None
+
+    def beta_range(self):
+        return 0, self.m * math.pi
+
+    @staticmethod
+    def gamma_range():
+        return 0, 2 * math.pi
+
+class ChoiceSpaceSimulator:
+    # Simulates QuantumWalkQAOA on the choice register alone. The weight and
+    # flag qubits are always uncomputed back to zero, so the Dephase layer is a
+    # diagonal phase and each SQQW step is an RX rotation between x and its
+    # j-th neighbour whenever the oracle marks both as feasible.
+    def __init__(self, problem: KnapsackProblem, m: int, subspace=True, layout=None):
+        self.problem = problem
+        self.m = m
+        N = problem.N
+        if subspace:
+            self.states = feasible_codes(problem, layout)
+            feasible = np.ones(len(self.states), dtype=bool)
+        else:
+            self.states = np.arange(2**N, dtype=np.int64)
+            feasible = oracle_feasible(codes_weight(self.states, problem.weights), problem, layout)
+        self.values = codes_weight(self.states, np.asarray(problem.values, dtype=float))
+        self.pairs = []
+        for j in range(N):
+            neighbors = self.states ^ (1 << j)
+            index = np.minimum(np.searchsorted(self.states, neighbors), len(self.states) - 1)
+            paired = (self.states[index] == neighbors) & feasible & feasible[index]
+            lower = paired & ((self.states >> j) & 1 == 0)
+            self.pairs.append((np.flatnonzero(lower), index[lower]))
+        self.initial_index = int(np.searchsorted(self.states, 0))
+
+    def statevectors(self, angles_batch):
+        # One row of angles per candidate; all candidates evolve together.
+        angles_batch = np.atleast_2d(np.asarray(angles_batch, dtype=float))
+        psi = np.zeros((len(angles_batch), len(self.states)), dtype=complex)
+        psi[:, self.initial_index] = 1
+        for gamma, beta in zip(angles_batch[:, 0::2].T, angles_batch[:, 1::2].T):
+            psi *= np.exp(-1j * np.outer(gamma, self.values))
+            cos = np.cos(beta / self.m)[:, None]
+            sin = np.sin(beta / self.m)[:, None]
+            for __ in range(self.m):
+                for lower, upper in self.pairs:
+                    a, b = psi[:, lower], psi[:, upper]
+                    psi[:, lower] = cos * a - 1j * sin * b
+                    psi[:, upper] = cos * b - 1j * sin * a
+        Instrumentation.count("simulator.calls", len(angles_batch))
+        Instrumentation.observe_max("statevector.bytes", psi.nbytes)
+        return psi
+
+    def expectation_and_gradient(self, angles):
+        # Adjoint-state gradient: run the circuit forward once, then walk the
+        # layers backwards, undoing each one on the state and on lambda = V psi.
+        # Every layer is exp(-i theta G), which contributes 2 Im <lambda|G|psi>.
+        angles = np.asarray(angles, dtype=float)
+        psi = self.statevector(angles)
+        energy = float(np.dot(np.abs(psi) ** 2, self.values))
+        lam = self.values * psi
+        gradient = np.zeros(len(angles))
+        for layer in reversed(range(len(angles) // 2)):
+            gamma, beta = angles[2 * layer], angles[2 * layer + 1]
+            cos, sin = np.cos(beta / self.m), np.sin(beta / self.m)
+            for __ in range(self.m):
+                for lower, upper in reversed(self.pairs):
+                    overlap = np.vdot(lam[lower], psi[upper]) + np.vdot(lam[upper], psi[lower])
+                    gradient[2 * layer + 1] += 2 * overlap.imag / self.m
+                    for vector in (psi, lam):
+                        a, b = vector[lower], vector[upper]
+                        vector[lower] = cos * a + 1j * sin * b
+                        vector[upper] = cos * b + 1j * sin * a
+            gradient[2 * layer] = 2 * np.vdot(lam, self.values * psi).imag
+            phase = np.exp(1j * gamma * self.values)
+            psi *= phase
+            lam *= phase
+        return energy, gradient
+
+    def statevector(self, angles):
+        return self.statevectors([angles])[0]
+
+    def state_probabilities(self, angles):
+        return np.abs(self.statevector(angles)) ** 2
+
+    def probabilities(self, angles):
+        probs = np.zeros(2**self.problem.N)
+        probs[self.states] = self.state_probabilities(angles)
+        return probs
+
+    def expectation_value(self, angles):
+        return float(np.dot(self.state_probabilities(angles), self.values))
+
+    def expectation_values(self, angles_batch):
+        return (np.abs(self.statevectors(angles_batch)) ** 2) @ self.values
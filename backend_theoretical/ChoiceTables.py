@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+import numpy as np
+
+# Value, weight and feasibility of every choice of a problem, indexed by the
+# choice's code (bit i set when item i is chosen). Tables of at least
+# disk_min_choices entries are also written to cache_dir and read back
+# memory-mapped, so later runs and other processes share them.
+cache_dir = os.environ.get("QAOA_CHOICE_TABLES", os.path.join(os.path.expanduser("~"), ".cache", "quantum_core", "tables"))
+disk_min_choices = 2**16
+# Least recently used problems are removed beyond this size on disk.
+disk_limit_bytes = 1024 * 2**20
+# The exact enumeration tabulates problems of up to max_choices choices;
+# larger ones (non-integer weights above ExactSolver.enumeration_limit) are
+# searched through chunks in bounded memory.
+max_choices = 2**22
+
+def subset_sums(items, dtype):
+    # Sum of the items chosen by every code. Codes 2^i .. 2^(i+1) - 1 are the
+    # codes below 2^i with item i added, so every entry is one addition to an
+    # entry that differs from it in a single bit, as in a Gray code walk.
+    table = np.zeros(1 << len(items), dtype=dtype)
+    for i, item in enumerate(items):
+        half = 1 << i
+        np.add(table[:half], item, out=table[half:2 * half])
+    return table
+
+def weight_dtype(weights):
+    # The smallest integer type that holds every total of integer weights.
+    if not all(float(w).is_integer() for w in weights):
+        return np.dtype(np.float64)
+    low = int(sum(w for w in weights if w < 0))
+    high = int(sum(w for w in weights if w > 0))
+    return np.promote_types(np.min_scalar_type(low), np.min_scalar_type(high))
+
+def chunks(values, weights, chunk_bits=16):
+    # Values and weights of consecutive blocks of 2^chunk_bits codes, for
+    # problems too large for full tables. Within a block only the low bits
+    # change, so every block is one table of the low items plus a constant.
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=weight_dtype(weights))
+    low = min(chunk_bits, len(values))
+    low_values, low_weights = subset_sums(values[:low], values.dtype), subset_sums(weights[:low], weights.dtype)
+    for high in range(2**(len(values) - low)):
+        bits = (high >> np.arange(len(values) - low)) & 1
+        yield high << low, low_values + bits @ values[low:], low_weights + bits @ weights[low:]
+
+def codes_from_choices(choices):
+    choices = np.atleast_2d(choices)
+    return choices.astype(np.int64) @ (1 << np.arange(choices.shape[1], dtype=np.int64))
+
+def _key(values, weights):
+    return hashlib.sha256(json.dumps({"values": values, "weights": weights}).encode()).hexdigest()
+
+def _save(path, array):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def _evict():
+    # Least recently used problems go first; loads refresh the directory's
+    # mtime. Tables still memory-mapped elsewhere stay readable once removed.
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            size = sum(table.stat().st_size for table in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        except FileNotFoundError:
+            continue
+    total = sum(size for __, size, __ in entries)
+    for __, size, path in sorted(entries):
+        if total <= disk_limit_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+class ChoiceTables:
+    def __init__(self, values: tuple, weights: tuple):
+        self.N = len(values)
+        self.directory = os.path.join(cache_dir, _key(values, weights)) if 2**self.N >= disk_min_choices else None
+        self.values = self._table("values", lambda: subset_sums(np.asarray(values, dtype=float), np.float64))
+        self.weights = self._table("weights", lambda: subset_sums(np.asarray(weights, dtype=weight_dtype(weights)), weight_dtype(weights)))
+        self._feasible = {}
+        self._lock = threading.Lock()
+
+    def _table(self, name, build):
+        if self.directory is None:
+            table = build()
+            table.setflags(write=False)
+            return table
+        path = os.path.join(self.directory, f"{name}.npy")
+        try:
+            table = np.load(path, mmap_mode="r")
+            os.utime(self.directory)
+            return table
+        except (OSError, ValueError):
+            os.makedirs(self.directory, exist_ok=True)
+            _save(path, build())
+            table = np.load(path, mmap_mode="r")
+            _evict()
+            return table
+
+    def feasible(self, max_weight):
+        with self._lock:
+            if max_weight not in self._feasible:
+                self._feasible[max_weight] = self._table(f"feasible_{max_weight}", lambda: self.weights <= max_weight)
+            return self._feasible[max_weight]
+
+    def feasible_codes(self, max_weight):
+        # The compact index of the feasible choices: their codes, in order.
+        return np.flatnonzero(self.feasible(max_weight))
+
+@lru_cache(maxsize=32)
+def tables(values: tuple, weights: tuple):
+    return ChoiceTables(values, weights)
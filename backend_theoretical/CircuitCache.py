@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+import qiskit
+import qiskit_aer
+from qiskit import transpile
+from .KnapsackMethod import KnapsackProblem, fingerprint
+from .QAOA import QuantumWalkQAOA
+from .ChoiceSpace import register_layout, sweep_register_layout
+from . import Circuits
+from . import Instrumentation
+
+cache_dir = os.environ.get("QAOA_CIRCUIT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "quantum_core", "circuits"))
+memory_size = 16
+disk_limit_bytes = 512 * 2**20
+# Bump when the construction of QuantumWalkQAOA changes.
+circuit_version = 3
+
+stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+_memory = OrderedDict()
+_lock = threading.Lock()
+_build_locks = {}
+
+class TranspiledQAOA:
+    # A transpiled QuantumWalkQAOA together with the parameters needed to bind
+    # it. Parameters are looked up by name, because a circuit loaded from disk
+    # does not share Parameter objects with a freshly built one.
+    def __init__(self, circuit, problem: KnapsackProblem, p: int, m: int):
+        self.circuit = circuit
+        self.problem = problem
+        self.p = p
+        self.m = m
+        parameters = {parameter.name: parameter for parameter in circuit.parameters}
+        sweep = "budget_offset" in parameters
+        self.oracle_layout = sweep_register_layout(problem) if sweep else register_layout(problem)
+        self.betas = [parameters[f"beta{i}"] for i in range(p)]
+        self.gammas = [parameters[f"gamma{i}"] for i in range(p)]
+        self.offset_parameter = parameters.get("budget_offset")
+        self.offset = None
+        # Variants of circuit for each kind of run, see Simulators.run_circuit.
+        self.run_circuits = {}
+
+    beta_range = QuantumWalkQAOA.beta_range
+    gamma_range = staticmethod(QuantumWalkQAOA.gamma_range)
+
+def cache_key(problem: KnapsackProblem, p, m, backend, budget_sweep=False):
+    values, weights, max_weight = fingerprint(problem)
+    description = {
+        "values": values,
+        "weights": weights,
+        "max_weight": max_weight,
+        "p": p,
+        "m": m,
+        "backend": backend.name,
+        "qiskit": qiskit.__version__,
+        "qiskit_aer": qiskit_aer.__version__,
+        "circuit_version": circuit_version,
+        "cancel_oracle_pairs": Circuits.cancel_oracle_pairs,
+        "budget_sweep": budget_sweep,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+def _path(key):
+    return os.path.join(cache_dir, f"{key}.pkl")
+
+def _remember(key, transpiled_circuit):
+    _memory[key] = transpiled_circuit
+    _memory.move_to_end(key)
+    while len(_memory) > memory_size:
+        _memory.popitem(last=False)
+
+def _load(key):
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            circuit = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    os.utime(path)
+    return circuit
+
+def _store(key, circuit):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(circuit, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, _path(key))
+    _evict()
+
+def _evict():
+    # Least recently used entries go first; hits refresh the file's mtime.
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".pkl"):
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for __, size, __ in entries)
+    for __, size, path in sorted(entries):
+        if total <= disk_limit_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        stats["evictions"] += 1
+
+def _cached(key):
+    with _lock:
+        if key in _memory:
+            stats["memory_hits"] += 1
+            Instrumentation.count("circuit_cache.memory_hits")
+            _memory.move_to_end(key)
+            return _memory[key]
+    return None
+
+def get_transpiled(problem: KnapsackProblem, p: int, m: int, backend, circuit=None, progress=None, budget_sweep=False):
+    # progress, if given, is told about the "build" and "transpile" stages of
+    # a cache miss.
+    key = cache_key(problem, p, m, backend, budget_sweep)
+    result = _cached(key)
+    if result is not None:
+        return result
+    with _lock:
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+    # Concurrent requests for the same circuit wait for a single build.
+    with build_lock:
+        result = _cached(key)
+        if result is not None:
+            return result
+        transpiled_circuit = _load(key)
+        if transpiled_circuit is not None:
+            stats["disk_hits"] += 1
+            Instrumentation.count("circuit_cache.disk_hits")
+        else:
+            stats["misses"] += 1
+            Instrumentation.count("circuit_cache.misses")
+            if circuit is None:
+                if progress is not None:
+                    progress("build")
+                circuit = QuantumWalkQAOA(problem, p=p, m=m, budget_sweep=budget_sweep)
+            if progress is not None:
+                progress("transpile")
+            with Instrumentation.span("circuit.transpile"):
+                transpiled_circuit = transpile(circuit, backend)
+            _store(key, transpiled_circuit)
+        result = TranspiledQAOA(transpiled_circuit, problem, p, m)
+        with _lock:
+            _remember(key, result)
+            _build_locks.pop(key, None)
+        return result
+
+def clear_memory():
+    with _lock:
+        _memory.clear()
+
+def cache_info():
+    return {**stats, "memory_entries": len(_memory), "cache_dir": cache_dir}
@@ -1,12 +1,13 @@
-from functools import partial
+from functools import partial, lru_cache
 from itertools import product
 from fractions import Fraction
 from qiskit import QuantumRegister, ClassicalRegister, QuantumCircuit
 from qiskit import Aer, transpile, execute
-from qiskit.circuit import Parameter
+from qiskit.circuit import Parameter, Instruction
 import numpy as np
 import math
 from .KnapsackMethod import KnapsackProblem
+from . import Instrumentation
 
 class QFT(QuantumCircuit):
     def __init__(self, register):
@@ -38,54 +39,240 @@ class Addition(QuantumCircuit):  # Changed from Add to Addition
                 m = l - k
                 phase_gate(2 * np.pi / 2**m, qubit)
 
+class OffsetAddition(QuantumCircuit):
+    # Adds a parameterized constant in the Fourier basis. Qubit idx picks up
+    # 2 pi n / 2^(idx + 1), which is what Addition applies bit by bit.
+    def __init__(self, register, n):
+        super().__init__(register, name="Add offset")
+        for idx, qubit in enumerate(register):
+            super().p(2 * np.pi * n / 2**(idx + 1), qubit)
+
+# In budget-sweep circuits the oracle offset w0 = 2^c - C - 1 is this
+# parameter instead of a constant, so one circuit serves every budget C that
+# fits in c bits.
+budget_offset = Parameter("budget_offset")
+
+# Oracle, walk and mixer sub-circuits depend only on the weights, the budget
+# and the register layout, so they are built once and shared between walk
+# steps, mixers and QAOA layers.
+use_construction_cache = True
+# Consecutive walk steps end and start with the same oracle on the same flag,
+# and the oracle is its own inverse, so mixers are built with such adjacent
+# pairs removed (see cancel_inverse_pairs).
+cancel_oracle_pairs = True
+# Operations that are their own inverse, so two of them back to back on the
+# same qubits (and with the same parameters) are the identity. FbsOracle with
+# clean_up is, as it uncomputes the weight register around a single mcx.
+INVOLUTIONS = frozenset({"x", "cx", "ccx", "mcx", "h", "U_v"})
+
+@lru_cache(maxsize=64)
+def _cached_qft(n):
+    qft = QFT(QuantumRegister(n, name="weight"))
+    return qft.to_instruction(), qft.inverse().to_instruction()
+
+@lru_cache(maxsize=256)
+def _cached_adder(n, weight, controlled):
+    weight_reg = QuantumRegister(n, name="weight")
+    if weight is budget_offset:
+        return OffsetAddition(weight_reg, weight).to_instruction()
+    control = [*QuantumRegister(1, name="control")] if controlled else None
+    return Addition(weight_reg, weight, control=control).to_instruction()
+
+def weight_sum_circuit(choice_reg, weight_reg, weights, w0):
+    n = len(weight_reg)
+    if use_construction_cache:
+        qft, qft_inverse = _cached_qft(n)
+    else:
+        qft_circuit = QFT(weight_reg)
+        qft, qft_inverse = qft_circuit.to_instruction(), qft_circuit.inverse().to_instruction()
+    subcirc = QuantumCircuit(choice_reg, weight_reg, name="weight_sum")
+    subcirc.append(qft, weight_reg)
+    for qubit, weight in zip(choice_reg, weights):
+        if use_construction_cache:
+            adder = _cached_adder(n, weight, True)
+        else:
+            adder = Addition(weight_reg, weight, control=[qubit]).to_instruction()  # Changed from Add to Addition
+        subcirc.append(adder, [*weight_reg, qubit])
+    if use_construction_cache:
+        adder = _cached_adder(n, w0, False)
+    elif w0 is budget_offset:
+        adder = OffsetAddition(weight_reg, w0).to_instruction()
+    else:
+        adder = Addition(weight_reg, w0).to_instruction()  # Changed from Add to Addition
+    subcirc.append(adder, weight_reg)
+    subcirc.append(qft_inverse, weight_reg)
+    return subcirc
+
+@lru_cache(maxsize=64)
+def _cached_weight_sum(weights, w0, N, n):
+    subcirc = weight_sum_circuit(QuantumRegister(N, name="choice"), QuantumRegister(n, name="weight"), weights, w0)
+    return subcirc.to_instruction(), subcirc.inverse().to_instruction()
+
+def _layout_key(problem, choice_reg, weight_reg, sweep=False):
+    weights = tuple(np.asarray(problem.weights).tolist())
+    return weights, np.asarray(problem.max_weight).item(), len(choice_reg), len(weight_reg), sweep
+
+def _layout_registers(N, n):
+    choice_reg = QuantumRegister(N, name="choice")
+    weight_reg = QuantumRegister(n, name="weight")
+    flag_regs = [QuantumRegister(1, name="v(x)"), QuantumRegister(1, name="v(n_j(x))"), QuantumRegister(1, name="v_j(x)")]
+    return choice_reg, weight_reg, flag_regs
+
+def _layout_problem(weights, max_weight):
+    return KnapsackProblem([0] * len(weights), list(weights), max_weight)
+
+@lru_cache(maxsize=64)
+def _cached_oracle(weights, max_weight, N, n, sweep):
+    Instrumentation.count("construction_cache.misses")
+    choice_reg, weight_reg, flag_regs = _layout_registers(N, n)
+    oracle = FbsOracle(choice_reg, weight_reg, flag_regs[0], _layout_problem(weights, max_weight), sweep=sweep)
+    return oracle.to_instruction()
+
+@lru_cache(maxsize=64)
+def _cached_mixer(weights, max_weight, N, n, sweep, cancel, m):
+    Instrumentation.count("construction_cache.misses")
+    choice_reg, weight_reg, flag_regs = _layout_registers(N, n)
+    mixer = QWMixer(choice_reg, weight_reg, flag_regs, _layout_problem(weights, max_weight), m, sweep=sweep)
+    if cancel:
+        mixer = cancel_inverse_pairs(inline_walk_steps(mixer))
+    return mixer
+
+def walk_mixer(choice_reg, weight_reg, flag_regs, problem: KnapsackProblem, m: int, sweep=False):
+    if use_construction_cache:
+        return _cached_mixer(*_layout_key(problem, choice_reg, weight_reg, sweep), cancel_oracle_pairs, m)
+    mixer = QWMixer(choice_reg, weight_reg, flag_regs, problem, m, sweep=sweep)
+    if cancel_oracle_pairs:
+        mixer = cancel_inverse_pairs(inline_walk_steps(mixer))
+    return mixer
+
+def inline_walk_steps(circuit):
+    # Replaces every walk step by its definition, leaving the oracles inside
+    # as single instructions, so that instructions of neighbouring steps
+    # become adjacent.
+    inlined = circuit.copy_empty_like()
+    inlined.beta = getattr(circuit, "beta", None)
+    for instruction in circuit.data:
+        if not instruction.operation.name.startswith("SQQW_"):
+            inlined.append(instruction)
+            continue
+        definition = instruction.operation.definition
+        for inner in definition.data:
+            qubits = [instruction.qubits[definition.find_bit(qubit).index] for qubit in inner.qubits]
+            inlined.append(inner.operation, qubits)
+    return inlined
+
+def _same_operation(a, b):
+    return a.operation.name == b.operation.name and list(a.operation.params) == list(b.operation.params)
+
+def cancel_inverse_pairs(circuit, involutions=INVOLUTIONS):
+    # Removes pairs of identical involutions on the same qubits with nothing
+    # in between on any of those qubits. Qubits keep a stack of the kept
+    # instructions acting on them, so cancellations cascade: removing a pair
+    # can make the instructions around it adjacent.
+    kept = []
+    stacks = {qubit: [] for qubit in circuit.qubits}
+    for instruction in circuit.data:
+        qubits = instruction.qubits
+        if instruction.operation.name in involutions and not instruction.clbits and stacks[qubits[0]]:
+            previous = stacks[qubits[0]][-1]
+            candidate = kept[previous]
+            if candidate is not None and candidate.qubits == qubits and _same_operation(candidate, instruction) and all(stacks[qubit] and stacks[qubit][-1] == previous for qubit in qubits):
+                kept[previous] = None
+                for qubit in qubits:
+                    stacks[qubit].pop()
+                continue
+        for qubit in qubits:
+            stacks[qubit].append(len(kept))
+        kept.append(instruction)
+    cancelled = circuit.copy_empty_like()
+    cancelled.beta = getattr(circuit, "beta", None)
+    for instruction in kept:
+        if instruction is not None:
+            cancelled.append(instruction)
+    Instrumentation.count("peephole.cancelled", len(circuit.data) - len(cancelled.data))
+    return cancelled
+
+def clear_construction_cache():
+    for cached in (_cached_qft, _cached_adder, _cached_weight_sum, _cached_oracle, _cached_mixer):
+        cached.cache_clear()
+
 class FbsOracle(QuantumCircuit):  # Changed from FeasibilityOracle to FbsOracle
-    def __init__(self, choice_reg, weight_reg, flag_qubit, problem, clean_up=True):
+    def __init__(self, choice_reg, weight_reg, flag_qubit, problem, clean_up=True, sweep=False):
+        # With sweep, problem.max_weight is the largest budget of the sweep and
+        # only fixes c; the actual budget is bound through budget_offset.
         c = math.floor(math.log2(problem.max_weight)) + 1
-        w0 = 2**c - problem.max_weight - 1
-        subcirc = QuantumCircuit(choice_reg, weight_reg, name="")
-        qft = QFT(weight_reg)
-        subcirc.append(qft.to_instruction(), weight_reg)
-        for qubit, weight in zip(choice_reg, problem.weights):
-            adder = Addition(weight_reg, weight, control=[qubit]).to_instruction()  # Changed from Add to Addition
-            subcirc.append(adder, [*weight_reg, qubit])
-        adder = Addition(weight_reg, w0)  # Changed from Add to Addition
-        subcirc.append(adder.to_instruction(), weight_reg)
-        subcirc.append(qft.inverse().to_instruction(), weight_reg)
+        w0 = budget_offset if sweep else 2**c - problem.max_weight - 1
+        if use_construction_cache:
+            weights = tuple(np.asarray(problem.weights).tolist())
+            weight_sum, weight_sum_inverse = _cached_weight_sum(weights, w0, len(choice_reg), len(weight_reg))
+        else:
+            subcirc = weight_sum_circuit(choice_reg, weight_reg, problem.weights, w0)
+            weight_sum, weight_sum_inverse = subcirc.to_instruction(), subcirc.inverse().to_instruction()
         super().__init__(choice_reg, weight_reg, flag_qubit, name="U_v")
-        super().append(subcirc.to_instruction(), [*choice_reg, *weight_reg])
+        super().append(weight_sum, [*choice_reg, *weight_reg])
         super().x(weight_reg[c:])
         super().mcx(weight_reg[c:], flag_qubit)
         super().x(weight_reg[c:])
         if clean_up:
-            super().append(subcirc.inverse().to_instruction(), [*choice_reg, *weight_reg])
+            super().append(weight_sum_inverse, [*choice_reg, *weight_reg])
 
 class SQQW(QuantumCircuit):  # Changed from SingleQubitQuantumWalk to SQQW
-    def __init__(self, choice_reg, weight_reg, flag_regs, problem: KnapsackProblem, j: int):
+    def __init__(self, choice_reg, weight_reg, flag_regs, problem: KnapsackProblem, j: int, beta=None, sweep=False):
         flag_x, flag_neighbor, flag_both = flag_regs
-        self.beta = Parameter("beta")
+        self.beta = Parameter("beta") if beta is None else beta
         super().__init__(choice_reg, weight_reg, *flag_regs, name=f"SQQW_{j=}")
-        feasibility_oracle = FbsOracle(choice_reg, weight_reg, flag_x, problem)  # Changed class name here
-        super().append(feasibility_oracle.to_instruction(), [*choice_reg, *weight_reg, flag_x])
+        if use_construction_cache:
+            oracle = _cached_oracle(*_layout_key(problem, choice_reg, weight_reg, sweep))
+        else:
+            oracle = FbsOracle(choice_reg, weight_reg, flag_x, problem, sweep=sweep).to_instruction()  # Changed class name here
+        super().append(oracle, [*choice_reg, *weight_reg, flag_x])
         super().x(choice_reg[j])
-        super().append(feasibility_oracle.to_instruction(), [*choice_reg, *weight_reg, flag_neighbor])
+        super().append(oracle, [*choice_reg, *weight_reg, flag_neighbor])
         super().x(choice_reg[j])
         super().ccx(flag_x, flag_neighbor, flag_both)
         super().crx(2 * self.beta, flag_both, choice_reg[j])
         super().ccx(flag_x, flag_neighbor, flag_both)
         super().x(choice_reg[j])
-        super().append(feasibility_oracle.to_instruction(), [*choice_reg, *weight_reg, flag_neighbor])
+        super().append(oracle, [*choice_reg, *weight_reg, flag_neighbor])
         super().x(choice_reg[j])
-        super().append(feasibility_oracle.to_instruction(), [*choice_reg, *weight_reg, flag_x])
+        super().append(oracle, [*choice_reg, *weight_reg, flag_x])
         
+class WalkStep(Instruction):
+    # SQQW as a parameterized instruction. Its definition is only built when
+    # the circuit is decomposed, so copying and binding it while the QAOA
+    # circuit is assembled does not deep-copy the oracles inside.
+    def __init__(self, layout_key, j, beta):
+        weights, max_weight, N, n, sweep = layout_key
+        params = [beta, budget_offset] if sweep else [beta]
+        super().__init__(f"SQQW_{j=}", N + n + 3, 0, params)
+        self.layout_key = layout_key
+        self.j = j
+
+    def _define(self):
+        weights, max_weight, N, n, sweep = self.layout_key
+        choice_reg, weight_reg, flag_regs = _layout_registers(N, n)
+        problem = _layout_problem(weights, max_weight)
+        definition = SQQW(choice_reg, weight_reg, flag_regs, problem, self.j, beta=self.params[0], sweep=sweep)
+        if sweep:
+            definition = definition.assign_parameters({budget_offset: self.params[1]})
+        self.definition = definition
+
 class QWMixer(QuantumCircuit):
-    def __init__(self, choice_reg, weight_reg, flag_regs, problem: KnapsackProblem, m: int):
+    def __init__(self, choice_reg, weight_reg, flag_regs, problem: KnapsackProblem, m: int, sweep=False):
         flag_x, flag_neighbor, flag_both = flag_regs
         self.beta = Parameter("beta")
         super().__init__(choice_reg, weight_reg, *flag_regs, name=f"QWalkMixer_{m=}")
         for __ in range(m):
             for j in range(problem.N):
-                jwalk = SQQW(choice_reg, weight_reg, flag_regs, problem, j)
-                super().append(jwalk.to_instruction({jwalk.beta: self.beta / m}), [*choice_reg, *weight_reg, *flag_regs])
+                if use_construction_cache:
+                    jwalk = WalkStep(_layout_key(problem, choice_reg, weight_reg, sweep), j, self.beta / m)
+                else:
+                    jwalk = SQQW(choice_reg, weight_reg, flag_regs, problem, j, sweep=sweep)
+                    parameter_map = {jwalk.beta: self.beta / m}
+                    if sweep:
+                        parameter_map[budget_offset] = budget_offset
+                    jwalk = jwalk.to_instruction(parameter_map)
+                super().append(jwalk, [*choice_reg, *weight_reg, *flag_regs])
 
 class Dephase(QuantumCircuit):
     def __init__(self, choice_reg, problem):
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+import numpy as np
+from .KnapsackMethod import KnapsackProblem, fingerprint
+from .ChoiceSpace import ChoiceSpaceSimulator, register_layout
+from . import Instrumentation
+
+cache_dir = os.environ.get("QAOA_COMPILED_PROBLEMS", os.path.join(os.path.expanduser("~"), ".cache", "quantum_core", "compiled"))
+# Up to this many feasible choices the generator is diagonalized and its
+# eigenvectors (8 d^2 bytes) kept. Larger problems run on the walk simulator
+# (see Utilities.choice_space_simulator): applying the continuous walk any
+# other way, such as Krylov expm_multiply, is slower than the m walk steps.
+max_dense_states = 4096
+# Bump when the stored layout changes, so old files are not loaded.
+format_version = 1
+
+def cache_key(problem: KnapsackProblem, layout=None):
+    description = {
+        "problem": fingerprint(problem),
+        "layout": list(layout or register_layout(problem)),
+        "format_version": format_version,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+class CompiledProblem(ChoiceSpaceSimulator):
+    # The continuous-time walk on the feasible choices: each mixer is
+    # exp(-i beta H), where H links every feasible x to its feasible
+    # neighbours x ^ (1 << j), the pairs an SQQW step rotates between. The m
+    # SQQW steps of the circuit are a Trotterization of it and approach it as
+    # m grows. A layer is a diagonal phase, then a change to the eigenbasis of
+    # H, another diagonal phase and the change back.
+    def __init__(self, problem: KnapsackProblem, layout=None, eigenvalues=None, eigenvectors=None):
+        # The states and pairs are those of a single walk step.
+        super().__init__(problem, 1, layout=layout)
+        self.m = None
+        self.layout = layout or register_layout(problem)
+        if len(self.states) > max_dense_states:
+            raise ValueError(f"{len(self.states)} feasible choices are more than CompiledProblem.max_dense_states = {max_dense_states}; use the choice_space simulator")
+        if eigenvalues is not None:
+            self.eigenvalues, self.eigenvectors = eigenvalues, eigenvectors
+        else:
+            with Instrumentation.span("compile_problem"):
+                self.eigenvalues, self.eigenvectors = np.linalg.eigh(self.generator_matrix())
+            Instrumentation.count("compiled_problem.compiled")
+
+    def generator_matrix(self):
+        H = np.zeros((len(self.states), len(self.states)))
+        for lower, upper in self.pairs:
+            H[lower, upper] = H[upper, lower] = 1
+        return H
+
+    def apply_generator(self, psi):
+        out = np.zeros_like(psi)
+        for lower, upper in self.pairs:
+            out[..., lower] += psi[..., upper]
+            out[..., upper] += psi[..., lower]
+        return out
+
+    def mix(self, psi, beta):
+        # exp(-i beta H) applied to every row of psi, each with its own beta.
+        beta = np.atleast_1d(beta)
+        coefficients = self._real_product(psi, self.eigenvectors)
+        coefficients *= np.exp(-1j * np.outer(beta, self.eigenvalues))
+        return self._real_product(coefficients, self.eigenvectors.T)
+
+    @staticmethod
+    def _real_product(psi, matrix):
+        # The eigenvectors are real. Multiplying the real and imaginary parts
+        # as one real matrix avoids numpy casting them to complex every call.
+        product = np.concatenate([psi.real, psi.imag]) @ matrix
+        return product[:len(psi)] + 1j * product[len(psi):]
+
+    def statevectors(self, angles_batch):
+        angles_batch = np.atleast_2d(np.asarray(angles_batch, dtype=float))
+        psi = np.zeros((len(angles_batch), len(self.states)), dtype=complex)
+        psi[:, self.initial_index] = 1
+        for gamma, beta in zip(angles_batch[:, 0::2].T, angles_batch[:, 1::2].T):
+            psi *= np.exp(-1j * np.outer(gamma, self.values))
+            psi = self.mix(psi, beta)
+        Instrumentation.count("simulator.calls", len(angles_batch))
+        Instrumentation.observe_max("statevector.bytes", psi.nbytes)
+        return psi
+
+    def expectation_and_gradient(self, angles):
+        # The adjoint-state gradient of ChoiceSpaceSimulator, with the walk
+        # steps replaced by the one mixer exp(-i beta H).
+        angles = np.asarray(angles, dtype=float)
+        psi = self.statevector(angles)
+        energy = float(np.dot(np.abs(psi) ** 2, self.values))
+        lam = self.values * psi
+        gradient = np.zeros(len(angles))
+        for layer in reversed(range(len(angles) // 2)):
+            gamma, beta = angles[2 * layer], angles[2 * layer + 1]
+            gradient[2 * layer + 1] = 2 * np.vdot(lam, self.apply_generator(psi)).imag
+            psi, lam = self.mix(np.array([psi, lam]), [-beta, -beta])
+            gradient[2 * layer] = 2 * np.vdot(lam, self.values * psi).imag
+            phase = np.exp(1j * gamma * self.values)
+            psi *= phase
+            lam *= phase
+        return energy, gradient
+
+    def save(self, path):
+        # The eigendecomposition is stored with the states it belongs to. The
+        # pairs are cheap to rebuild, and the states are checked on load.
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, states=self.states, eigenvalues=self.eigenvalues, eigenvectors=self.eigenvectors)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, problem: KnapsackProblem, layout=None):
+        with np.load(path) as arrays:
+            states, eigenvalues, eigenvectors = arrays["states"], arrays["eigenvalues"], arrays["eigenvectors"]
+        compiled = cls(problem, layout=layout, eigenvalues=eigenvalues, eigenvectors=eigenvectors)
+        if not np.array_equal(compiled.states, states):
+            raise ValueError(f"{path} was compiled for a different problem")
+        return compiled
+
+def _path(key):
+    return os.path.join(cache_dir, f"{key}.npz")
+
+@lru_cache(maxsize=16)
+def _compiled(problem_fingerprint, layout):
+    values, weights, max_weight = problem_fingerprint
+    problem = KnapsackProblem(list(values), list(weights), max_weight)
+    path = _path(cache_key(problem, layout))
+    try:
+        compiled = CompiledProblem.load(path, problem, layout)
+    except (OSError, ValueError, KeyError):
+        compiled = CompiledProblem(problem, layout)
+        compiled.save(path)
+        return compiled
+    Instrumentation.count("compiled_problem.disk_hits")
+    return compiled
+
+def compiled_problem(problem: KnapsackProblem, layout=None):
+    # Compiled once per problem and register layout, then kept in memory and
+    # in cache_dir, so later runs on the same basket load it from disk.
+    return _compiled(fingerprint(problem), layout)
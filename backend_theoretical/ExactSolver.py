@@ -0,0 +1,87 @@
+from functools import lru_cache
+import numpy as np
+from . import ChoiceTables
+
+# Problems up to this size are solved by enumerating every choice; above it
+# integer weights go through the dynamic programme instead.
+enumeration_limit = 20
+# Relative tolerance used to decide that two choices tie for the optimum.
+tolerance = 1e-9
+
+def choices_from_codes(codes, N):
+    return np.array([[(code >> i) & 1 for i in range(N)] for code in codes], dtype=int).reshape(-1, N)
+
+def is_tied(value, best):
+    return abs(value - best) <= tolerance * max(1.0, abs(best))
+
+def has_integer_weights(weights):
+    return all(float(w).is_integer() and w >= 0 for w in weights)
+
+def enumerate_solutions(values, weights, max_weight):
+    if 2**len(values) > ChoiceTables.max_choices:
+        return enumerate_solutions_chunked(values, weights, max_weight)
+    tables = ChoiceTables.tables(tuple(values), tuple(weights))
+    feasible = tables.feasible(max_weight)
+    if not feasible.any():
+        return []
+    best = tables.values[feasible].max()
+    scale = tolerance * max(1.0, abs(best))
+    return np.flatnonzero(feasible & (np.abs(tables.values - best) <= scale)).tolist()
+
+def enumerate_solutions_chunked(values, weights, max_weight):
+    # The same search a block of codes at a time, in bounded memory.
+    best = -np.inf
+    codes = []
+    for start, chunk_values, chunk_weights in ChoiceTables.chunks(values, weights):
+        feasible = chunk_weights <= max_weight
+        if not feasible.any():
+            continue
+        chunk_best = chunk_values[feasible].max()
+        if best == -np.inf or (chunk_best > best and not is_tied(chunk_best, best)):
+            best = chunk_best
+            codes = []
+        if is_tied(chunk_best, best):
+            scale = tolerance * max(1.0, abs(best))
+            tied = feasible & (np.abs(chunk_values - best) <= scale)
+            codes.extend((start + np.flatnonzero(tied)).tolist())
+    return codes
+
+def dp_solutions(values, weights, max_weight):
+    N = len(values)
+    weights = [int(w) for w in weights]
+    capacity = min(int(np.floor(max_weight)), sum(weights))
+    if capacity < 0:
+        return []
+    # table[i, c] is the best value reachable with items i.. and capacity c.
+    table = np.zeros((N + 1, capacity + 1))
+    for i in reversed(range(N)):
+        table[i] = table[i + 1]
+        w = weights[i]
+        if w <= capacity:
+            taken = table[i + 1, :capacity + 1 - w] + values[i]
+            table[i, w:] = np.maximum(table[i + 1, w:], taken)
+    codes = []
+    stack = [(0, capacity, 0)]
+    while stack:
+        i, c, code = stack.pop()
+        if i == N:
+            codes.append(code)
+            continue
+        target = table[i, c]
+        if is_tied(table[i + 1, c], target):
+            stack.append((i + 1, c, code))
+        w = weights[i]
+        if w <= c and is_tied(table[i + 1, c - w] + values[i], target):
+            stack.append((i + 1, c - w, code | (1 << i)))
+    return sorted(codes)
+
+@lru_cache(maxsize=128)
+def solve(values: tuple, weights: tuple, max_weight):
+    N = len(values)
+    if N > enumeration_limit and has_integer_weights(weights):
+        codes = dp_solutions(values, weights, max_weight)
+    else:
+        codes = enumerate_solutions(values, weights, max_weight)
+    solutions = choices_from_codes(codes, N)
+    solutions.setflags(write=False)
+    return solutions
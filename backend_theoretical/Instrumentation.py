@@ -0,0 +1,206 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# Spans and counters are recorded when enabled is set, or inside recording().
+# Otherwise span() hands back a shared no-op context and count() returns after
+# one check, so instrumented code runs at full speed.
+enabled = os.environ.get("QAOA_INSTRUMENTATION", "0") == "1"
+sinks = []
+
+totals = Counter()
+maxima = {}
+_lock = threading.Lock()
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_recording = contextvars.ContextVar("current_recording", default=None)
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+_no_span = _NoSpan()
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        record = {
+            "type": "span",
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "duration": duration,
+            "error": exc_type.__name__ if exc_type is not None else None,
+            **self.attributes,
+        }
+        recording = _current_recording.get()
+        if recording is not None:
+            recording.add_span(record, top_level=self.parent is recording.root)
+        emit(record)
+        return False
+
+def span(name, **attributes):
+    if not enabled and _current_recording.get() is None:
+        return _no_span
+    return Span(name, attributes)
+
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n=1):
+    if not enabled and _current_recording.get() is None:
+        return
+    with _lock:
+        totals[name] += n
+    recording = _current_recording.get()
+    if recording is not None:
+        recording.add_count(name, n)
+
+def observe_max(name, value):
+    if not enabled and _current_recording.get() is None:
+        return
+    with _lock:
+        maxima[name] = max(maxima.get(name, value), value)
+    recording = _current_recording.get()
+    if recording is not None:
+        recording.add_max(name, value)
+
+def emit(record):
+    for sink in sinks:
+        sink(record)
+
+class Recording:
+    def __init__(self, root=None):
+        # Spans whose parent is root (the span open when recording started)
+        # are the top-level stages of the recording.
+        self.root = root
+        self.spans = []
+        self.counters = Counter()
+        self.maxima = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, record, top_level=False):
+        with self._lock:
+            self.spans.append({**record, "top_level": top_level})
+
+    def add_count(self, name, n):
+        with self._lock:
+            self.counters[name] += n
+
+    def add_max(self, name, value):
+        with self._lock:
+            self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    def export(self):
+        # Everything recorded, in a form that pickles, for merge() in the
+        # process that started this one.
+        with self._lock:
+            return {"spans": list(self.spans), "counters": dict(self.counters), "maxima": dict(self.maxima)}
+
+    def summary(self):
+        # Total time per span name; top-level spans are the stages of the run.
+        with self._lock:
+            stages = {}
+            for record in self.spans:
+                stage = stages.setdefault(record["name"], {"calls": 0, "seconds": 0.0, "top_level": record["top_level"]})
+                stage["calls"] += 1
+                stage["seconds"] += record["duration"]
+            return {"spans": stages, "counters": dict(self.counters), "maxima": dict(self.maxima)}
+
+@contextmanager
+def recording():
+    # Collects every span and counter of the enclosed code, in this thread or
+    # context only, whether or not instrumentation is enabled globally.
+    recording = Recording(root=_current_span.get())
+    token = _current_recording.set(recording)
+    try:
+        yield recording
+    finally:
+        _current_recording.reset(token)
+        emit({"type": "counters", "counters": dict(recording.counters), "maxima": dict(recording.maxima)})
+
+def merge(exported):
+    # Adds what a worker process recorded (its Recording.export()) to this
+    # process, as if it had run here under the current span.
+    recording = _current_recording.get()
+    if not enabled and recording is None:
+        return
+    with _lock:
+        totals.update(exported["counters"])
+        for name, value in exported["maxima"].items():
+            maxima[name] = max(maxima.get(name, value), value)
+    parent = _current_span.get()
+    for record in exported["spans"]:
+        top_level = record.pop("top_level", False)
+        if record["parent"] is None and parent is not None:
+            record = {**record, "parent": parent.name}
+        if recording is not None:
+            recording.add_span(record, top_level=top_level and parent is recording.root)
+        emit(record)
+    if recording is not None:
+        for name, n in exported["counters"].items():
+            recording.add_count(name, n)
+        for name, value in exported["maxima"].items():
+            recording.add_max(name, value)
+
+def reset():
+    with _lock:
+        totals.clear()
+        maxima.clear()
+
+class LogSink:
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger("backend_theoretical")
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, json.dumps(record, default=str))
+
+class JSONLSink:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps({"time": time.time(), **record}, default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
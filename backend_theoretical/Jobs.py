@@ -0,0 +1,165 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .MeanVariance import MeanVarianceMethod
+from . import Instrumentation
+from .main import main as quantum_main, budget_sweep
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.stage = "queued"
+        self.details = {}
+        self.events = []
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def update(self, stage, **details):
+        # Called from the worker thread; readers only ever see whole updates.
+        with self._lock:
+            if stage != self.stage:
+                self.details = {}
+                self.events.append((time.time(), stage))
+            self.stage = stage
+            self.details.update(details)
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def snapshot(self):
+        with self._lock:
+            now = self.finished or time.time()
+            return {
+                "id": self.id,
+                "status": self.status,
+                "stage": self.stage,
+                "details": dict(self.details),
+                "events": list(self.events),
+                "result": self.result,
+                "error": self.error,
+                "elapsed": now - (self.started or now),
+            }
+
+class QueueFull(Exception):
+    pass
+
+def job_key(**inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+class JobManager:
+    # Jobs are keyed by a fingerprint of their inputs. Submitting inputs that
+    # match a queued, running or finished job returns that job, so reruns and
+    # other sessions attach to it instead of starting the work again. New jobs
+    # beyond max_queued waiting ones raise QueueFull. on_finished, if given,
+    # is called with every job that finishes.
+    def __init__(self, max_workers=1, max_finished=32, max_queued=None, on_finished=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="optimizer")
+        self._jobs = {}
+        self._by_key = OrderedDict()
+        self._max_finished = max_finished
+        self._max_queued = max_queued
+        self._on_finished = on_finished
+        self._lock = threading.Lock()
+
+    def submit(self, function, **inputs):
+        key = job_key(function=function.__qualname__, **inputs)
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None and job.status != "failed":
+                self._by_key.move_to_end(key)
+                return job
+            queued = self._count("queued")
+            if self._max_queued is not None and queued >= self._max_queued:
+                raise QueueFull(f"{queued} jobs are already waiting")
+            if job is not None:
+                # The failed job is replaced by its retry.
+                self._jobs.pop(job.id, None)
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._forget_finished()
+        self._pool.submit(self._run, job, function, inputs)
+        return job
+
+    def _run(self, job, function, inputs):
+        job.started = time.time()
+        job.status = "running"
+        try:
+            job.result = function(progress=job.update, **inputs)
+            job.update("done")
+            job.status = "done"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+        job.finished = time.time()
+        if self._on_finished is not None:
+            self._on_finished(job)
+
+    def _forget_finished(self):
+        finished = [key for key, job in self._by_key.items() if job.done]
+        for key in finished[:max(len(finished) - self._max_finished, 0)]:
+            job = self._by_key.pop(key)
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _count(self, status):
+        return sum(1 for job in self._jobs.values() if job.status == status)
+
+    @property
+    def queued(self):
+        with self._lock:
+            return self._count("queued")
+
+    @property
+    def running(self):
+        with self._lock:
+            return self._count("running")
+
+def optimize_portfolio(stocks, start_date, end_date, budget, progress):
+    with Instrumentation.recording() as recording:
+        progress("data")
+        optimized_weights = MeanVarianceMethod(list(stocks), start_date, end_date).weights()
+        higher_prob_key_reversed, higher_prob_key, best_known_solution, approximation_ratio = quantum_main(optimized_weights, budget, progress=progress)
+    return {
+        "instrumentation": recording.summary(),
+        "stocks": list(stocks),
+        "optimized_weights": optimized_weights,
+        "higher_prob_key_reversed": higher_prob_key_reversed,
+        "higher_prob_key": higher_prob_key,
+        "best_known_solution": best_known_solution,
+        "approximation_ratio": approximation_ratio,
+    }
+
+def optimize_portfolio_sweep(stocks, start_date, end_date, progress):
+    with Instrumentation.recording() as recording:
+        progress("data")
+        optimized_weights = MeanVarianceMethod(list(stocks), start_date, end_date).weights()
+        progress("circuit")
+        sweep = budget_sweep(optimized_weights, progress=progress)
+    instrumentation = recording.summary()
+    return {
+        budget: {
+            "instrumentation": instrumentation,
+            "stocks": list(stocks),
+            "optimized_weights": optimized_weights,
+            "higher_prob_key_reversed": higher_prob_key_reversed,
+            "higher_prob_key": higher_prob_key,
+            "best_known_solution": best_known_solution,
+            "approximation_ratio": approximation_ratio,
+        }
+        for budget, (higher_prob_key_reversed, higher_prob_key, best_known_solution, approximation_ratio) in sweep.items()
+    }
@@ -1,5 +1,7 @@
 from dataclasses import dataclass, field
 import numpy as np
+from . import ExactSolver
+from . import Instrumentation
 
 @dataclass
 class KnapsackProblem:
@@ -20,19 +22,13 @@ def weight(choice, problem):
 def is_choice_feasible(choice, problem):
     return weight(choice, problem) <= problem.max_weight
 
+def fingerprint(problem):
+    values = tuple(np.asarray(problem.values, dtype=float).tolist())
+    weights = tuple(np.asarray(problem.weights).tolist())
+    return values, weights, np.asarray(problem.max_weight).item()
+
+@Instrumentation.timed("classical_solutions")
 def classical_solutions(problem: KnapsackProblem):
-    def choices_from_number(problem, number):
-        return np.array(list(map(int, list(reversed(bin(number)[2:])))) + [0] * (problem.N - len(bin(number)[2:])))
-    best = 0
-    solutions = []
-    for i in range(2**problem.N):
-        choice = choices_from_number(problem, i)
-        value = choice.dot(problem.values)
-        weight = choice.dot(problem.weights)
-        is_legal = weight <= problem.max_weight
-        if is_legal and value > best:
-            best = value
-            solutions = [choice]
-        elif is_legal and value == best:
-            solutions.append(choice)
-    return np.array(solutions)
+    # Memoized per problem fingerprint, so repeated calls for the same
+    # problem (baseline, approximation ratio) only solve it once.
+    return ExactSolver.solve(*fingerprint(problem)).copy()
@@ -0,0 +1,239 @@
+import json
+import os
+import tempfile
+import threading
+import zlib
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from . import Instrumentation
+
+data_dir = os.environ.get("QAOA_MARKET_DATA", os.path.join(os.path.expanduser("~"), ".cache", "quantum_core", "market_data"))
+# Offline mode never touches the network: prices come from CSV fixtures in
+# fixture_dir if it is set, and from a deterministic synthetic series otherwise.
+offline = os.environ.get("QAOA_MARKET_DATA_OFFLINE", "0") == "1"
+fixture_dir = os.environ.get("QAOA_MARKET_DATA_FIXTURES")
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+def to_timestamp(day):
+    return pd.Timestamp(day).normalize().tz_localize(None)
+
+class FetchError(Exception):
+    pass
+
+class YahooFetcher:
+    def prices(self, ticker, start, end):
+        # yf.download does not raise on network and rate-limit errors, it
+        # returns an empty frame. A range without trading days is empty too,
+        # so an empty answer only counts as such when the range holds no
+        # business day.
+        import yfinance as yf
+        data = yf.download(ticker, start=start, end=end, auto_adjust=False, progress=False)
+        if isinstance(data.columns, pd.MultiIndex):
+            data.columns = data.columns.get_level_values(0)
+        if data.empty and len(pd.bdate_range(start, end, inclusive="left")):
+            raise FetchError(f"{ticker}: no prices returned for {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+        return data
+
+    def company_name(self, ticker):
+        import yfinance as yf
+        return yf.Ticker(ticker).info.get("longName", ticker)
+
+class FixtureFetcher:
+    # Reads <directory>/<TICKER>.csv files with a Date column and the usual
+    # OHLC columns, and an optional names.json mapping tickers to names.
+    def __init__(self, directory):
+        self.directory = directory
+
+    def prices(self, ticker, start, end):
+        path = os.path.join(self.directory, f"{ticker}.csv")
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=COLUMNS)
+        data = pd.read_csv(path, index_col="Date", parse_dates=True)
+        return data[(data.index >= start) & (data.index < end)]
+
+    def company_name(self, ticker):
+        try:
+            with open(os.path.join(self.directory, "names.json")) as f:
+                return json.load(f).get(ticker, ticker)
+        except OSError:
+            return ticker
+
+class SyntheticFetcher:
+    # Deterministic prices that depend only on the ticker and the date, so any
+    # two requests agree on the days they share.
+    def prices(self, ticker, start, end):
+        days = pd.bdate_range(start, end, inclusive="left", name="Date")
+        seed = zlib.crc32(ticker.encode())
+        rng = np.random.default_rng(seed)
+        drift, amplitude, period, level = rng.uniform([-2e-4, 0.05, 60, 3], [6e-4, 0.25, 400, 6])
+        t = days.to_julian_date().to_numpy() - 2440587.5
+        noise = np.modf(np.abs(np.sin(t * 12.9898 + seed % 1000) * 43758.5453))[0] - 0.5
+        close = np.exp(level + drift * t + amplitude * np.sin(2 * np.pi * t / period) + 0.02 * noise)
+        return pd.DataFrame({
+            "Open": close * (1 - 0.002 * noise),
+            "High": close * 1.01,
+            "Low": close * 0.99,
+            "Close": close,
+            "Adj Close": close,
+            "Volume": np.full(len(days), 1e6),
+        }, index=days)
+
+    def company_name(self, ticker):
+        return ticker
+
+def missing_ranges(covered, start, end):
+    # covered is a sorted list of disjoint [start, end) ranges.
+    missing = []
+    for lo, hi in covered:
+        if hi <= start:
+            continue
+        if lo >= end:
+            break
+        if lo > start:
+            missing.append((start, lo))
+        start = max(start, hi)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+def merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+class PriceStore:
+    # One Arrow IPC file per ticker, read through a memory map, plus a JSON
+    # index of the date ranges already fetched. Requests only fetch the parts
+    # of their range that are not on disk yet.
+    def __init__(self, directory, fetcher):
+        self.directory = directory
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "prices"), exist_ok=True)
+        self._coverage = self._read_json("coverage.json")
+        self._names = self._read_json("metadata.json")
+
+    def _read_json(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_atomic(self, path, write):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _write_json(self, name, content):
+        self._write_atomic(os.path.join(self.directory, name), lambda f: f.write(json.dumps(content, sort_keys=True).encode()))
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, "prices", f"{ticker}.arrow")
+
+    def _read(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return None
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def _write(self, ticker, data):
+        table = pa.Table.from_pandas(data.rename_axis("Date").reset_index(), preserve_index=False)
+        def write(f):
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        self._write_atomic(self._path(ticker), write)
+
+    def _fill(self, ticker, start, end):
+        # Today's bar is still moving, so ranges are only recorded up to today.
+        end = min(end, to_timestamp(pd.Timestamp.today()) + pd.Timedelta(days=1))
+        covered = [(to_timestamp(lo), to_timestamp(hi)) for lo, hi in self._coverage.get(ticker, [])]
+        missing = missing_ranges(covered, start, end)
+        if not missing:
+            return
+        fetched = []
+        for lo, hi in missing:
+            try:
+                with Instrumentation.span("market_data.fetch", ticker=ticker):
+                    data = self.fetcher.prices(ticker, lo, hi)
+            except FetchError:
+                # Not recorded as covered, so it is fetched again next time.
+                Instrumentation.count("market_data.fetch_errors")
+                continue
+            Instrumentation.count("market_data.fetches")
+            if data is None or data.empty:
+                # Failures raise FetchError, so for a ticker that has returned
+                # prices before an empty range just has no trading days. A
+                # ticker without prices yet may be invalid and is tried again.
+                if ticker not in self._coverage:
+                    continue
+            else:
+                data.index = pd.DatetimeIndex(data.index).tz_localize(None).normalize()
+                fetched.append(data.reindex(columns=COLUMNS).astype(float))
+            covered.append((lo, min(hi, to_timestamp(pd.Timestamp.today()))))
+        if fetched:
+            table = self._read(ticker)
+            if table is not None:
+                fetched.insert(0, table.to_pandas().set_index("Date"))
+            data = pd.concat(fetched)
+            data = data[~data.index.duplicated(keep="last")].sort_index()
+            self._write(ticker, data)
+        elif ticker not in self._coverage:
+            return
+        self._coverage[ticker] = [[lo.date().isoformat(), hi.date().isoformat()] for lo, hi in merge_ranges(covered) if lo < hi]
+        self._write_json("coverage.json", self._coverage)
+
+    def history(self, ticker, start, end):
+        start, end = to_timestamp(start), to_timestamp(end)
+        with self._lock:
+            self._fill(ticker, start, end)
+            table = self._read(ticker)
+        if table is None:
+            return pd.DataFrame(columns=COLUMNS)
+        dates = table.column("Date").to_numpy()
+        mask = (dates >= start.to_datetime64()) & (dates < end.to_datetime64())
+        return table.filter(pa.array(mask)).to_pandas().set_index("Date")
+
+    def prices(self, tickers, start, end, field="Adj Close"):
+        # Same layout as yf.download(tickers)[field], with columns in the
+        # order the tickers were given.
+        columns = {ticker: self.history(ticker, start, end)[field] for ticker in tickers}
+        prices = pd.DataFrame({ticker: column for ticker, column in columns.items() if not column.empty})
+        return prices.dropna(how="all")
+
+    def company_name(self, ticker):
+        with self._lock:
+            if ticker not in self._names:
+                try:
+                    self._names[ticker] = self.fetcher.company_name(ticker)
+                except Exception:
+                    return ticker
+                self._write_json("metadata.json", self._names)
+            return self._names[ticker]
+
+def default_fetcher():
+    if not offline:
+        return YahooFetcher()
+    if fixture_dir:
+        return FixtureFetcher(fixture_dir)
+    return SyntheticFetcher()
+
+@lru_cache(maxsize=None)
+def _store(directory, offline, fixture_dir):
+    # Offline data is kept apart so it never mixes with downloaded prices.
+    if offline:
+        source = f"fixtures-{zlib.crc32(os.path.abspath(fixture_dir).encode()):08x}" if fixture_dir else "synthetic"
+        directory = os.path.join(directory, "offline", source)
+    return PriceStore(directory, default_fetcher())
+
+def default_store():
+    return _store(data_dir, offline, fixture_dir)
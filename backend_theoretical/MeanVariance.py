@@ -1,17 +1,18 @@
 # Import required libraries
-import yfinance as yf
-import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
 
-from pypfopt import risk_models, expected_returns, EfficientFrontier
+# pypfopt is imported in the methods that use it: it takes about a second to
+# import, and most importers of this module never compute weights.
 from .KnapsackMethod import KnapsackProblem
+from . import MarketData
+from . import Instrumentation
 
 class MeanVarianceMethod:
-    def __init__(self, stocks, start_date, end_date):
-        ohlc = yf.download(stocks, start=start_date, end=end_date)
+    def __init__(self, stocks, start_date, end_date, store=None):
+        store = store or MarketData.default_store()
         self.stocks = stocks
-        self.prices = ohlc["Adj Close"].dropna(how="all")
+        with Instrumentation.span("market_data"):
+            self.prices = store.prices(stocks, start_date, end_date)
         
         # Check for invalid tickers
         valid_tickers = self.prices.columns
@@ -19,15 +20,21 @@ class MeanVarianceMethod:
         if invalid_tickers:
             raise ValueError(f"Invalid tickers: {', '.join(invalid_tickers)}")
     
+    @Instrumentation.timed("pypfopt.covariance")
     def covariance(self):
+        from pypfopt import risk_models
         cov = risk_models.CovarianceShrinkage(self.prices).ledoit_wolf()
         return cov
 
+    @Instrumentation.timed("pypfopt.expected_returns")
     def expected_returns(self):
+        from pypfopt import expected_returns
         mu = expected_returns.capm_return(self.prices)
         return mu
 
+    @Instrumentation.timed("pypfopt")
     def weights(self):
+        from pypfopt import EfficientFrontier
         er = self.expected_returns()
         cov = self.covariance()
 
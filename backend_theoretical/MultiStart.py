@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from .KnapsackMethod import KnapsackProblem
+from . import Instrumentation
+from . import Utilities
+
+# State built once per worker process by _initialize_worker.
+_worker = {}
+
+class _Cancelled(Exception):
+    pass
+
+def _initialize_worker(problem, circuit_problem, p, m, budget_sweep, offset, settings, cancel_event):
+    # Spawned workers start from the default settings, so the parent's
+    # simulator, noise and cache settings are applied first. In the parent
+    # the circuit has already been transpiled into the on-disk cache, so
+    # workers only load it, and bind the same budget-sweep offset.
+    Utilities.apply_settings(settings)
+    circuit = Utilities.prepare_circuit(circuit_problem, p, m, budget_sweep=budget_sweep)
+    if offset is not None:
+        circuit = Utilities.bound_offset(circuit, offset)
+    _worker.update(
+        problem=problem,
+        circuit=circuit,
+        objective=Utilities.get_objective(circuit, problem),
+        cancel_event=cancel_event,
+    )
+
+def _run_start(index, initial_angles, maxiter):
+    # What the start records goes back to the parent with its result.
+    with Instrumentation.recording() as recording:
+        result = _refine_start(index, initial_angles, maxiter)
+    return {**result, "recording": recording.export()}
+
+def _refine_start(index, initial_angles, maxiter):
+    problem, circuit = _worker["problem"], _worker["circuit"]
+    objective, cancel_event = _worker["objective"], _worker["cancel_event"]
+    trace = []
+    def angles_to_value(angles):
+        if cancel_event.is_set():
+            raise _Cancelled
+        value = objective(angles)
+        trace.append(value)
+        return value
+    result = {"index": index, "initial_angles": initial_angles, "trace": trace}
+    try:
+        angles = Utilities.refine_angles(angles_to_value, initial_angles, circuit.gamma_range(), circuit.beta_range(), maxiter=maxiter)
+    except _Cancelled:
+        return {**result, "cancelled": True}
+    probs = Utilities.get_choice_probabilities(circuit, problem, angles)
+    return {
+        **result,
+        "cancelled": False,
+        "angles": angles,
+        "value": -objective(angles),
+        "ratio": Utilities.approximation_ratio(problem, probs),
+        "evaluations": len(trace),
+    }
+
+def starting_points(circuit, starts, seed=None):
+    rng = np.random.default_rng(seed)
+    bounds = np.array([circuit.gamma_range(), circuit.beta_range()] * circuit.p)
+    return rng.uniform(bounds[:, 0], bounds[:, 1], size=(starts, 2 * circuit.p))
+
+def multistart_angles(problem: KnapsackProblem, p: int, m: int, starts=16, workers=None, seed=None, target_ratio=None, maxiter=200, circuit=None):
+    # circuit, if given, is the circuit to optimize, such as a budget-sweep
+    # view from Utilities.budget_circuit; by default it is built for problem.
+    if circuit is None:
+        circuit = Utilities.prepare_circuit(problem, p, m)
+    initial_points = starting_points(circuit, starts, seed)
+    context = multiprocessing.get_context("spawn")
+    cancel_event = context.Event()
+    workers = workers or os.cpu_count()
+    results = []
+    reached_target = False
+    budget_sweep = circuit.offset_parameter is not None
+    initargs = (problem, circuit.problem, p, m, budget_sweep, circuit.offset, Utilities.settings(), cancel_event)
+    with ProcessPoolExecutor(max_workers=min(workers, starts), mp_context=context, initializer=_initialize_worker, initargs=initargs) as pool:
+        futures = [pool.submit(_run_start, index, start, maxiter) for index, start in enumerate(initial_points)]
+        # Results are consumed in start order, and only starts before the first
+        # one to reach the target are kept, so the outcome does not depend on
+        # which worker finishes first.
+        for future in futures:
+            result = future.result()
+            Instrumentation.merge(result.pop("recording"))
+            results.append(result)
+            if target_ratio is not None and result["ratio"] >= target_ratio:
+                reached_target = True
+                cancel_event.set()
+                for pending in futures:
+                    pending.cancel()
+                break
+    best = max(results, key=lambda result: (result["value"], -result["index"]))
+    return {
+        "angles": best["angles"],
+        "value": best["value"],
+        "ratio": best["ratio"],
+        "best_start": best["index"],
+        "reached_target": reached_target,
+        "starts": results,
+    }
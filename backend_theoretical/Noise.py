@@ -0,0 +1,95 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+from . import Simulators
+
+# Local noise applied when Utilities.is_apply_noise is set: a depolarizing
+# error of the given probability after every gate of that name (gates not
+# listed are noiseless), and each measured bit flipped with readout_error.
+gate_errors = {
+    "h": 1e-3,
+    "x": 1e-3,
+    "p": 1e-3,
+    "rx": 1e-3,
+    "cx": 1e-2,
+    "cp": 1e-2,
+    "rxx": 1e-2,
+    "ccx": 3e-2,
+}
+readout_error = 2e-2
+# Noisy runs are Monte Carlo trajectories: every shot samples the errors and
+# evolves one statevector. Each round of shots is split into chunks of at
+# least min_chunk shots that run concurrently on workers threads, each with
+# its own seed; Aer releases the GIL while it simulates.
+workers = os.cpu_count() or 1
+min_chunk = 64
+
+def noise_key():
+    return tuple(sorted(gate_errors.items())), readout_error
+
+@lru_cache(maxsize=4)
+def _noise_model(key):
+    from qiskit.circuit.library.standard_gates import get_standard_gate_name_mapping
+    from qiskit_aer.noise import NoiseModel, ReadoutError, depolarizing_error
+    errors, readout = key
+    gates = get_standard_gate_name_mapping()
+    model = NoiseModel()
+    for name, probability in errors:
+        if probability > 0:
+            model.add_all_qubit_quantum_error(depolarizing_error(probability, gates[name].num_qubits), [name])
+    if readout > 0:
+        model.add_all_qubit_readout_error(ReadoutError([[1 - readout, readout], [readout, 1 - readout]]))
+    return model
+
+def noise_model():
+    return _noise_model(noise_key())
+
+def density_matrix_bytes(num_qubits):
+    return 16 * 4**num_qubits
+
+def select(num_qubits, choice_qubits, budget=None):
+    # The workers hold one trajectory each. A density matrix, the exact
+    # alternative, squares the size of the state.
+    budget = Simulators.memory_budget_bytes if budget is None else budget
+    density_matrix = f"a density matrix would need {Simulators.format_bytes(density_matrix_bytes(num_qubits))}"
+    for method in ("statevector", "matrix_product_state"):
+        estimate = workers * Simulators.memory_estimate(method, num_qubits, choice_qubits)
+        if estimate <= budget:
+            reason = f"{workers} {method} trajectories of {num_qubits} qubits at a time need {Simulators.format_bytes(estimate)}; {density_matrix}"
+            if method == "matrix_product_state":
+                reason += Simulators.mps_caveat(num_qubits)
+            return Simulators.SimulationMode("trajectories", estimate, reason, method=method)
+    raise MemoryError(f"{workers} noisy trajectories of {num_qubits} qubits do not fit in {Simulators.format_bytes(budget)}")
+
+@lru_cache(maxsize=4)
+def _simulator(method, key, threads, bond_dimension):
+    from qiskit_aer import AerSimulator
+    options = {"matrix_product_state_max_bond_dimension": bond_dimension} if method == "matrix_product_state" else {}
+    return AerSimulator(method=method, noise_model=_noise_model(key), max_parallel_threads=threads, **options)
+
+def simulator(method="statevector"):
+    # The threads of the machine are shared among the concurrent chunks.
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    return _simulator(method, noise_key(), threads, Simulators.mps_max_bond_dimension)
+
+@lru_cache(maxsize=None)
+def _executor(max_workers):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trajectories")
+
+def split_shots(shots):
+    chunks = max(min(workers, shots // min_chunk), 1)
+    return [len(part) for part in np.array_split(np.arange(shots), chunks)]
+
+def run_chunks(run, shots, seed):
+    # Calls run(shots, seed) for every chunk of shots, concurrently, and
+    # returns their results in order. Each chunk runs in a copy of the
+    # caller's context, so its spans and counters reach the caller's
+    # Instrumentation.recording().
+    sizes = split_shots(shots)
+    seeds = np.random.default_rng(seed).integers(2**31, size=len(sizes))
+    if len(sizes) == 1:
+        return [run(sizes[0], int(seeds[0]))]
+    contexts = [contextvars.copy_context() for __ in sizes]
+    return list(_executor(workers).map(lambda context, size, chunk_seed: context.run(run, size, chunk_seed), contexts, sizes, [int(s) for s in seeds]))
@@ -3,21 +3,28 @@ from itertools import product
 from fractions import Fraction
 from qiskit import QuantumRegister, QuantumCircuit
 from qiskit.circuit import Parameter
+import qiskit_aer  # registers QuantumCircuit.save_statevector
 import numpy as np
 import math
 from .KnapsackMethod import KnapsackProblem
-from .Circuits import Dephase, QWMixer
+from .Circuits import Dephase, walk_mixer, budget_offset
+from .ChoiceSpace import register_layout, sweep_register_layout
+from . import Instrumentation
 
 class QuantumWalkQAOA(QuantumCircuit):
-    def __init__(self, problem: KnapsackProblem, p: int, m: int):
+    @Instrumentation.timed("circuit.build")
+    def __init__(self, problem: KnapsackProblem, p: int, m: int, budget_sweep=False):
+        # With budget_sweep, problem.max_weight is the largest budget to sweep
+        # and the budget itself is bound through offset_parameter.
         self.p = p
         self.m = m
+        self.problem = problem
         self.betas = [Parameter(f"beta{i}") for i in range(p)]
         self.gammas = [Parameter(f"gamma{i}") for i in range(p)]
-        n = math.floor(math.log2(problem.total_weight)) + 1
-        c = math.floor(math.log2(problem.max_weight)) + 1
-        if c == n:
-            n += 1
+        self.offset_parameter = budget_offset if budget_sweep else None
+        self.offset = None
+        n, c = sweep_register_layout(problem) if budget_sweep else register_layout(problem)
+        self.oracle_layout = n, c
         choice_reg = QuantumRegister(problem.N, name="choice")
         weight_reg = QuantumRegister(n, name="weight")
         flag_x = QuantumRegister(1, name="v(x)")
@@ -27,10 +34,13 @@ class QuantumWalkQAOA(QuantumCircuit):
         print("Number of qubits:", len(choice_reg) + len(weight_reg) + len(flag_regs))
         super().__init__(choice_reg, weight_reg, *flag_regs, name=f"QuantumWalkQAOA {m=},{p=}")
         phase_circ = Dephase(choice_reg, problem)
-        mix_circ = QWMixer(choice_reg, weight_reg, flag_regs, problem, m)
+        mix_circ = walk_mixer(choice_reg, weight_reg, flag_regs, problem, m, sweep=budget_sweep)
         for gamma, beta in zip(self.gammas, self.betas):
             super().append(phase_circ.to_instruction({phase_circ.gamma: gamma}), choice_reg)
-            super().append(mix_circ.to_instruction({mix_circ.beta: beta}), [*choice_reg, *weight_reg, *flag_regs])
+            mix_parameters = {mix_circ.beta: beta}
+            if budget_sweep:
+                mix_parameters[budget_offset] = budget_offset
+            super().append(mix_circ.to_instruction(mix_parameters), [*choice_reg, *weight_reg, *flag_regs])
         super().save_statevector()
         super().measure_all()
 
@@ -0,0 +1,125 @@
+import math
+from statistics import NormalDist
+import numpy as np
+
+# A sampled evaluation stops once the confidence interval of its expectation
+# value is at most tolerance * sum(|values|) wide on either side, or after
+# max_shots. Shots are drawn in rounds, the first of min_shots.
+tolerance = 0.005
+confidence = 0.95
+min_shots = 512
+max_shots = 2**16
+# Number of distinct choices tracked by the streaming top-k.
+top_capacity = 64
+
+class RunningStatistics:
+    # Welford's mean and squared deviations, updated a batch of (value, count)
+    # pairs at a time with Chan's merge formula.
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values, counts):
+        n = counts.sum()
+        if n == 0:
+            return
+        mean = counts @ values / n
+        m2 = counts @ (values - mean) ** 2
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else math.inf
+
+    def half_width(self, confidence=confidence):
+        if self.n < 2:
+            return math.inf
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        return z * math.sqrt(self.variance / self.n)
+
+class SpaceSaving:
+    # Heavy hitters of a weighted stream in bounded memory. Batches are merged
+    # at once: items not yet tracked enter at the current smallest tracked
+    # count, and only the capacity largest counts are kept. A count exceeds
+    # the item's true count by at most its error.
+    def __init__(self, capacity=top_capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def update(self, items, counts):
+        floor = min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+        new_items, new_counts = [], []
+        for item, count in zip(items.tolist(), counts.tolist()):
+            if item in self.counts:
+                self.counts[item] += count
+            else:
+                new_items.append(item)
+                new_counts.append(count + floor)
+        if not new_items:
+            return
+        new_counts = np.array(new_counts)
+        keep = np.argsort(-new_counts, kind="stable")[:self.capacity]
+        for i in keep.tolist():
+            self.counts[new_items[i]] = float(new_counts[i])
+            self.errors[new_items[i]] = floor
+        if len(self.counts) > self.capacity:
+            ranked = sorted(self.counts, key=lambda item: (-self.counts[item], item))
+            for item in ranked[self.capacity:]:
+                del self.counts[item]
+                del self.errors[item]
+
+    def top(self, k):
+        ranked = sorted(self.counts, key=lambda item: (-self.counts[item], item))[:k]
+        return [(item, self.counts[item], self.errors[item]) for item in ranked]
+
+class StreamingEstimate:
+    # Running estimate of one parameter set's expectation value (and of the
+    # feasible-only value used for approximation ratios) from sampled choices.
+    def __init__(self, problem, tolerance=None):
+        tolerance = globals()["tolerance"] if tolerance is None else tolerance
+        self.problem = problem
+        self.values = np.asarray(problem.values, dtype=float)
+        self.weights = np.asarray(problem.weights, dtype=float)
+        self.target = tolerance * max(np.abs(self.values).sum(), 1e-12)
+        self.value = RunningStatistics()
+        self.comparable = RunningStatistics()
+        self.top_choices = SpaceSaving()
+
+    @property
+    def shots(self):
+        return int(self.value.n)
+
+    @property
+    def mean(self):
+        return self.value.mean
+
+    @property
+    def done(self):
+        return self.shots >= max_shots or self.value.half_width() <= self.target
+
+    def add(self, indices, counts):
+        bits = (indices[:, None] >> np.arange(self.problem.N)) & 1
+        values = bits @ self.values
+        feasible = bits @ self.weights <= self.problem.max_weight
+        self.value.update(values, counts)
+        self.comparable.update(np.where(feasible, values, 0.0), counts)
+        self.top_choices.update(indices, counts)
+
+    def shots_needed(self):
+        # Enough further shots to reach the target with the variance seen so
+        # far, with some margin, at least one more round of min_shots.
+        if self.shots == 0:
+            return min_shots
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        required = math.ceil(1.1 * (z * math.sqrt(self.value.variance) / self.target) ** 2)
+        return int(min(max(required - self.shots, min_shots), max_shots - self.shots))
+
+    def top(self, k):
+        # The k most sampled choices with their estimated probabilities.
+        return [(index, count / self.shots) for index, count, __ in self.top_choices.top(k)]
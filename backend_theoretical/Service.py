@@ -0,0 +1,190 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from . import Jobs
+
+# The solver as a long-running local process. Clients (see SolverClient.py)
+# submit portfolio optimizations over HTTP and poll their progress. Circuits,
+# classical baselines, compiled problems and stored angles stay in this
+# process's memory across requests, identical requests share one job, and at
+# most max_queued new jobs wait for the workers before requests are refused.
+host = "127.0.0.1"
+port = 8765
+workers = 1
+max_queued = 8
+# Seconds a refused client is told to wait before trying again.
+retry_after = 5
+# Latencies of the most recent finished jobs kept for the stats.
+latency_window = 256
+# Imported at start, so the first request does not pay for them.
+WARM_MODULES = ["qiskit", "qiskit_aer", "scipy.optimize", "pypfopt", ".QAOA", ".CircuitCache"]
+
+KINDS = {
+    "portfolio": Jobs.optimize_portfolio,
+    "sweep": Jobs.optimize_portfolio_sweep,
+}
+
+class ServiceStats:
+    def __init__(self):
+        self.started = time.time()
+        self.counts = {"requests": 0, "submitted": 0, "coalesced": 0, "rejected": 0, "done": 0, "failed": 0}
+        self.waits = deque(maxlen=latency_window)
+        self.latencies = deque(maxlen=latency_window)
+        self.finished = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def job_finished(self, job):
+        with self._lock:
+            self.counts[job.status] += 1
+            self.waits.append((job.started or job.finished) - job.submitted)
+            self.latencies.append(job.finished - job.submitted)
+            self.finished.append(job.finished)
+
+    def summary(self):
+        def percentiles(values):
+            if not values:
+                return None
+            p50, p95 = np.percentile(list(values), [50, 95])
+            return {"p50": float(p50), "p95": float(p95), "max": float(max(values))}
+        with self._lock:
+            now = time.time()
+            recent = [t for t in self.finished if now - t <= 60]
+            return {
+                **self.counts,
+                "uptime": now - self.started,
+                "jobs_per_minute": len(recent),
+                "queue_wait_seconds": percentiles(self.waits),
+                "latency_seconds": percentiles(self.latencies),
+            }
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+class SolverService:
+    def __init__(self, workers=workers, max_queued=max_queued):
+        self.stats = ServiceStats()
+        self.jobs = Jobs.JobManager(max_workers=workers, max_queued=max_queued, on_finished=self.stats.job_finished)
+
+    def warm(self):
+        from . import Utilities
+        for module in WARM_MODULES:
+            importlib.import_module(module, __package__)
+        Utilities.get_backend()
+
+    def submit(self, kind, inputs):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown job kind {kind!r}, expected one of {sorted(KINDS)}")
+        inputs = {name: inputs[name] for name in ("stocks", "start_date", "end_date", "budget") if name in inputs}
+        if kind == "sweep":
+            inputs.pop("budget", None)
+        inputs["stocks"] = [str(stock) for stock in inputs.get("stocks", [])]
+        before = time.time()
+        job = self.jobs.submit(KINDS[kind], **inputs)
+        # A job submitted earlier is one an identical request already started.
+        self.stats.count("coalesced" if job.submitted < before else "submitted")
+        return job
+
+    def summary(self):
+        from . import AngleStore, CircuitCache
+        return {
+            **self.stats.summary(),
+            "queued": self.jobs.queued,
+            "running": self.jobs.running,
+            "circuit_cache": CircuitCache.cache_info(),
+            "angle_store": AngleStore.default_store().summary(),
+        }
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, headers=()):
+            content = json.dumps(body, default=_to_json).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            service.stats.count("requests")
+            if self.path == "/health":
+                return self._reply(200, {"status": "ok"})
+            if self.path == "/stats":
+                return self._reply(200, service.summary())
+            if self.path.startswith("/jobs/"):
+                job = service.jobs.get(self.path[len("/jobs/"):])
+                if job is None:
+                    return self._reply(404, {"error": "Unknown job"})
+                return self._reply(200, job.snapshot())
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            service.stats.count("requests")
+            if self.path != "/jobs":
+                return self._reply(404, {"error": f"Unknown path {self.path}"})
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                job = service.submit(request.pop("kind", "portfolio"), request)
+            except Jobs.QueueFull as e:
+                service.stats.count("rejected")
+                return self._reply(503, {"error": str(e), "retry_after": retry_after}, [("Retry-After", str(retry_after))])
+            except (ValueError, TypeError, KeyError) as e:
+                return self._reply(400, {"error": f"{type(e).__name__}: {e}"})
+            self._reply(202, job.snapshot())
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(host=host, port=port, workers=workers, max_queued=max_queued, warm=True):
+    service = SolverService(workers=workers, max_queued=max_queued)
+    if warm:
+        service.warm()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server, service
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve portfolio optimizations over local HTTP, keeping the solver's caches warm between requests.")
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--workers", type=int, default=workers, help="Optimizations run at the same time.")
+    parser.add_argument("--max-queued", type=int, default=max_queued, help="New jobs allowed to wait for a worker before requests are refused.")
+    parser.add_argument("--circuit-cache-entries", type=int, help="Transpiled circuits kept in memory.")
+    parser.add_argument("--simulator", choices=["aer", "choice_space", "spectral"], help="Utilities.simulator for every job.")
+    args = parser.parse_args()
+
+    if args.simulator is not None:
+        from . import Utilities
+        Utilities.simulator = args.simulator
+
+    if args.circuit_cache_entries is not None:
+        from . import CircuitCache
+        CircuitCache.memory_size = args.circuit_cache_entries
+    server, __ = serve(args.host, args.port, args.workers, args.max_queued)
+    print(f"Solver service listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
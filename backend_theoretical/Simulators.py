@@ -0,0 +1,132 @@
+import os
+import warnings
+from functools import lru_cache
+
+# "auto" takes the first of MODES whose memory estimate fits in
+# memory_budget_bytes; any other entry of MODES forces that mode.
+mode = os.environ.get("QAOA_SIMULATION_MODE", "auto")
+MODES = ["statevector", "statevector_single", "matrix_product_state", "sampling"]
+
+def _default_memory_budget():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 * 2**30
+
+memory_budget_bytes = int(float(os.environ["QAOA_MEMORY_BUDGET_MB"]) * 2**20) if "QAOA_MEMORY_BUDGET_MB" in os.environ else _default_memory_budget()
+# Bonds of the matrix product state are truncated to this dimension. It is
+# exact while 2^floor(n / 2) <= 256, up to 17 qubits, and approximate above;
+# the SimulationMode reason then says so, and a warning is issued.
+mps_max_bond_dimension = 256
+# Shots per parameter set in the sampling mode, and the seed they are drawn with.
+shots = 8192
+seed = None
+
+class SimulationMode:
+    # method is the Aer method noisy trajectories run with (see Noise.py).
+    def __init__(self, name, estimate_bytes, reason, method=None):
+        self.name = name
+        self.estimate_bytes = estimate_bytes
+        self.reason = reason
+        self.method = method
+
+    @property
+    def sampled(self):
+        return self.name in ("sampling", "trajectories")
+
+    def __str__(self):
+        return f"{self.name} ({self.reason})"
+
+    def __repr__(self):
+        return f"SimulationMode({self.name!r}, {self.estimate_bytes}, {self.reason!r})"
+
+def format_bytes(n):
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if n < 1024 or unit == "TiB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+def _mps_bytes(num_qubits):
+    # Per qubit, two bond x bond complex matrices, where the bond at cut k is
+    # at most 2^min(k, n - k) and never more than the truncation.
+    bonds = [min(2**min(k, num_qubits - k), mps_max_bond_dimension) for k in range(1, num_qubits + 1)]
+    return sum(2 * 16 * bond**2 for bond in bonds)
+
+def mps_truncated(num_qubits):
+    # Whether a matrix product state of num_qubits may need bonds larger than
+    # mps_max_bond_dimension, the largest being 2^floor(n / 2).
+    return 2**(num_qubits // 2) > mps_max_bond_dimension
+
+def mps_caveat(num_qubits):
+    # Added to the reason of a mode that runs a matrix product state, and
+    # warned about, when its bonds are truncated.
+    if not mps_truncated(num_qubits):
+        return ""
+    message = f"bonds of {num_qubits} qubits are truncated to {mps_max_bond_dimension}, so results are approximate"
+    warnings.warn(f"Matrix product state {message}; raise Simulators.mps_max_bond_dimension for exact results", stacklevel=3)
+    return f"; {message}"
+
+def state_bytes(name, num_qubits):
+    # Size of the state the simulator evolves in one run of a mode (or of an
+    # Aer method, for noisy trajectories).
+    if name == "statevector":
+        return 16 * 2**num_qubits
+    if name == "statevector_single":
+        return 8 * 2**num_qubits
+    if name in ("matrix_product_state", "sampling"):
+        return _mps_bytes(num_qubits)
+    raise ValueError(f"Unknown simulation mode {name!r}, expected one of {MODES}")
+
+def memory_estimate(name, num_qubits, choice_qubits):
+    # Memory held by the simulator during one run: the state, plus the result
+    # it hands back. The probability modes return all 2^N choice probabilities;
+    # the sampling mode returns at most one count per shot.
+    if name == "sampling":
+        return state_bytes(name, num_qubits) + 100 * min(shots, 2**choice_qubits)
+    return state_bytes(name, num_qubits) + 8 * 2**choice_qubits
+
+def select(num_qubits, choice_qubits, budget=None):
+    budget = memory_budget_bytes if budget is None else budget
+    if mode != "auto":
+        estimate = memory_estimate(mode, num_qubits, choice_qubits)
+        reason = f"forced by Simulators.mode, needs {format_bytes(estimate)} for {num_qubits} qubits"
+        if mode in ("matrix_product_state", "sampling"):
+            reason += mps_caveat(num_qubits)
+        return SimulationMode(mode, estimate, reason)
+    rejected = []
+    for name in MODES:
+        estimate = memory_estimate(name, num_qubits, choice_qubits)
+        if estimate <= budget:
+            reason = f"{num_qubits} qubits need {format_bytes(estimate)} of the {format_bytes(budget)} budget"
+            if rejected:
+                reason += f"; {', '.join(rejected)} would not fit"
+            if name in ("matrix_product_state", "sampling"):
+                reason += mps_caveat(num_qubits)
+            return SimulationMode(name, estimate, reason)
+        rejected.append(f"{name} {format_bytes(estimate)}")
+    raise MemoryError(f"No simulation mode fits {num_qubits} qubits in {format_bytes(budget)}: {', '.join(rejected)}")
+
+@lru_cache(maxsize=None)
+def _simulator(name, bond_dimension):
+    from qiskit_aer import AerSimulator
+    if name == "statevector":
+        return AerSimulator(method="statevector")
+    if name == "statevector_single":
+        return AerSimulator(method="statevector", precision="single")
+    return AerSimulator(method="matrix_product_state", matrix_product_state_max_bond_dimension=bond_dimension)
+
+def simulator_for(simulation_mode):
+    return _simulator(simulation_mode.name, mps_max_bond_dimension)
+
+def run_circuit(circuit, choice_qubits, sampled):
+    # The QAOA circuit ends by saving the full statevector and measuring every
+    # qubit. Runs only need the choice register: its probabilities, or samples.
+    body = circuit.copy_empty_like()
+    for instruction in circuit.data:
+        if instruction.operation.name not in ("save_statevector", "measure", "barrier"):
+            body.append(instruction)
+    if sampled:
+        body.measure(range(choice_qubits), range(choice_qubits))
+    else:
+        body.save_probabilities(list(range(choice_qubits)))
+    return body
@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+
+# Where the solver service (see Service.py) listens.
+service_url = os.environ.get("QAOA_SERVICE_URL", "http://127.0.0.1:8765")
+timeout = 10
+
+class ServiceBusy(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class SolverClient:
+    # The HTTP side of the solver service, with the job snapshots of
+    # Jobs.Job.snapshot. Only the standard library is needed, so importing it
+    # loads none of the solver.
+    def __init__(self, url=service_url):
+        self.url = url.rstrip("/")
+
+    def _request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body, default=str).encode()
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            content = json.loads(e.read() or b"{}")
+            if e.code == 503:
+                raise ServiceBusy(content.get("error", "Solver service is busy"), int(e.headers.get("Retry-After", 1))) from None
+            if e.code == 404:
+                return None
+            raise RuntimeError(content.get("error", str(e))) from None
+
+    def healthy(self):
+        try:
+            return self._request("GET", "/health") is not None
+        except (OSError, ValueError):
+            return False
+
+    def submit(self, kind, **inputs):
+        return _decode(self._request("POST", "/jobs", {"kind": kind, **inputs}))
+
+    def snapshot(self, job_id):
+        if job_id is None:
+            return None
+        return _decode(self._request("GET", f"/jobs/{job_id}"))
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+def _decode_result(result):
+    result = dict(result)
+    if result.get("best_known_solution") is not None:
+        result["best_known_solution"] = np.array(result["best_known_solution"])
+    return result
+
+def _decode(snapshot):
+    # JSON turns the numpy arrays of a result into lists and the budgets
+    # keying a sweep into strings; undo both.
+    if snapshot is None or not snapshot.get("result"):
+        return snapshot
+    result = snapshot["result"]
+    if "stocks" in result:
+        snapshot["result"] = _decode_result(result)
+    else:
+        snapshot["result"] = {int(budget): _decode_result(entry) for budget, entry in result.items()}
+    return snapshot
+
+def connection_refused(error):
+    # Whether a request failed because nothing listens at the service's
+    # address, so it never reached a service. urlopen wraps the socket error.
+    return isinstance(getattr(error, "reason", error), ConnectionRefusedError)
+
+def connect(url=service_url, start=True, wait=60):
+    # A client for the service at url. If nothing answers there and start is
+    # set, a service is started in the background on that port.
+    client = SolverClient(url)
+    if client.healthy() or not start:
+        return client
+    port = url.rstrip("/").rsplit(":", 1)[-1]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.Popen(
+        [sys.executable, "-m", "backend_theoretical.Service", "--port", port],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        if client.healthy():
+            return client
+        time.sleep(0.5)
+    raise RuntimeError(f"The solver service did not start at {url}; run python -m backend_theoretical.Service")
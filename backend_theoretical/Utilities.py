@@ -1,44 +1,232 @@
-from functools import partial
+from functools import lru_cache
+import copy
+import time
+import warnings
 import numpy as np
-from qiskit import Aer, transpile
-from qiskit.providers.aer import QasmSimulator
-from scipy.optimize import shgo
 from . import KnapsackMethod
-from . import Circuits
-from qiskit import BasicAer
+from . import ChoiceTables
+from . import Instrumentation
+from . import Simulators
+from . import Sampling
+from . import Noise
+from .ChoiceSpace import ChoiceSpaceSimulator, ChoiceSpaceCircuit
 
-backend = Aer.get_backend("aer_simulator_statevector")
+# qiskit, qiskit-aer and scipy are imported where they are first needed, so
+# importing this module (and the choice-space solver path) stays cheap.
+# Runs the Aer circuit as noisy Monte Carlo trajectories under Noise.noise_model.
 is_apply_noise = False
+# "aer" runs the full QuantumWalkQAOA circuit, "choice_space" runs the same
+# layers on the 2^N choice register only (see ChoiceSpace.py). "spectral"
+# replaces the m walk steps of each mixer by the continuous-time walk they
+# approximate, applied through a cached eigendecomposition (see
+# CompiledProblem.py).
+simulator = "aer"
+# The spectral search ends with at most spectral_refine_maxiter Nelder-Mead
+# iterations on the circuit's m walk steps, so the angles it returns are the
+# circuit's own.
+spectral_refine_maxiter = 30
+CHOICE_SPACE_SIMULATORS = ("choice_space", "spectral")
+# Number of parameter sets submitted to Aer in one job by the batched API.
+batch_size = 64
+# A budget sweep refines the previous budget's angles for at most
+# sweep_refine_maxiter iterations, and runs the global search again when they
+# reach less than sweep_fallback of the previous budget's approximation ratio.
+sweep_refine_maxiter = 30
+sweep_fallback = 0.9
+# Module settings a spawned worker process must share with its parent; it
+# starts from the defaults otherwise. See settings() and apply_settings().
+WORKER_SETTINGS = {
+    "Utilities": ["is_apply_noise", "simulator", "batch_size"],
+    "CircuitCache": ["cache_dir"],
+    "Simulators": ["mode", "memory_budget_bytes", "mps_max_bond_dimension", "shots", "seed"],
+    "Noise": ["gate_errors", "readout_error", "workers", "min_chunk"],
+}
+
+def get_backend():
+    # Circuits are transpiled for this backend; they run on the simulator that
+    # Simulators.select picks for their size (see simulation_mode). It is
+    # created on first use, after which it is the module attribute backend,
+    # and can be replaced by assigning Utilities.backend.
+    global backend
+    try:
+        return backend
+    except NameError:
+        from qiskit_aer import Aer
+        backend = Aer.get_backend("aer_simulator_statevector")
+        return backend
+
+def __getattr__(name):
+    if name == "backend":
+        return get_backend()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_statevector(transpiled_circuit, parameter_dict):
+    # With noise, the statevector of a single trajectory.
     bound_circuit = transpiled_circuit.bind_parameters(parameter_dict)
     if is_apply_noise:
-        result = backend.run(bound_circuit, shots=1).result()
+        seed = {} if Simulators.seed is None else {"seed_simulator": Simulators.seed}
+        result = Noise.simulator().run(bound_circuit, shots=1, **seed).result()
     else:
-        result = backend.run(bound_circuit, shots=1).result()
+        result = get_backend().run(bound_circuit, shots=1).result()
     statevector = result.get_statevector()
+    Instrumentation.count("simulator.calls")
+    Instrumentation.observe_max("statevector.bytes", statevector.data.nbytes)
     return statevector
 
+def choice_probabilities(statevector, problem):
+    # The choice register holds the lowest N qubits, so the marginal over it
+    # is a sum over the remaining (weight and flag) qubits.
+    probs = np.abs(np.asarray(statevector)) ** 2
+    return probs.reshape(-1, 2**problem.N).sum(axis=0)
+
+@lru_cache(maxsize=32)
+def _value_tables(fingerprint):
+    values, weights, max_weight = fingerprint
+    tables = ChoiceTables.tables(values, weights)
+    feasible = tables.feasible(max_weight)
+    comparable = np.where(feasible, tables.values, 0.0)
+    comparable.setflags(write=False)
+    return tables.values, feasible, comparable
+
+def value_vector(problem):
+    return _value_tables(KnapsackMethod.fingerprint(problem))[0]
+
+def feasibility_vector(problem):
+    return _value_tables(KnapsackMethod.fingerprint(problem))[1]
+
+def comparable_value_vector(problem):
+    return _value_tables(KnapsackMethod.fingerprint(problem))[2]
+
+def expectation(probs, vector):
+    return float(np.dot(probs, vector))
+
+def top_k(probs, k):
+    k = min(k, len(probs))
+    indices = np.argpartition(-probs, k - 1)[:k]
+    indices = indices[np.lexsort((indices, -probs[indices]))]
+    return indices, probs[indices]
+
+def index_to_bitstring(index, problem):
+    return format(int(index), f"0{problem.N}b")
+
+def to_probs_dict(probs, problem, k=None):
+    if k is None:
+        indices = np.flatnonzero(probs)
+    else:
+        indices = np.sort(top_k(probs, k)[0])
+    return {index_to_bitstring(index, problem): float(probs[index]) for index in indices}
+
+def probs_dict_to_array(probs_dict, problem):
+    probs = np.zeros(2**problem.N)
+    mask = 2**problem.N - 1
+    for bitstring, prob in probs_dict.items():
+        probs[int(bitstring, 2) & mask] += prob
+    return probs
+
 def average_value(probs_dict, func):
     bitstrings = list(probs_dict.keys())
     values = np.array(list(map(func, bitstrings)))
     probs = np.array(list(probs_dict.values()))
     return sum(values * probs)
 
-def optimize_angles(p, angles_to_value, gamma_range, beta_range):
+def optimize_angles(p, angles_to_value, gamma_range, beta_range, workers=1):
+    from scipy.optimize import shgo
+    bounds = np.array([gamma_range, beta_range] * p)
+    result = shgo(angles_to_value, bounds, iters=3, workers=workers)
+    return result.x
+
+def refine_angles(angles_to_value, initial_angles, gamma_range, beta_range, maxiter=200):
+    from scipy.optimize import minimize
+    p = len(initial_angles) // 2
     bounds = np.array([gamma_range, beta_range] * p)
-    result = shgo(angles_to_value, bounds, iters=3)
+    initial_angles = np.clip(initial_angles, bounds[:, 0], bounds[:, 1])
+    result = minimize(angles_to_value, initial_angles, method="Nelder-Mead", bounds=bounds, options={"maxiter": maxiter, "xatol": 1e-4, "fatol": 1e-8})
     return result.x
 
+def interpolate_angles(angles):
+    # INTERP initialisation (Zhou et al., PRX 10, 021067): the depth p+1
+    # schedules are linear interpolations of the optimized depth p schedules.
+    def interpolate(schedule):
+        p = len(schedule)
+        padded = np.concatenate([[0.0], schedule, [0.0]])
+        return np.array([(i / p) * padded[i] + ((p - i) / p) * padded[i + 1] for i in range(p + 1)])
+    angles = np.asarray(angles, dtype=float)
+    gammas, betas = interpolate(angles[0::2]), interpolate(angles[1::2])
+    return np.ravel(np.column_stack([gammas, betas]))
+
+def extend_angles(angles):
+    # A layer with gamma = beta = 0 is the identity, so this reproduces the
+    # depth p state exactly at depth p+1.
+    return np.concatenate([np.asarray(angles, dtype=float), [0.0, 0.0]])
+
+def batch_map(batch_angles_to_value):
+    # Map-like callable for shgo's `workers`: the sampling points of an
+    # iteration arrive together and are evaluated as a single batch.
+    def map_batch(func, points):
+        points = list(points)
+        if not points:
+            return []
+        return list(batch_angles_to_value(np.array(points)))
+    return map_batch
+
+def optimize_angles_population(p, batch_angles_to_value, gamma_range, beta_range, population=64, generations=8, elite=8, seed=None):
+    # Cross-entropy search: sample a population, refit a Gaussian to the best
+    # candidates and resample, evaluating each generation as one batch.
+    from scipy.stats import qmc
+    bounds = np.array([gamma_range, beta_range] * p)
+    low, high = bounds[:, 0], bounds[:, 1]
+    rng = np.random.default_rng(seed)
+    candidates = qmc.scale(qmc.LatinHypercube(d=2 * p, seed=rng).random(population), low, high)
+    best_angles, best_value = None, np.inf
+    for __ in range(generations):
+        values = np.asarray(batch_angles_to_value(candidates))
+        order = np.argsort(values)
+        if values[order[0]] < best_value:
+            best_angles, best_value = candidates[order[0]].copy(), values[order[0]]
+        elites = candidates[order[:elite]]
+        std = np.maximum(elites.std(axis=0), 1e-3 * (high - low))
+        candidates = np.clip(rng.normal(elites.mean(axis=0), std, size=(population, 2 * p)), low, high)
+        candidates[0] = best_angles
+    return best_angles
+
+def optimize_angles_gradient(p, angles_to_value_and_gradient, gamma_range, beta_range, starts=8, initial_angles=None, seed=None):
+    # L-BFGS-B within the same box as shgo, from a Latin hypercube of starting
+    # points unless starting angles are given.
+    from scipy.optimize import minimize
+    from scipy.stats import qmc
+    bounds = np.array([gamma_range, beta_range] * p)
+    low, high = bounds[:, 0], bounds[:, 1]
+    if initial_angles is None:
+        initial_angles = qmc.scale(qmc.LatinHypercube(d=2 * p, seed=seed).random(starts), low, high)
+    best = None
+    for angles in np.atleast_2d(initial_angles):
+        result = minimize(angles_to_value_and_gradient, np.clip(angles, low, high), jac=True, method="L-BFGS-B", bounds=bounds)
+        if best is None or result.fun < best.fun:
+            best = result
+    return best.x
+
 def bitstring_to_choice(bitstring, problem):
     bits = np.array(list(map(int, list(bitstring))))[::-1]
     choice = np.array(bits[:problem.N])
     return choice
 
+def bitstring_to_code(bitstring, problem):
+    # The choice register is the lowest N bits of a (possibly longer) bitstring.
+    return int(bitstring, 2) & (2**problem.N - 1)
+
 def objective_function(bitstring, problem):
-    choice = bitstring_to_choice(bitstring, problem)
-    value = choice.dot(problem.values)
-    return value
+    return value_vector(problem)[bitstring_to_code(bitstring, problem)]
+
+def to_parameter_binds(angles_batch, circuit):
+    angles_batch = np.atleast_2d(angles_batch)
+    binds = {}
+    for parameter, values in zip(circuit.betas, angles_batch[:, 1::2].T):
+        binds[parameter] = values.tolist()
+    for parameter, values in zip(circuit.gammas, angles_batch[:, 0::2].T):
+        binds[parameter] = values.tolist()
+    if circuit.offset is not None:
+        binds[circuit.offset_parameter] = [circuit.offset] * len(angles_batch)
+    return binds
 
 def to_parameter_dict(angles, circuit):
     gammas = angles[0::2]
@@ -48,51 +236,429 @@ def to_parameter_dict(angles, circuit):
         parameters[parameter] = value
     for parameter, value in zip(circuit.gammas, gammas):
         parameters[parameter] = value
+    if circuit.offset is not None:
+        parameters[circuit.offset_parameter] = circuit.offset
     return parameters
 
+@lru_cache(maxsize=16)
+def _choice_space_simulator(fingerprint, m, layout):
+    values, weights, max_weight = fingerprint
+    problem = KnapsackMethod.KnapsackProblem(list(values), list(weights), max_weight)
+    return ChoiceSpaceSimulator(problem, m, layout=layout)
+
+def spectral_applies(problem, m, layout=None):
+    # The spectral simulator only takes problems whose generator it can
+    # diagonalize; larger ones run on the walk simulator, which is faster
+    # there than any other way of applying the continuous walk.
+    if simulator != "spectral":
+        return False
+    from . import CompiledProblem
+    walk = _choice_space_simulator(KnapsackMethod.fingerprint(problem), m, layout)
+    return len(walk.states) <= CompiledProblem.max_dense_states
+
+def walk_simulator(problem, m, layout=None):
+    return _choice_space_simulator(KnapsackMethod.fingerprint(problem), m, layout)
+
+def choice_space_simulator(problem, m, layout=None):
+    if spectral_applies(problem, m, layout):
+        from . import CompiledProblem
+        return CompiledProblem.compiled_problem(problem, layout)
+    if simulator == "spectral":
+        from . import CompiledProblem
+        warnings.warn(f"{len(walk_simulator(problem, m, layout).states)} feasible choices exceed CompiledProblem.max_dense_states = {CompiledProblem.max_dense_states}; the spectral simulator runs the walk steps instead", stacklevel=2)
+    return walk_simulator(problem, m, layout)
+
+def circuit_choice_probabilities(circuit, problem, angles):
+    # The choice distribution the circuit itself gives at angles. The
+    # spectral simulator optimizes the continuous-time limit of the mixers,
+    # so results are reported from the circuit's m walk steps instead.
+    if spectral_applies(problem, circuit.m, circuit.oracle_layout):
+        return walk_simulator(problem, circuit.m, circuit.oracle_layout).probabilities(angles)
+    return get_choice_probabilities(circuit, problem, angles)
+
+def transpiled(circuit):
+    from . import CircuitCache
+    if isinstance(circuit, CircuitCache.TranspiledQAOA):
+        return circuit
+    budget_sweep = circuit.offset_parameter is not None
+    result = CircuitCache.get_transpiled(circuit.problem, circuit.p, circuit.m, get_backend(), circuit=circuit, budget_sweep=budget_sweep)
+    if circuit.offset is not None:
+        result = copy.copy(result)
+        result.offset = circuit.offset
+    return result
+
+def prepare_circuit(problem, p, m, progress=None, budget_sweep=False):
+    # The choice-space simulator never runs the circuit, so it is not built
+    # at all; otherwise reuse a cached transpiled circuit if there is one.
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        if is_apply_noise:
+            raise ValueError(f"The {simulator} simulator has no noise; use the aer simulator with is_apply_noise")
+        return ChoiceSpaceCircuit(problem, p, m, budget_sweep=budget_sweep)
+    from . import CircuitCache
+    return CircuitCache.get_transpiled(problem, p, m, get_backend(), progress=progress, budget_sweep=budget_sweep)
+
+def settings():
+    import importlib
+    snapshot = {}
+    for module, names in WORKER_SETTINGS.items():
+        module = importlib.import_module(f".{module}", __package__)
+        snapshot[module.__name__] = {name: copy.deepcopy(getattr(module, name)) for name in names}
+    return snapshot
+
+def apply_settings(snapshot):
+    import importlib
+    for module, values in snapshot.items():
+        module = importlib.import_module(module)
+        for name, value in values.items():
+            setattr(module, name, value)
+
+def bound_offset(circuit, offset):
+    # The circuit with its budget-sweep oracle offset bound to offset.
+    view = copy.copy(circuit)
+    view.offset = offset
+    return view
+
+def budget_circuit(circuit, budget):
+    # A budget-sweep circuit with its oracle offset bound to one budget. The
+    # registers stay sized for the sweep's largest budget, so the offset is
+    # taken from the circuit's layout rather than from the budget alone.
+    n, c = circuit.oracle_layout
+    if not 0 <= budget < 2**c:
+        raise ValueError(f"Budget {budget} does not fit the {c}-bit budget register of this circuit")
+    return bound_offset(circuit, 2**c - budget - 1)
+
+def simulation_mode(circuit):
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        return Simulators.SimulationMode(simulator, 16 * 2**circuit.problem.N, f"Utilities.simulator is {simulator}")
+    if is_apply_noise:
+        return Noise.select(transpiled(circuit).circuit.num_qubits, circuit.problem.N)
+    return Simulators.select(transpiled(circuit).circuit.num_qubits, circuit.problem.N)
+
+def run_batch(circuit, angles_batch, shots=None, seed=None, mode=None):
+    # One Aer job for a batch of parameter sets, in the mode picked for the
+    # circuit unless one is given. Returns the result and the mode.
+    transpiled_circuit = transpiled(circuit)
+    mode = simulation_mode(transpiled_circuit) if mode is None else mode
+    run_circuit = transpiled_circuit.run_circuits.get(mode.sampled)
+    if run_circuit is None:
+        run_circuit = Simulators.run_circuit(transpiled_circuit.circuit, circuit.problem.N, mode.sampled)
+        transpiled_circuit.run_circuits[mode.sampled] = run_circuit
+    options = {"shots": shots or Simulators.shots} if mode.sampled else {"shots": 1}
+    seed = Simulators.seed if seed is None else seed
+    if mode.sampled and seed is not None:
+        options["seed_simulator"] = seed
+    binds = to_parameter_binds(angles_batch, transpiled_circuit)
+    backend = Noise.simulator(mode.method) if mode.name == "trajectories" else Simulators.simulator_for(mode)
+    result = backend.run(run_circuit, parameter_binds=[binds], max_parallel_experiments=0, **options).result()
+    Instrumentation.count("simulator.calls", len(angles_batch))
+    # Aer keeps the state to itself; this is the size of the one it evolved.
+    Instrumentation.observe_max("statevector.bytes", Simulators.state_bytes(mode.method or mode.name, run_circuit.num_qubits))
+    Instrumentation.observe_max("simulator.estimated_bytes", mode.estimate_bytes)
+    return result, mode
+
+def sampled_choices(result, i, problem):
+    # Distinct sampled choices and how often each was drawn.
+    counts = result.data(i)["counts"]
+    indices = np.array([int(key, 16) for key in counts], dtype=np.int64) & (2**problem.N - 1)
+    return indices, np.array(list(counts.values()), dtype=float)
+
+def result_choice_probabilities(result, i, mode, problem):
+    if mode.sampled:
+        indices, counts = sampled_choices(result, i, problem)
+        return np.bincount(indices, weights=counts, minlength=2**problem.N) / counts.sum()
+    return np.asarray(result.data(i)["probabilities"])
+
+def result_expectation(result, i, mode, problem):
+    return expectation(result_choice_probabilities(result, i, mode, problem), value_vector(problem))
+
+def sample_batch(circuit, angles_batch, shots, seed):
+    # Sampled choices and their counts for every parameter set. Noisy
+    # trajectories are split into chunks that run concurrently (see Noise.py).
+    problem = circuit.problem
+    if simulation_mode(circuit).name != "trajectories":
+        result, __ = run_batch(circuit, angles_batch, shots=shots, seed=seed)
+        return [sampled_choices(result, i, problem) for i in range(len(angles_batch))]
+    def run_chunk(chunk_shots, chunk_seed):
+        result, __ = run_batch(circuit, angles_batch, shots=chunk_shots, seed=chunk_seed)
+        return [sampled_choices(result, i, problem) for i in range(len(angles_batch))]
+    chunks = Noise.run_chunks(run_chunk, shots, seed)
+    samples = []
+    for parts in zip(*chunks):
+        indices, inverse = np.unique(np.concatenate([indices for indices, __ in parts]), return_inverse=True)
+        samples.append((indices, np.bincount(inverse, weights=np.concatenate([counts for __, counts in parts]))))
+    return samples
+
+def sampled_estimates(circuit, problem, angles_batch):
+    # Draws shots for every parameter set in rounds until each expectation is
+    # within Sampling.tolerance, streaming them into a Sampling.StreamingEstimate
+    # rather than building the 2^N distribution. Each round samples the sets
+    # that still need shots, as many as the one that needs the most. With
+    # noise every shot is one trajectory, so the number of trajectories
+    # adapts the same way.
+    transpiled_circuit = transpiled(circuit)
+    angles_batch = np.atleast_2d(angles_batch)
+    rng = np.random.default_rng(Simulators.seed)
+    estimates = [Sampling.StreamingEstimate(problem) for __ in angles_batch]
+    pending = list(range(len(angles_batch)))
+    shots = Sampling.min_shots
+    while pending:
+        samples = sample_batch(transpiled_circuit, angles_batch[pending], shots, int(rng.integers(2**31)))
+        for i, (indices, counts) in zip(pending, samples):
+            estimates[i].add(indices, counts)
+        pending = [i for i in pending if not estimates[i].done]
+        shots = max((estimates[i].shots_needed() for i in pending), default=0)
+    Instrumentation.count("sampling.shots", sum(estimate.shots for estimate in estimates))
+    return estimates
+
+def get_sampled_estimate(circuit, problem, angles):
+    return sampled_estimates(circuit, problem, [angles])[0]
+
+def get_choice_probabilities(circuit, problem, angles):
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        return choice_space_simulator(problem, circuit.m, circuit.oracle_layout).probabilities(angles)
+    result, mode = run_batch(circuit, np.atleast_2d(angles))
+    return result_choice_probabilities(result, 0, mode, problem)
+
 def get_probs_dict(circuit, problem, angles, choices_only=True):
-    transpiled_circuit = transpile(circuit, backend)
-    parameter_dict = to_parameter_dict(angles, circuit)
-    statevector = get_statevector(transpiled_circuit, parameter_dict)
     if choices_only:
-        probs_dict = statevector.probabilities_dict(range(problem.N))
-    else:
-        probs_dict = statevector.probabilities_dict()
-    return probs_dict
+        return to_probs_dict(get_choice_probabilities(circuit, problem, angles), problem)
+    transpiled_circuit = transpiled(circuit)
+    parameter_dict = to_parameter_dict(angles, transpiled_circuit)
+    statevector = get_statevector(transpiled_circuit.circuit, parameter_dict)
+    return statevector.probabilities_dict()
 
 def get_expectation_value(circuit, problem, angles):
-    probs_dict = get_probs_dict(circuit, problem, angles)
-    obj = partial(objective_function, problem=problem)
-    return average_value(probs_dict, obj)
-
-def find_optimal_angles(circuit, problem):
-    transpiled_circuit = transpile(circuit, backend)
-    obj = partial(objective_function, problem=problem)
-    angles_to_parameters = partial(to_parameter_dict, circuit=circuit)
+    probs = get_choice_probabilities(circuit, problem, angles)
+    return expectation(probs, value_vector(problem))
+
+def get_objective(circuit, problem):
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        choice_space = choice_space_simulator(problem, circuit.m, circuit.oracle_layout)
+        def angles_to_value(angles):
+            return -choice_space.expectation_value(angles)
+        return angles_to_value
+    transpiled_circuit = transpiled(circuit)
     def angles_to_value(angles):
-        parameter_dict = angles_to_parameters(angles)
-        statevector = get_statevector(transpiled_circuit, parameter_dict)
-        probs_dict = statevector.probabilities_dict()
-        value = -average_value(probs_dict, obj)
-        return value
+        if simulation_mode(transpiled_circuit).sampled:
+            return -get_sampled_estimate(transpiled_circuit, problem, angles).mean
+        result, mode = run_batch(transpiled_circuit, np.atleast_2d(angles))
+        return -result_expectation(result, 0, mode, problem)
+    return angles_to_value
+
+def gradient_mode(circuit):
+    # The mode finite-difference gradients are taken in. Sampled expectations
+    # are too noisy to difference; single precision is replaced by double
+    # precision when that fits the memory budget.
+    mode = simulation_mode(circuit)
+    if mode.name == "trajectories":
+        raise ValueError("Gradients need exact expectations, but noisy runs only estimate them from trajectories; use a gradient-free method")
+    if mode.name == "sampling":
+        raise ValueError(f"Gradients need exact expectations, which the sampling mode only estimates ({mode.reason}); use a gradient-free method")
+    if mode.name == "statevector_single":
+        estimate = Simulators.memory_estimate("statevector", transpiled(circuit).circuit.num_qubits, circuit.problem.N)
+        if estimate <= Simulators.memory_budget_bytes:
+            return Simulators.SimulationMode("statevector", estimate, f"double precision for gradients, needs {Simulators.format_bytes(estimate)}")
+    return mode
+
+def gradient_step(mode):
+    # Central differences lose eps / step to rounding and step^2 to
+    # truncation, which balance at a step of eps^(1/3).
+    precision = np.float32 if mode.name == "statevector_single" else np.float64
+    return float(np.finfo(precision).eps ** (1 / 3))
+
+def get_expectation_gradient(circuit, problem, angles, step=None):
+    angles = np.asarray(angles, dtype=float)
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        return choice_space_simulator(problem, circuit.m, circuit.oracle_layout).expectation_and_gradient(angles)[1]
+    # Aer returns no gradients, so take central differences, submitted as one
+    # batch of 4p parameter sets.
+    mode = gradient_mode(transpiled(circuit))
+    step = gradient_step(mode) if step is None else step
+    shifts = step * np.eye(len(angles))
+    values = batch_expectation_values(circuit, problem, np.concatenate([angles + shifts, angles - shifts]), mode=mode)
+    return (values[:len(angles)] - values[len(angles):]) / (2 * step)
+
+def get_objective_and_gradient(circuit, problem):
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        choice_space = choice_space_simulator(problem, circuit.m, circuit.oracle_layout)
+        def angles_to_value_and_gradient(angles):
+            value, gradient = choice_space.expectation_and_gradient(angles)
+            return -value, -gradient
+        return angles_to_value_and_gradient
+    objective = get_objective(circuit, problem)
+    def angles_to_value_and_gradient(angles):
+        return objective(angles), -get_expectation_gradient(circuit, problem, angles)
+    return angles_to_value_and_gradient
+
+def batch_expectation_values(circuit, problem, angles_batch, mode=None):
+    angles_batch = np.atleast_2d(np.asarray(angles_batch, dtype=float))
+    if simulator in CHOICE_SPACE_SIMULATORS:
+        return choice_space_simulator(problem, circuit.m, circuit.oracle_layout).expectation_values(angles_batch)
+    transpiled_circuit = transpiled(circuit)
+    expectations = []
+    for start in range(0, len(angles_batch), batch_size):
+        chunk = angles_batch[start:start + batch_size]
+        if (mode or simulation_mode(transpiled_circuit)).sampled:
+            expectations.extend(estimate.mean for estimate in sampled_estimates(transpiled_circuit, problem, chunk))
+            continue
+        result, chunk_mode = run_batch(transpiled_circuit, chunk, mode=mode)
+        expectations.extend(result_expectation(result, i, chunk_mode, problem) for i in range(len(chunk)))
+    return np.array(expectations)
+
+def get_batch_objective(circuit, problem):
+    def batch_angles_to_value(angles_batch):
+        return -batch_expectation_values(circuit, problem, angles_batch)
+    return batch_angles_to_value
+
+@Instrumentation.timed("optimize")
+def find_optimal_angles(circuit, problem, method="shgo", seed=None, initial_angles=None, report=None, progress=None, maxiter=200):
+    # progress, if given, is called as
+    # progress(evaluations, best_expectation, best_angles) after every
+    # evaluation. best_expectation is the optimized objective, which counts
+    # infeasible choices; best_angles are the angles it was reached at.
     p = circuit.p
-    return optimize_angles(p, angles_to_value, circuit.gamma_range(), circuit.beta_range())
+    gamma_range, beta_range = circuit.gamma_range(), circuit.beta_range()
+    evaluations = 0
+    best_expectation = -np.inf
+    best_angles = None
+    objective = get_objective(circuit, problem)
+    batch_objective = get_batch_objective(circuit, problem)
+    objective_and_gradient = get_objective_and_gradient(circuit, problem)
+    def record(values, angles_batch):
+        nonlocal evaluations, best_expectation, best_angles
+        values = np.atleast_1d(values)
+        evaluations += len(values)
+        Instrumentation.count("objective.evaluations", len(values))
+        best = int(np.argmin(values))
+        if -float(values[best]) > best_expectation:
+            best_expectation = -float(values[best])
+            best_angles = np.array(np.atleast_2d(angles_batch)[best], dtype=float)
+        if progress is not None:
+            progress(evaluations, best_expectation, best_angles)
+    def angles_to_value(angles):
+        value = objective(angles)
+        record(value, angles)
+        return value
+    def batch_angles_to_value(angles_batch):
+        values = batch_objective(angles_batch)
+        record(values, angles_batch)
+        return values
+    def angles_to_value_and_gradient(angles):
+        value, gradient = objective_and_gradient(angles)
+        record(value, angles)
+        return value, gradient
+    if method == "lbfgs" and simulator not in CHOICE_SPACE_SIMULATORS:
+        # Fails before any evaluation if the mode cannot give gradients.
+        gradient_mode(transpiled(circuit))
+    start = time.perf_counter()
+    if method == "lbfgs":
+        # Every offered starting point is refined: the extended depth p optimum
+        # is a stationary point at depth p+1, so picking by value alone could
+        # leave L-BFGS-B nowhere to go.
+        angles = optimize_angles_gradient(p, angles_to_value_and_gradient, gamma_range, beta_range, initial_angles=initial_angles, seed=seed)
+    elif initial_angles is not None:
+        # Several starting points may be offered; refine the most promising.
+        initial_angles = np.atleast_2d(initial_angles)
+        if len(initial_angles) > 1:
+            initial_angles = initial_angles[np.argmin(batch_angles_to_value(initial_angles))]
+        angles = refine_angles(angles_to_value, initial_angles.ravel(), gamma_range, beta_range, maxiter=maxiter)
+    elif method == "population":
+        angles = optimize_angles_population(p, batch_angles_to_value, gamma_range, beta_range, seed=seed)
+    elif method == "multistart":
+        from .MultiStart import multistart_angles
+        result = multistart_angles(problem, p, circuit.m, seed=seed, circuit=circuit)
+        angles = result["angles"]
+        evaluations += sum(start["evaluations"] for start in result["starts"])
+        best_expectation = result["value"]
+        if progress is not None:
+            progress(evaluations, best_expectation, np.asarray(angles, dtype=float))
+    elif method == "shgo":
+        angles = optimize_angles(p, angles_to_value, gamma_range, beta_range, workers=batch_map(batch_angles_to_value))
+    else:
+        raise ValueError(f"Unknown optimization method: {method}")
+    if spectral_applies(problem, circuit.m, circuit.oracle_layout):
+        # The search above optimized the continuous walk, which the circuit's
+        # m walk steps only approximate; finish on the walk steps themselves.
+        walk = walk_simulator(problem, circuit.m, circuit.oracle_layout)
+        best_expectation, best_angles = -np.inf, None
+        def walk_angles_to_value(angles):
+            value = -walk.expectation_value(angles)
+            record(value, angles)
+            return value
+        angles = refine_angles(walk_angles_to_value, angles, gamma_range, beta_range, maxiter=spectral_refine_maxiter)
+    if report is not None:
+        report.update(evaluations=evaluations, seconds=time.perf_counter() - start)
+    return angles
+
+def find_angles_progressively(problem, max_p, m, method="shgo", seed=None):
+    # Depth p+1 starts from the interpolated or extended depth p optimum and
+    # is only refined locally; the global search runs once, at p = 1.
+    history = []
+    angles = None
+    for p in range(1, max_p + 1):
+        circuit = prepare_circuit(problem, p, m)
+        report = {"p": p}
+        initial_angles = None if angles is None else [interpolate_angles(angles), extend_angles(angles)]
+        angles = find_optimal_angles(circuit, problem, method=method, seed=seed, initial_angles=initial_angles, report=report)
+        report["angles"] = angles
+        report["expectation"] = get_expectation_value(circuit, problem, angles)
+        history.append(report)
+    return history
+
+def sweep_budgets(values, weights, budgets, p, m, method="shgo", seed=None, warm_start=True, progress=None):
+    # Every budget shares one circuit, built and transpiled for the largest
+    # budget with the oracle offset left as a parameter. Budgets are visited
+    # in increasing order. With warm_start only the first budget gets the
+    # global search; the others briefly refine the previous budget's angles,
+    # and fall back to the global search when those do poorly.
+    budgets = sorted(budgets)
+    sweep_problem = KnapsackMethod.KnapsackProblem(values, weights, budgets[-1])
+    circuit = prepare_circuit(sweep_problem, p, m, budget_sweep=True)
+    results = []
+    angles = None
+    for budget in budgets:
+        problem = KnapsackMethod.KnapsackProblem(values, weights, budget)
+        view = budget_circuit(circuit, budget)
+        report = {"budget": budget, "p": p, "fallback": False}
+        if warm_start and angles is not None:
+            angles = find_optimal_angles(view, problem, method=method, initial_angles=angles, report=report, maxiter=sweep_refine_maxiter)
+            ratio = approximation_ratio(problem, get_choice_probabilities(view, problem, angles))
+            if ratio < sweep_fallback * results[-1]["approximation_ratio"]:
+                search_report = {}
+                search_angles = find_optimal_angles(view, problem, method=method, seed=seed, report=search_report)
+                report["evaluations"] += search_report["evaluations"]
+                report["seconds"] += search_report["seconds"]
+                report["fallback"] = True
+                if get_expectation_value(view, problem, search_angles) > get_expectation_value(view, problem, angles):
+                    angles = search_angles
+        else:
+            angles = find_optimal_angles(view, problem, method=method, seed=seed, report=report)
+        probs = circuit_choice_probabilities(view, problem, angles)
+        (top_index,), __ = top_k(probs, 1)
+        report.update(
+            angles=angles,
+            expectation=expectation(probs, value_vector(problem)),
+            approximation_ratio=approximation_ratio(problem, probs),
+            higher_prob_key=index_to_bitstring(top_index, problem),
+            best_known_solution=KnapsackMethod.classical_solutions(problem),
+        )
+        results.append(report)
+        if progress is not None:
+            progress(report)
+    return results
 
 def comparable_objective_function(bitstring, problem):
-    choice = bitstring_to_choice(bitstring, problem)
-    if KnapsackMethod.is_choice_feasible(choice, problem):
-        return KnapsackMethod.value(choice, problem)
-    return 0
+    return comparable_value_vector(problem)[bitstring_to_code(bitstring, problem)]
 
 def comparable_expectation_value(problem, probs):
-    obj = partial(comparable_objective_function, problem=problem)
-    expectation = average_value(probs, obj)
-    return expectation
+    if isinstance(probs, dict):
+        probs = probs_dict_to_array(probs, problem)
+    return expectation(probs, comparable_value_vector(problem))
 
 def approximation_ratio(problem, probs):
     expectation = comparable_expectation_value(problem, probs)
     best_known_solutions = KnapsackMethod.classical_solutions(problem)
-    choice = best_known_solutions[0]
-    best_value = KnapsackMethod.value(choice, problem)
+    code, = ChoiceTables.codes_from_choices(best_known_solutions[0])
+    best_value = value_vector(problem)[code]
     ratio = expectation / best_value
     return ratio
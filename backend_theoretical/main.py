@@ -1,14 +1,87 @@
-from .QAOA import QuantumWalkQAOA
-import matplotlib.pyplot as plt
-
 import os
+import time
 from . import KnapsackMethod
-from . import MeanVariance
 from . import Utilities
+from . import AngleStore
+from . import Instrumentation
 import datetime
 
+# The best ratio in optimizer progress reports takes a simulation of its own,
+# so it is refreshed at most once per progress_interval seconds.
+progress_interval = 5.0
+
+
+def solve(problem, p, m, progress=None, method="shgo", angle_store=None):
+    # One QAOA run for a knapsack problem at depth p with m walk steps per
+    # mixer. progress, if given, is called as progress(stage, **details) as
+    # the run moves through circuit construction and angle optimization.
+    # Angles are looked up in and added to angle_store, by default the
+    # AngleStore.default_store().
+    def report(stage, **details):
+        if progress is not None:
+            progress(stage, **details)
+
+    bks = KnapsackMethod.classical_solutions(problem)
+    best_value = KnapsackMethod.value(bks[0], problem)
+
+    print("Building Circuit...")
+    report("circuit", p=p)
+    circuit = Utilities.prepare_circuit(problem, p, m, progress=report)
+    print("Done!")
+    mode = Utilities.simulation_mode(circuit)
+    print(f"Simulation mode: {mode}")
+    print("Optimizing Angles...")
+    report("optimize", evaluations=0, best_ratio=None, simulation_mode=mode.name)
+    def comparable_ratio(angles):
+        # The ratio over feasible choices only, as reported for the result.
+        if mode.sampled:
+            return Utilities.get_sampled_estimate(circuit, problem, angles).comparable.mean / best_value
+        return Utilities.approximation_ratio(problem, Utilities.circuit_choice_probabilities(circuit, problem, angles))
+    best = {"angles": None, "ratio": None, "time": None}
+    def optimizer_progress(evaluations, best_expectation, best_angles):
+        # Evaluated again only when the optimizer has found better angles,
+        # and not within progress_interval of the previous evaluation.
+        if best_angles is not None and best_angles is not best["angles"]:
+            if best["time"] is None or time.monotonic() - best["time"] >= progress_interval:
+                with Instrumentation.span("progress.ratio"):
+                    best.update(angles=best_angles, ratio=comparable_ratio(best_angles))
+                best["time"] = time.monotonic()
+        report("optimize", evaluations=evaluations, best_ratio=best["ratio"])
+    angle_store = AngleStore.default_store() if angle_store is None else angle_store
+    angles = AngleStore.find_angles(circuit, problem, store=angle_store, method=method, progress=optimizer_progress if progress is not None else None)
+    print("Done!")
+    print(f"Angle store: {angle_store.summary()}")
+    print(f"Optimized Angles: {angles}")
+    if mode.sampled:
+        # Only the most sampled choices are kept, never the full distribution.
+        estimate = Utilities.get_sampled_estimate(circuit, problem, angles)
+        ratio = estimate.comparable.mean / best_value
+        top = estimate.top(16)
+        probs = {Utilities.index_to_bitstring(index, problem): prob for index, prob in top}
+        (top_index, top_prob), = top[:1]
+    else:
+        choice_probs = Utilities.circuit_choice_probabilities(circuit, problem, angles)
+        ratio = Utilities.approximation_ratio(problem, choice_probs)
+        probs = Utilities.to_probs_dict(choice_probs, problem)
+        (top_index,), (top_prob,) = Utilities.top_k(choice_probs, 1)
+    print(f"Probabilities of Bitstrings: {probs}")
+    print(f"Approximation Ratio: {ratio}")
+    higher_prob_key = Utilities.index_to_bitstring(top_index, problem)
+    return {
+        "p": p,
+        "m": m,
+        "angles": angles,
+        "probabilities": probs,
+        "approximation_ratio": ratio,
+        "higher_prob_key": higher_prob_key,
+        "higher_prob_key_reversed": higher_prob_key[::-1],
+        "top_probability": float(top_prob),
+        "best_known_solution": bks,
+        "simulation_mode": mode.name,
+    }
+
 
-def main(er, budget=None):
+def main(er, budget=None, progress=None):
     p = 1
     m = 5
 
@@ -17,56 +90,59 @@ def main(er, budget=None):
 
     prices = [1] * len(er)
     problem = KnapsackMethod.KnapsackProblem(er, prices, budget)
+    Utilities.is_apply_noise = False
 
-    bks = KnapsackMethod.classical_solutions(problem)
+    print(f"Problem: {problem}")
+    result = solve(problem, p, m, progress=progress)
+
+    os.makedirs("plots", exist_ok=True)
+    folder = os.path.join(
+        "plots",
+        f"{p}_{m}_{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}_NOISELESS",
+    )
+    os.makedirs(folder, exist_ok=True)
+
+    comments = [
+        f"Considered {problem}",
+        f"QAOA circuit with {p = } and {m = }",
+        f"Optimized angles: {result['angles']}",
+        f"Resulting Probabilities: {result['probabilities']}",
+        f"Best known solutions: {result['best_known_solution']}",
+        f"Approximation Ratio: {result['approximation_ratio']}",
+        f"Higher the probability: {result['top_probability']} at reversed key: {result['higher_prob_key_reversed']}",
+        f"Higher the probability: {result['top_probability']} at key: {result['higher_prob_key']}",
+    ]
+
+    file_name = f"result.txt"
+    with open(os.path.join(f"{folder}", file_name), "w") as f:
+        f.write("\n".join(comments))
+
+    return result["higher_prob_key_reversed"], result["higher_prob_key"], result["best_known_solution"], result["approximation_ratio"]
+
+
+def budget_sweep(er, budgets=None, progress=None):
+    # Results for every budget from a single transpiled circuit, in the same
+    # form main returns them, keyed by budget.
+    p = 1
+    m = 5
+
+    if budgets is None:
+        budgets = range(1, len(er))
+
+    prices = [1] * len(er)
+    print(f"Sweeping budgets {list(budgets)} for values {er}")
 
-    for p in range(1, 6):
-        Utilities.is_apply_noise = False
-
-        print(f"Problem: {problem}")
-        print("Building Circuit...")
-        circuit = QuantumWalkQAOA(problem, p=p, m=m)
-        print("Done!")
-        print("Optimizing Angles...")
-        angles = Utilities.find_optimal_angles(circuit, problem)
-        print("Done!")
-        print(f"Optimized Angles: {angles}")
-        probs = Utilities.get_probs_dict(circuit, problem, angles)
-        print(f"Probabilities of Bitstrings: {probs}")
-        ratio = Utilities.approximation_ratio(problem, probs)
-        print(f"Approximation Ratio: {ratio}")
-
-        os.makedirs("plots", exist_ok=True)
-        folder = os.path.join(
-            "plots",
-            f"{p}_{m}_{datetime.datetime.now().strftime('%Y-%m-%d_%H_%M_%S')}_NOISELESS",
-        )
-        os.makedirs(folder, exist_ok=True)
-        fig, ax = plt.subplots()
-        fig.set_size_inches(18, 10)
-
-        comments = [
-            f"Considered {problem}",
-            f"QAOA circuit with {p = } and {m = }",
-            f"Optimized angles: {angles}",
-            f"Resulting Probabilities: {probs}",
-            f"Best known solutions: {bks}",
-            f"Approximation Ratio: {ratio}",
-            f"Higher the probability: {max(probs.values())} at reversed key: {max(probs, key=probs.get)[::-1]}",
-            f"Higher the probability: {max(probs.values())} at key: {max(probs, key=probs.get)}",
-        ]
-
-        file_name = f"result.txt"
-        with open(os.path.join(f"{folder}", file_name), "w") as f:
-            f.write("\n".join(comments))
-        
-        higher_prob_key_reversed = max(probs, key=probs.get)[::-1]
-        higher_prob_key = max(probs, key=probs.get)
-        best_known_solution = bks
-        approximation_ratio = ratio
-
-        return higher_prob_key_reversed, higher_prob_key, best_known_solution, approximation_ratio
+    def report(result):
+        if progress is not None:
+            progress("budget", budget=result["budget"], best_ratio=result["approximation_ratio"])
 
+    results = Utilities.sweep_budgets(er, prices, budgets, p, m, progress=report)
+    sweep = {}
+    for result in results:
+        higher_prob_key = result["higher_prob_key"]
+        print(f"Budget {result['budget']}: {higher_prob_key[::-1]} with approximation ratio {result['approximation_ratio']}")
+        sweep[result["budget"]] = higher_prob_key[::-1], higher_prob_key, result["best_known_solution"], result["approximation_ratio"]
+    return sweep
 
 
 if __name__ == "__main__":
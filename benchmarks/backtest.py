@@ -0,0 +1,75 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import common  # Adds the project root to sys.path
+
+from backend_theoretical import Backtest
+
+
+def synthetic_prices(days, assets, seed):
+    # Correlated geometric random walks.
+    rng = np.random.default_rng(seed)
+    mixing = rng.normal(size=(assets, assets)) / np.sqrt(assets)
+    returns = 0.0003 + 0.012 * rng.normal(size=(days, assets)) @ mixing
+    prices = 100 * np.cumprod(1 + returns, axis=0)
+    return pd.DataFrame(prices, index=pd.bdate_range("2000-01-03", periods=days), columns=[f"S{i}" for i in range(assets)])
+
+
+def pypfopt_weights(prices, ends):
+    # Every window from scratch, as MeanVarianceMethod.weights does it.
+    from pypfopt import EfficientFrontier, risk_models
+    weights, covariances = [], []
+    for end in ends:
+        window_prices = prices.iloc[end - Backtest.window:end + 1]
+        cov = risk_models.CovarianceShrinkage(window_prices).ledoit_wolf()
+        ef = EfficientFrontier(None, cov, weight_bounds=Backtest.weight_bounds)
+        ef.min_volatility()
+        weights.append(list(ef.clean_weights().values()))
+        covariances.append(cov.to_numpy())
+    return np.array(weights), np.array(covariances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the rolling-window covariance and min-volatility stage of Backtest against pypfopt on every window, and check that both agree.")
+    parser.add_argument("--days", type=int, default=2520)
+    parser.add_argument("--assets", type=int, default=8)
+    parser.add_argument("--window", type=int, default=Backtest.window)
+    parser.add_argument("--step", type=int, default=5)
+    parser.add_argument("--long-only", action="store_true", help="Bound the weights to [0, 1], so every date needs an iterative solve.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Backtest.window, Backtest.step = args.window, args.step
+    if args.long_only:
+        Backtest.weight_bounds = (0, 1)
+    prices = synthetic_prices(args.days, args.assets, args.seed)
+
+    start = time.perf_counter()
+    ends, weights, __ = Backtest.window_weights(prices)
+    rolling_seconds = time.perf_counter() - start
+    returns = Backtest.daily_returns(prices)
+    covariances, __ = Backtest.ledoit_wolf(Backtest.rolling_moments(returns, ends), Backtest.window)
+
+    start = time.perf_counter()
+    reference_weights, reference_covariances = pypfopt_weights(prices, ends)
+    pypfopt_seconds = time.perf_counter() - start
+
+    cov_error = np.abs(covariances - reference_covariances).max() / np.abs(reference_covariances).max()
+    weight_error = np.abs(weights - reference_weights).max()
+    print(f"{len(ends)} windows of {args.window} days, {args.assets} assets")
+    print(f"pypfopt per window: {pypfopt_seconds:.3f} s")
+    print(f"rolling:            {rolling_seconds:.3f} s ({pypfopt_seconds / rolling_seconds:.0f}x)")
+    print(f"max relative covariance difference: {cov_error:.1e}")
+    print(f"max cleaned weight difference:      {weight_error:.1e}")
+    # Cleaned weights are rounded to 1e-5, so a weight near a rounding
+    # boundary may land on either side; the solvers themselves agree closer.
+    if cov_error > 1e-9 or weight_error > (1e-3 if args.long_only else 2e-5):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
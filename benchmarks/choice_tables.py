@@ -0,0 +1,86 @@
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import synthetic_problem
+
+from backend_theoretical import ChoiceTables, ExactSolver, Utilities
+
+
+def matrix_tables(problem, chunk_size=1 << 16):
+    # The tables as they were built before: a 0/1 matrix of every choice,
+    # a chunk at a time, times the values and weights.
+    N = problem.N
+    values, feasible = [], []
+    for start in range(0, 2**N, chunk_size):
+        codes = np.arange(start, min(start + chunk_size, 2**N), dtype=np.int64)
+        bits = ((codes[:, None] >> np.arange(N)) & 1).astype(np.int8)
+        values.append(bits @ np.asarray(problem.values, dtype=float))
+        feasible.append(bits @ np.asarray(problem.weights) <= problem.max_weight)
+    return np.concatenate(values), np.concatenate(feasible)
+
+
+def parsed_objective(bitstring, problem):
+    choice = Utilities.bitstring_to_choice(bitstring, problem)
+    if choice.dot(problem.weights) <= problem.max_weight:
+        return choice.dot(problem.values)
+    return 0
+
+
+def timed(function, repeat=1):
+    start = time.perf_counter()
+    for __ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def compare(sizes, lookups, seed):
+    rng = np.random.default_rng(seed)
+    failures = []
+    print(f"{'N':>3} {'matrix [s]':>11} {'tables [s]':>11} {'mmap load [s]':>14} {'table MiB':>10} {'parse [us]':>11} {'lookup [us]':>12} {'max |dv|':>9} {'solutions':>10}")
+    for N in sizes:
+        problem = synthetic_problem(N, weighted=True)
+        values, weights = tuple(problem.values), tuple(problem.weights)
+        matrix_seconds, (reference_values, reference_feasible) = timed(lambda: matrix_tables(problem))
+        table_seconds, tables = timed(lambda: ChoiceTables.ChoiceTables(values, weights))
+        feasible = tables.feasible(problem.max_weight)
+        # A second instance reads what the first one wrote.
+        load_seconds, __ = timed(lambda: ChoiceTables.ChoiceTables(values, weights).feasible(problem.max_weight), 3)
+        size = (tables.values.nbytes + tables.weights.nbytes + feasible.nbytes) / 2**20
+
+        bitstrings = [format(code, f"0{N}b") for code in rng.integers(2**N, size=lookups)]
+        Utilities.comparable_objective_function(bitstrings[0], problem)
+        parse_seconds, parsed = timed(lambda: [parsed_objective(b, problem) for b in bitstrings])
+        lookup_seconds, looked_up = timed(lambda: [Utilities.comparable_objective_function(b, problem) for b in bitstrings])
+
+        deviation = max(np.abs(tables.values - reference_values).max(), np.abs(np.subtract(parsed, looked_up)).max())
+        same_feasible = np.array_equal(feasible, reference_feasible)
+        solutions = ExactSolver.dp_solutions(values, weights, problem.max_weight)
+        same_solutions = ExactSolver.enumerate_solutions(values, weights, problem.max_weight) == solutions == ExactSolver.enumerate_solutions_chunked(values, weights, problem.max_weight)
+        flag = "" if deviation < 1e-9 and same_feasible and same_solutions else "  FAIL"
+        print(f"{N:>3} {matrix_seconds:>11.4f} {table_seconds:>11.4f} {load_seconds:>14.4f} {size:>10.2f} {parse_seconds / lookups * 1e6:>11.2f} {lookup_seconds / lookups * 1e6:>12.2f} {deviation:>9.1e} {'same' if same_solutions else 'differ':>10}{flag}")
+        if flag:
+            failures.append(N)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and load time of the shared choice tables against the choice-matrix products they replace, with checks that both agree.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 14, 17, 20])
+    parser.add_argument("--lookups", type=int, default=10000, help="Bitstrings evaluated per objective timing.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ChoiceTables.cache_dir = directory
+        failures = compare(args.sizes, args.lookups, args.seed)
+    if failures:
+        print(f"\nChoice tables differ from the choice matrix for N = {failures}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
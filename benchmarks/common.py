@@ -0,0 +1,36 @@
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Benchmarks run as scripts from any directory, so importing this module adds
+# the project root to sys.path, as App/app.py does.
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from backend_theoretical.KnapsackMethod import KnapsackProblem
+
+
+def synthetic_problem(N, weighted=False):
+    # Deterministic values. Unit weights with room for half the items, or
+    # with weighted, weights 1 to 3 with room for half the total weight.
+    values = [(i * 37 % 11 + 1) / 11 for i in range(N)]
+    if not weighted:
+        return KnapsackProblem(values, [1] * N, max(N // 2, 1))
+    weights = [i % 3 + 1 for i in range(N)]
+    return KnapsackProblem(values, weights, max(sum(weights) // 2, 1))
+
+
+@contextmanager
+def isolated_circuit_cache():
+    # An empty circuit cache in a temporary directory of its own, removed
+    # afterwards; the user's cache is neither read nor touched.
+    from backend_theoretical import CircuitCache
+    previous = CircuitCache.cache_dir
+    with tempfile.TemporaryDirectory() as directory:
+        CircuitCache.clear_memory()
+        CircuitCache.cache_dir = directory
+        try:
+            yield directory
+        finally:
+            CircuitCache.clear_memory()
+            CircuitCache.cache_dir = previous
@@ -0,0 +1,36 @@
+import argparse
+import time
+
+from common import synthetic_problem
+
+from backend_theoretical import Circuits
+from backend_theoretical.QAOA import QuantumWalkQAOA
+
+
+def construction_time(problem, p, m, cached):
+    Circuits.use_construction_cache = cached
+    Circuits.clear_construction_cache()
+    start = time.perf_counter()
+    QuantumWalkQAOA(problem, p=p, m=m)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time QuantumWalkQAOA construction with and without the sub-circuit cache.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(range(4, 13)))
+    parser.add_argument("--mixers", type=int, nargs="+", default=list(range(1, 11)))
+    parser.add_argument("-p", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'N':>3} {'m':>3} {'uncached [s]':>13} {'cached [s]':>11} {'speedup':>8}")
+    for N in args.sizes:
+        problem = synthetic_problem(N)
+        for m in args.mixers:
+            uncached = construction_time(problem, args.p, m, cached=False)
+            cached = construction_time(problem, args.p, m, cached=True)
+            print(f"{N:>3} {m:>3} {uncached:>13.4f} {cached:>11.4f} {uncached / cached:>7.1f}x")
+    Circuits.use_construction_cache = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import argparse
+
+from common import synthetic_problem
+
+from backend_theoretical import Instrumentation, Utilities
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the cost to convergence of the shgo angle search and gradient-based L-BFGS-B, in circuit runs.")
+    parser.add_argument("-N", type=int, default=6)
+    parser.add_argument("-m", type=int, default=5)
+    parser.add_argument("-p", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--simulator", default="choice_space", choices=["aer", "choice_space", "spectral"])
+    args = parser.parse_args()
+
+    Utilities.simulator = args.simulator
+    problem = synthetic_problem(args.N)
+    # An L-BFGS-B evaluation on Aer also runs 4p circuits for the central
+    # differences, so the methods are compared by the circuits they run
+    # (simulator.calls), not by objective evaluations.
+    print(f"{'p':>2} {'method':>6} {'evals':>7} {'circuits':>9} {'[s]':>8} {'E':>8} {'ratio':>6}")
+    for p in args.p:
+        circuit = Utilities.prepare_circuit(problem, p, args.m)
+        for method in ("shgo", "lbfgs"):
+            report = {}
+            with Instrumentation.recording() as recording:
+                angles = Utilities.find_optimal_angles(circuit, problem, method=method, seed=0, report=report)
+            circuits = recording.counters["simulator.calls"]
+            probs = Utilities.get_choice_probabilities(circuit, problem, angles)
+            value = Utilities.expectation(probs, Utilities.value_vector(problem))
+            ratio = Utilities.approximation_ratio(problem, probs)
+            print(f"{p:>2} {method:>6} {report['evaluations']:>7} {circuits:>9} {report['seconds']:>8.2f} {value:>8.4f} {ratio:>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# Modules the core solver path must not load at import: they are pulled in on
+# first use by the code paths that need them.
+DEFERRED = ["qiskit", "qiskit_aer", "scipy", "pandas", "matplotlib", "pypfopt", "yfinance", "pyarrow"]
+
+
+def import_profile(module):
+    # A fresh interpreter per measurement, so nothing is already imported.
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    # Lines look like "import time:   self [us] | cumulative | imported package".
+    profile = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = int(cumulative_us)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold import time of the solver modules with python -X importtime.")
+    parser.add_argument("--modules", nargs="+", default=["backend_theoretical.main", "backend_theoretical.Utilities"])
+    parser.add_argument("--budget", type=float, default=0.5, help="Largest allowed cold import time per module, in seconds.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8, help="Number of slowest imports to list.")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        profiles = [import_profile(module) for __ in range(args.repeat)]
+        seconds = min(profile[module] for profile in profiles) / 1e6
+        profile = min(profiles, key=lambda profile: profile[module])
+        loaded = sorted(name for name in DEFERRED if name in profile)
+        print(f"{module}: {seconds:.3f} s (budget {args.budget:.3f} s)")
+        top_level = {name: us for name, us in profile.items() if "." not in name.strip()}
+        for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {us / 1e6:8.3f} s  {name}")
+        if seconds > args.budget:
+            failures.append(f"{module} took {seconds:.3f} s")
+        if loaded:
+            failures.append(f"{module} imports {', '.join(loaded)}")
+    if failures:
+        print("\n" + "\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
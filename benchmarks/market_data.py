@@ -0,0 +1,29 @@
+import argparse
+import tempfile
+import time
+
+import common  # Adds the project root to sys.path
+
+from backend_theoretical import MarketData
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the market data store on fetched, overlapping and covered requests, on synthetic prices without network access. Correctness is checked in tests/test_market_data.py.")
+    parser.add_argument("--tickers", nargs="+", default=["AAPL", "MSFT", "GOOGL", "AMZN"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = MarketData.PriceStore(directory, MarketData.SyntheticFetcher())
+        for name, start, end in [("fetched", "2022-03-01", "2022-09-01"), ("overlapping", "2022-06-01", "2022-12-01"), ("from disk", "2022-04-01", "2022-11-01")]:
+            seconds, prices = timed(lambda: store.prices(args.tickers, start, end))
+            print(f"{name:>12}  {seconds * 1e3:8.1f} ms  {prices.shape[0]} days x {prices.shape[1]} tickers")
+
+
+if __name__ == "__main__":
+    main()
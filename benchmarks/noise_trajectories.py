@@ -0,0 +1,102 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from common import synthetic_problem
+
+from backend_theoretical import Noise, Sampling, Simulators, Utilities
+
+
+def apply_readout(probs, N):
+    # The readout error of every choice bit, applied to exact probabilities.
+    confusion = np.array([[1 - Noise.readout_error, Noise.readout_error], [Noise.readout_error, 1 - Noise.readout_error]])
+    tensor = probs.reshape((2,) * N)
+    for axis in range(N):
+        tensor = np.moveaxis(np.tensordot(confusion, tensor, axes=([1], [axis])), 0, axis)
+    return tensor.reshape(-1)
+
+
+def run_case(method, N, angles):
+    # One measurement per process, so the peak resident memory is its own.
+    problem = synthetic_problem(N)
+    Utilities.is_apply_noise = True
+    circuit = Utilities.transpiled(Utilities.prepare_circuit(problem, 1, 1))
+    mode = Utilities.simulation_mode(circuit)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if method == "density_matrix":
+        from qiskit_aer import AerSimulator
+        run_circuit = Simulators.run_circuit(circuit.circuit, N, sampled=False)
+        binds = Utilities.to_parameter_binds(np.atleast_2d(angles), circuit)
+        result = AerSimulator(method="density_matrix", noise_model=Noise.noise_model()).run(run_circuit, parameter_binds=[binds]).result()
+        probs = apply_readout(np.asarray(result.data(0)["probabilities"]), N)
+        expectation, half_width, trajectories = float(probs @ Utilities.value_vector(problem)), 0.0, 0
+    else:
+        estimate = Utilities.get_sampled_estimate(circuit, problem, angles)
+        expectation, half_width, trajectories = estimate.mean, estimate.value.half_width(), estimate.shots
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "qubits": circuit.circuit.num_qubits, "expectation": expectation, "half_width": half_width, "trajectories": trajectories,
+        "seconds": seconds, "peak_mib": peak / 1024, "added_mib": (peak - before) / 1024, "reason": mode.reason,
+    }))
+
+
+def measure(method, N, args):
+    command = [sys.executable, __file__, "--case", method, str(N), "--tolerance", str(args.tolerance), "--workers", str(args.workers)]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode:
+        return {"error": process.stderr.strip().splitlines()[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory of noisy simulation as Monte Carlo trajectories against a full density matrix, and a check that they agree.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 3, 4, 5])
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Sampling.tolerance of the trajectory estimate.")
+    parser.add_argument("--workers", type=int, default=Noise.workers)
+    parser.add_argument("--max-density-qubits", type=int, default=12, help="Larger circuits are only run as trajectories.")
+    parser.add_argument("--case", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    Sampling.tolerance = args.tolerance
+    Noise.workers = args.workers
+    angles = np.array([0.7, 1.3])
+    if args.case:
+        method, N = args.case
+        run_case(method, int(N), angles)
+        return
+
+    failures = []
+    print(f"{'N':>3} {'qubits':>6} {'dm [s]':>8} {'dm MiB':>8} {'dm need':>10} {'traj [s]':>9} {'traj MiB':>9} {'traj':>6} {'dm value':>9} {'traj value':>15}")
+    for N in args.sizes:
+        trajectories = measure("trajectories", N, args)
+        if "error" in trajectories:
+            print(f"{N:>3} trajectories failed: {trajectories['error']}")
+            failures.append(N)
+            continue
+        qubits = trajectories["qubits"]
+        need = Simulators.format_bytes(Noise.density_matrix_bytes(qubits))
+        density = measure("density_matrix", N, args) if qubits <= args.max_density_qubits else {"error": "skipped"}
+        if "error" in density:
+            dm = f"{'-':>8} {'-':>8} {need:>10} "
+            dm_value = f"{'-':>9}"
+        else:
+            dm = f"{density['seconds']:>8.2f} {density['added_mib']:>8.1f} {need:>10} "
+            dm_value = f"{density['expectation']:>9.4f}"
+            # Three half-widths, so a correct estimate fails rarely.
+            if abs(density["expectation"] - trajectories["expectation"]) > 3 * trajectories["half_width"]:
+                failures.append(N)
+        print(f"{N:>3} {qubits:>6} {dm}{trajectories['seconds']:>9.2f} {trajectories['added_mib']:>9.1f} {trajectories['trajectories']:>6} {dm_value} {trajectories['expectation']:>8.4f}±{trajectories['half_width']:.4f}")
+    if failures:
+        print(f"\nTrajectories disagree with the density matrix for N = {failures}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from common import synthetic_problem
+
+from qiskit import QuantumRegister, transpile
+from qiskit.quantum_info import Statevector, random_statevector
+from backend_theoretical import Circuits, Utilities
+from backend_theoretical.ChoiceSpace import register_layout
+from backend_theoretical.QAOA import QuantumWalkQAOA
+
+
+def build_mixer(problem, m, cancel):
+    n, c = register_layout(problem)
+    Circuits.cancel_oracle_pairs = cancel
+    choice_reg = QuantumRegister(problem.N, name="choice")
+    weight_reg = QuantumRegister(n, name="weight")
+    flag_regs = [QuantumRegister(1, name="v(x)"), QuantumRegister(1, name="v(n_j(x))"), QuantumRegister(1, name="v_j(x)")]
+    mixer = Circuits.walk_mixer(choice_reg, weight_reg, flag_regs, problem, m)
+    return mixer
+
+
+def timed_transpile(circuit):
+    start = time.perf_counter()
+    result = transpile(circuit, Utilities.backend)
+    return result, time.perf_counter() - start
+
+
+def compare(sizes, mixers, seed):
+    rng = np.random.default_rng(seed)
+    failures = []
+    print(f"{'N':>3} {'m':>2} {'oracles':>9} {'gates':>13} {'depth':>13} {'transpile [s]':>15} {'QAOA transpile [s]':>19} {'max |da|':>10}")
+    for N in sizes:
+        problem = synthetic_problem(N)
+        for m in mixers:
+            rows = {}
+            for cancel in (False, True):
+                Circuits.clear_construction_cache()
+                mixer = build_mixer(problem, m, cancel)
+                oracles = sum(1 for instruction in Circuits.inline_walk_steps(mixer).data if instruction.operation.name == "U_v")
+                transpiled_mixer, seconds = timed_transpile(mixer)
+                __, qaoa_seconds = timed_transpile(QuantumWalkQAOA(problem, p=1, m=m))
+                rows[cancel] = (mixer, transpiled_mixer, oracles, seconds, qaoa_seconds)
+            # The mixers must agree on the whole register, not only on states
+            # whose weight and flag qubits are clean.
+            beta = rng.uniform(0, np.pi)
+            state = random_statevector(2**rows[False][1].num_qubits, seed=int(rng.integers(2**31)))
+            before, after = (Statevector(state).evolve(rows[cancel][1].assign_parameters({rows[cancel][0].beta: beta})) for cancel in (False, True))
+            deviation = np.abs(before.data - after.data).max()
+            (__, plain, plain_oracles, plain_seconds, plain_qaoa), (__, cancelled, oracles, seconds, qaoa_seconds) = rows[False], rows[True]
+            flag = "" if deviation < 1e-9 else "  FAIL"
+            print(f"{N:>3} {m:>2} {plain_oracles:>4}->{oracles:<4} {plain.size():>6}->{cancelled.size():<6} {plain.depth():>6}->{cancelled.depth():<6} {plain_seconds:>7.2f}->{seconds:<7.2f} {plain_qaoa:>9.2f}->{qaoa_seconds:<9.2f} {deviation:>10.1e}{flag}")
+            if deviation >= 1e-9:
+                failures.append((N, m))
+    Circuits.cancel_oracle_pairs = True
+    Circuits.clear_construction_cache()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gate count, depth and transpile time of the walk mixer with and without oracle pair cancellation, and a check that both are the same operator.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 4, 5])
+    parser.add_argument("--mixers", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = compare(args.sizes, args.mixers, args.seed)
+    if failures:
+        print(f"\nCancelled mixers differ from the original for (N, m) = {failures}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from common import isolated_circuit_cache, synthetic_problem
+
+import qiskit
+from qiskit import transpile
+from backend_theoretical import Circuits, ExactSolver, KnapsackMethod, Utilities
+from backend_theoretical.QAOA import QuantumWalkQAOA
+
+# A reference run of the default suite, written with --output.
+reference_baseline = Path(__file__).resolve().parent / "pipeline_baseline.json"
+
+STAGES = ["construction", "transpile", "bind", "statevector", "reduction_dict", "reduction_array", "classical_solutions", "find_optimal_angles"]
+
+
+def timed(function, repeat):
+    times = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def stage_runners(problem, p, m):
+    # Inputs for each stage are prepared once, outside the timed region.
+    angles = np.linspace(0.3, 1.2, 2 * p)
+    circuit = QuantumWalkQAOA(problem, p=p, m=m)
+    transpiled_circuit = transpile(circuit, Utilities.backend)
+    parameters = Utilities.to_parameter_dict(angles, circuit)
+    statevector = Utilities.get_statevector(transpiled_circuit, parameters)
+
+    def construction():
+        Circuits.clear_construction_cache()
+        QuantumWalkQAOA(problem, p=p, m=m)
+
+    def reduction_dict():
+        probs_dict = statevector.probabilities_dict()
+        Utilities.average_value(probs_dict, lambda bitstring: Utilities.objective_function(bitstring, problem))
+
+    def reduction_array():
+        probs = Utilities.choice_probabilities(statevector, problem)
+        Utilities.expectation(probs, Utilities.value_vector(problem))
+
+    def classical_solutions():
+        ExactSolver.solve.cache_clear()
+        KnapsackMethod.classical_solutions(problem)
+
+    def find_optimal_angles():
+        # Every repeat starts from an empty circuit cache of its own, so each
+        # one includes the construction and transpile of the circuit.
+        Circuits.clear_construction_cache()
+        with isolated_circuit_cache():
+            Utilities.find_optimal_angles(Utilities.prepare_circuit(problem, p, m), problem, seed=0)
+
+    return {
+        "construction": construction,
+        "transpile": lambda: transpile(circuit, Utilities.backend),
+        "bind": lambda: transpiled_circuit.bind_parameters(parameters),
+        "statevector": lambda: Utilities.get_statevector(transpiled_circuit, parameters),
+        "reduction_dict": reduction_dict,
+        "reduction_array": reduction_array,
+        "classical_solutions": classical_solutions,
+        "find_optimal_angles": find_optimal_angles,
+    }
+
+
+def run_suite(sizes, depths, mixers, stages, repeat):
+    results = []
+    for N in sizes:
+        problem = synthetic_problem(N)
+        for p in depths:
+            for m in mixers:
+                runners = stage_runners(problem, p, m)
+                for stage in stages:
+                    times = timed(runners[stage], repeat)
+                    result = {"stage": stage, "N": N, "p": p, "m": m, "min": min(times), "median": statistics.median(times), "runs": times}
+                    print(f"{stage:>20} N={N:<3} p={p:<2} m={m:<2} min {result['min']:.4f} s  median {result['median']:.4f} s")
+                    results.append(result)
+    return results
+
+
+def metadata(args):
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "numpy": np.__version__,
+        "qiskit": qiskit.__version__,
+        "simulator": Utilities.simulator,
+        "repeat": args.repeat,
+    }
+
+
+def result_key(result):
+    return result["stage"], result["N"], result["p"], result["m"]
+
+
+def compare(results, baseline, threshold, min_seconds):
+    # Times below min_seconds are treated as min_seconds, so timer noise on
+    # very fast stages does not count as a regression.
+    reference = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    print(f"\n{'stage':>20} {'N':>3} {'p':>2} {'m':>2} {'baseline [s]':>13} {'current [s]':>12} {'ratio':>7}")
+    for result in results:
+        previous = reference.get(result_key(result))
+        if previous is None:
+            continue
+        ratio = max(result["min"], min_seconds) / max(previous["min"], min_seconds)
+        flag = "  SLOWER" if ratio > threshold else ""
+        print(f"{result['stage']:>20} {result['N']:>3} {result['p']:>2} {result['m']:>2} {previous['min']:>13.4f} {result['min']:>12.4f} {ratio:>6.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(result_key(result))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the QAOA pipeline on synthetic problems and compare against a baseline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 6])
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--mixers", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--simulator", default="aer", choices=["aer", "choice_space", "spectral"], help="Simulator used by the find_optimal_angles stage.")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=Path, help=f"Compare against results previously written with --output, such as {reference_baseline.name}.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio above which a stage counts as a regression.")
+    parser.add_argument("--min-seconds", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    Utilities.simulator = args.simulator
+    results = run_suite(args.sizes, args.depths, args.mixers, args.stages, args.repeat)
+    report = {"metadata": metadata(args), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"\n{len(regressions)} stage(s) slower than {args.threshold}x the baseline")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from common import synthetic_problem
+
+from backend_theoretical import Simulators, Utilities
+
+# Largest allowed deviation from double-precision statevector results. The
+# sampling tolerance is in units of the shot-noise standard deviation.
+TOLERANCES = {"statevector": 1e-12, "statevector_single": 1e-5, "matrix_product_state": 1e-6}
+SAMPLING_SIGMAS = 5
+
+
+def run_mode(name, circuit, problem, angles):
+    Simulators.mode = name
+    start = time.perf_counter()
+    probs = Utilities.get_choice_probabilities(circuit, problem, angles)
+    expectation = Utilities.get_expectation_value(circuit, problem, angles)
+    return probs, expectation, time.perf_counter() - start
+
+
+def compare(sizes, p, m, seed):
+    rng = np.random.default_rng(seed)
+    failures = []
+    print(f"{'N':>3} {'qubits':>6} {'mode':>21} {'max |dp|':>10} {'|dE|':>10} {'allowed':>10} {'estimate':>11} {'time [s]':>9}")
+    for N in sizes:
+        problem = synthetic_problem(N)
+        circuit = Utilities.prepare_circuit(problem, p, m)
+        angles = rng.uniform(0, np.pi, 2 * p)
+        num_qubits = circuit.circuit.num_qubits
+        reference, reference_expectation, __ = run_mode("statevector", circuit, problem, angles)
+        for name in Simulators.MODES:
+            probs, value, seconds = run_mode(name, circuit, problem, angles)
+            deviation = np.abs(probs - reference).max()
+            error = abs(value - reference_expectation)
+            if name == "sampling":
+                spread = np.sqrt(reference @ Utilities.value_vector(problem)**2 - reference_expectation**2)
+                allowed = SAMPLING_SIGMAS * spread / np.sqrt(Simulators.shots)
+                passed = error <= allowed
+            else:
+                allowed = TOLERANCES[name]
+                passed = deviation <= allowed and error <= allowed * max(1.0, sum(problem.values))
+            estimate = Simulators.format_bytes(Simulators.memory_estimate(name, num_qubits, N))
+            flag = "" if passed else "  FAIL"
+            print(f"{N:>3} {num_qubits:>6} {name:>21} {deviation:>10.2e} {error:>10.2e} {allowed:>10.2e} {estimate:>11} {seconds:>9.3f}{flag}")
+            if not passed:
+                failures.append((N, name))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every simulation mode agrees with the double-precision statevector on small problems.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 4, 5])
+    parser.add_argument("--p", type=int, default=1)
+    parser.add_argument("--m", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Simulators.seed = args.seed
+    failures = compare(args.sizes, args.p, args.m, args.seed)
+    if failures:
+        print(f"\n{len(failures)} mode(s) outside tolerance: {failures}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
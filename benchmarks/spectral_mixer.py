@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from common import synthetic_problem
+
+from scipy.linalg import expm
+from backend_theoretical import CompiledProblem
+from backend_theoretical.ChoiceSpace import ChoiceSpaceSimulator
+
+
+def reference_statevector(compiled, angles):
+    # Dense matrix exponentials, independent of the eigendecomposition.
+    H = compiled.generator_matrix()
+    psi = np.zeros(len(compiled.states), dtype=complex)
+    psi[compiled.initial_index] = 1
+    for gamma, beta in zip(angles[0::2], angles[1::2]):
+        psi = expm(-1j * beta * H) @ (np.exp(-1j * gamma * compiled.values) * psi)
+    return psi
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for __ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def compare(sizes, p, m, batch, seed):
+    rng = np.random.default_rng(seed)
+    failures = []
+    print(f"{'N':>3} {'states':>7} {'compile [s]':>12} {'load [s]':>9} {'walk [ms]':>10} {'spectral [ms]':>14} {'max |da|':>9} {'gradient':>9} {'walk - limit':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for N in sizes:
+            problem = synthetic_problem(N, weighted=True)
+            start = time.perf_counter()
+            compiled = CompiledProblem.CompiledProblem(problem)
+            compile_seconds = time.perf_counter() - start
+            path = os.path.join(directory, f"{N}.npz")
+            compiled.save(path)
+            load_seconds = timed(lambda: CompiledProblem.CompiledProblem.load(path, problem), 3)
+
+            angles_batch = rng.uniform(0, np.pi, size=(batch, 2 * p))
+            walk = ChoiceSpaceSimulator(problem, m)
+            walk_seconds = timed(lambda: walk.expectation_values(angles_batch), 3) / batch
+            spectral_seconds = timed(lambda: compiled.expectation_values(angles_batch), 3) / batch
+
+            angles = angles_batch[0]
+            reference = reference_statevector(compiled, angles)
+            deviation = np.abs(compiled.statevector(angles) - reference).max()
+            __, gradient = compiled.expectation_and_gradient(angles)
+            step = 1e-6
+            shifts = step * np.eye(len(angles))
+            numeric = (compiled.expectation_values(angles + shifts) - compiled.expectation_values(angles - shifts)) / (2 * step)
+            gradient_error = np.abs(gradient - numeric).max()
+            # How far the circuit's m walk steps are from their continuous limit.
+            trotter = np.abs(walk.statevector(angles) - compiled.statevector(angles)).max()
+
+            flag = "" if deviation < 1e-9 and gradient_error < 1e-6 else "  FAIL"
+            print(f"{N:>3} {len(compiled.states):>7} {compile_seconds:>12.3f} {load_seconds:>9.3f} {walk_seconds * 1e3:>10.3f} {spectral_seconds * 1e3:>14.3f} {deviation:>9.1e} {gradient_error:>9.1e} {trotter:>13.2e}{flag}")
+            if flag:
+                failures.append(N)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Setup, load and per-evaluation time of the compiled (spectral) mixer against the walk-step simulator, with checks against dense matrix exponentials.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[6, 8, 10, 12])
+    parser.add_argument("-p", type=int, default=2)
+    parser.add_argument("-m", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=64, help="Parameter sets per batched evaluation.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = compare(args.sizes, args.p, args.m, args.batch, args.seed)
+    if failures:
+        print(f"\nCompiled mixers differ from the matrix exponential for N = {failures}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+
+from common import synthetic_problem
+
+from backend_theoretical import Utilities
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold global angle searches per depth with depth-progressive warm starts.")
+    parser.add_argument("-N", type=int, default=6)
+    parser.add_argument("-m", type=int, default=5)
+    parser.add_argument("--max-p", type=int, default=4)
+    parser.add_argument("--method", default="shgo", choices=["shgo", "population"])
+    parser.add_argument("--simulator", default="choice_space", choices=["aer", "choice_space", "spectral"])
+    args = parser.parse_args()
+
+    Utilities.simulator = args.simulator
+    problem = synthetic_problem(args.N)
+    progressive = Utilities.find_angles_progressively(problem, args.max_p, args.m, method=args.method, seed=0)
+
+    print(f"{'p':>2} {'cold evals':>10} {'cold [s]':>9} {'cold E':>8} {'warm evals':>10} {'warm [s]':>9} {'warm E':>8}")
+    for warm in progressive:
+        p = warm["p"]
+        circuit = Utilities.prepare_circuit(problem, p, args.m)
+        cold = {}
+        angles = Utilities.find_optimal_angles(circuit, problem, method=args.method, seed=0, report=cold)
+        cold_value = Utilities.get_expectation_value(circuit, problem, angles)
+        print(f"{p:>2} {cold['evaluations']:>10} {cold['seconds']:>9.2f} {cold_value:>8.4f} "
+              f"{warm['evaluations']:>10} {warm['seconds']:>9.2f} {warm['expectation']:>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from backend_theoretical import ChoiceSpace, Utilities
+from backend_theoretical.ChoiceSpace import ChoiceSpaceCircuit, ChoiceSpaceSimulator, feasible_codes
+from backend_theoretical.KnapsackMethod import KnapsackProblem
+
+PROBLEMS = [
+    ([0.3, 0.9, 0.5], [1, 2, 4], 3),
+    ([0.3, 0.9, 0.5, 0.7], [3, 5, 2, 7], 12),
+    ([0.4, 0.2, 0.8, 0.6, 0.1], [2, 9, 4, 6, 1], 15),
+]
+
+
+def truly_feasible(weights, budget):
+    codes = np.arange(2**len(weights), dtype=np.int64)
+    return codes[ChoiceSpace.codes_weight(codes, weights) <= budget]
+
+
+@pytest.mark.parametrize("values, weights, largest", PROBLEMS)
+def test_sweep_marks_the_same_choices_as_each_budget(values, weights, largest):
+    circuit = ChoiceSpaceCircuit(KnapsackProblem(values, weights, largest), 1, 1, budget_sweep=True)
+    for budget in range(1, largest + 1):
+        problem = KnapsackProblem(values, weights, budget)
+        view = Utilities.budget_circuit(circuit, budget)
+        sweep = feasible_codes(problem, view.oracle_layout)
+        assert np.array_equal(sweep, truly_feasible(weights, budget))
+        assert np.array_equal(sweep, feasible_codes(problem))
+
+
+@pytest.mark.parametrize("values, weights, largest", PROBLEMS)
+def test_sweep_walk_matches_each_budget(values, weights, largest):
+    circuit = ChoiceSpaceCircuit(KnapsackProblem(values, weights, largest), 2, 2, budget_sweep=True)
+    angles = [0.4, 1.1, 0.9, 2.3]
+    for budget in range(1, largest + 1):
+        problem = KnapsackProblem(values, weights, budget)
+        sweep = ChoiceSpaceSimulator(problem, 2, layout=circuit.oracle_layout)
+        own = ChoiceSpaceSimulator(problem, 2)
+        assert sweep.expectation_value(angles) == pytest.approx(own.expectation_value(angles))
+
+
+def test_sweep_register_holds_the_largest_offset():
+    n, c = ChoiceSpace.sweep_register_layout(KnapsackProblem([0.3, 0.9, 0.5], [1, 2, 4], 3))
+    assert 7 + 2**c - 1 < 2**n
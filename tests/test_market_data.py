@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend_theoretical import MarketData
+
+TICKERS = ["AAPL", "MSFT", "GOOGL", "AMZN"]
+
+
+class CountingFetcher:
+    # Wraps a fetcher, counting its calls and failing the first `failures`
+    # price requests the way YahooFetcher does when a download fails.
+    def __init__(self, fetcher, failures=0):
+        self.fetcher = fetcher
+        self.failures = failures
+        self.calls = 0
+        self.name_calls = 0
+
+    def prices(self, ticker, start, end):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise MarketData.FetchError(f"{ticker}: simulated download failure")
+        return self.fetcher.prices(ticker, start, end)
+
+    def company_name(self, ticker):
+        self.name_calls += 1
+        return self.fetcher.company_name(ticker)
+
+
+@pytest.fixture
+def fixtures(tmp_path):
+    # CSV fixtures for FixtureFetcher, written from the synthetic series.
+    directory = tmp_path / "fixtures"
+    directory.mkdir()
+    synthetic = MarketData.SyntheticFetcher()
+    for ticker in TICKERS:
+        synthetic.prices(ticker, pd.Timestamp("2022-01-01"), pd.Timestamp("2024-01-01")).to_csv(directory / f"{ticker}.csv")
+    (directory / "names.json").write_text(json.dumps({ticker: f"{ticker} Inc." for ticker in TICKERS}))
+    return MarketData.FixtureFetcher(str(directory))
+
+
+@pytest.fixture
+def fetcher(fixtures):
+    return CountingFetcher(fixtures)
+
+
+@pytest.fixture
+def store(tmp_path, fetcher):
+    return MarketData.PriceStore(str(tmp_path / "store"), fetcher)
+
+
+def expected_prices(fixtures, tickers, start, end):
+    return pd.DataFrame({ticker: fixtures.prices(ticker, pd.Timestamp(start), pd.Timestamp(end))["Adj Close"] for ticker in tickers})
+
+
+def test_first_request_fetches_every_ticker_once(store, fetcher, fixtures):
+    prices = store.prices(TICKERS, "2022-03-01", "2022-09-01")
+    assert np.allclose(prices, expected_prices(fixtures, TICKERS, "2022-03-01", "2022-09-01"))
+    assert fetcher.calls == len(TICKERS)
+
+
+def test_overlapping_request_fetches_only_the_missing_part(store, fetcher, fixtures):
+    store.prices(TICKERS, "2022-03-01", "2022-09-01")
+    fetcher.calls = 0
+    prices = store.prices(TICKERS, "2022-06-01", "2022-12-01")
+    assert fetcher.calls == len(TICKERS)
+    assert np.allclose(prices, expected_prices(fixtures, TICKERS, "2022-06-01", "2022-12-01"))
+
+
+def test_covered_request_is_served_from_disk(store, fetcher, fixtures):
+    store.prices(TICKERS, "2022-03-01", "2022-12-01")
+    fetcher.calls = 0
+    prices = store.prices(TICKERS, "2022-04-01", "2022-11-01")
+    assert fetcher.calls == 0
+    assert np.allclose(prices, expected_prices(fixtures, TICKERS, "2022-04-01", "2022-11-01"))
+
+
+def test_failed_download_is_fetched_again(store, fetcher, fixtures):
+    # A failed download must not leave a hole that is later served as empty.
+    store.prices(TICKERS[:1], "2022-03-01", "2022-09-01")
+    fetcher.failures = 1
+    assert store.prices(TICKERS[:1], "2023-01-01", "2023-03-01").empty
+    fetcher.calls = 0
+    prices = store.prices(TICKERS[:1], "2023-01-01", "2023-03-01")
+    assert fetcher.calls == 1
+    assert np.allclose(prices, expected_prices(fixtures, TICKERS[:1], "2023-01-01", "2023-03-01"))
+
+
+def test_company_names_are_cached(tmp_path, store, fetcher):
+    names = [store.company_name(ticker) for ticker in TICKERS]
+    reopened = MarketData.PriceStore(str(tmp_path / "store"), fetcher)
+    assert [reopened.company_name(ticker) for ticker in TICKERS] == names == [f"{ticker} Inc." for ticker in TICKERS]
+    assert fetcher.name_calls == len(TICKERS)
+
+
+def test_unknown_tickers_are_dropped(store):
+    assert list(store.prices(["UNKNOWN"], "2022-01-01", "2022-02-01").columns) == []
+
+
+def test_empty_download_raises_fetch_error(monkeypatch):
+    # yf.download returns an empty frame instead of raising when it fails.
+    yf = pytest.importorskip("yfinance")
+    monkeypatch.setattr(yf, "download", lambda *args, **kwargs: pd.DataFrame())
+    with pytest.raises(MarketData.FetchError):
+        MarketData.YahooFetcher().prices("AAPL", pd.Timestamp("2023-01-02"), pd.Timestamp("2023-01-10"))
+    # A range without business days is legitimately empty.
+    assert MarketData.YahooFetcher().prices("AAPL", pd.Timestamp("2023-01-07"), pd.Timestamp("2023-01-09")).empty